@@ -1,31 +1,56 @@
+import json
+import re
 from ast import literal_eval
+from itertools import islice
 from pathlib import Path
 
-import sqlalchemy as sa
 from flask import (
     Flask,
+    Response,
+    abort,
+    jsonify,
     redirect,
     render_template,
     request,
+    send_file,
     send_from_directory,
+    stream_with_context,
     url_for,
 )
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import select
+from sqlalchemy import event, select
 
-from db_utils import consolidate_files_db
-from models import File
+from db_utils import (
+    consolidate_files_db,
+    consolidate_groups_db,
+    consolidation_journal_path,
+    iter_duplicate_groups,
+    iter_near_duplicates,
+    set_sqlite_pragmas,
+)
+from models import DuplicateGroup, File, NearDuplicate
+from thumbnails import THUMBNAIL_SIZES, get_cache_dir, get_thumbnail, thumbnail_path
 from utils import consolidate_files, load_config
 
 
 class Config:
     _, DBFILE = load_config("mediatool.ini")
     SQLALCHEMY_DATABASE_URI = f"sqlite+pysqlite:///{DBFILE}"
+    # Duplicate groups shown per /dupes page, unless overridden with ?per_page=
+    DUPES_PER_PAGE = 10
+    DUPES_MAX_PER_PAGE = 100
+    # Most groups a /dupes.json request may ask for with ?limit=, without it every group is streamed.
+    DUPES_JSON_MAX_LIMIT = 100_000
+    THUMBNAIL_DIR = get_cache_dir("mediatool.ini")
+    # Files waiting to be unlinked by a bulk consolidation, replayed by the next one if it was interrupted.
+    CONSOLIDATE_JOURNAL = consolidation_journal_path(DBFILE)
 
 
 app = Flask(__name__)
 app.config.from_object(Config)
 db = SQLAlchemy(app)
+with app.app_context():
+    event.listen(db.engine, "connect", set_sqlite_pragmas)
 
 
 @app.route("/pics/<path:filename>")
@@ -33,57 +58,204 @@ def pics(filename):
     return send_from_directory("/", filename, as_attachment=False)
 
 
-@app.route("/dupes")
-def view_duplicates(page_number=1):
-    page = request.args.get("page", page_number, type=int)
-    query = (
-        sa.select(File.sha256, sa.func.count(File.sha256).label("qty"))
-        .group_by(File.sha256)
-        .having(sa.func.count(File.sha256) > 1)
-    )
+def duplicates_per_page() -> int:
+    per_page = request.args.get("per_page", app.config["DUPES_PER_PAGE"], type=int)
+    return min(max(per_page, 1), app.config["DUPES_MAX_PER_PAGE"])
+
 
-    duplicate_checksums = db.paginate(query, page=page, per_page=1, error_out=False)
+# Hex digests of the hash algorithms, 32 characters for xxh3_128 and 64 for the others.
+CHECKSUM_PATTERN = re.compile(r"[0-9a-f]{32}|[0-9a-f]{64}")
 
-    if page > duplicate_checksums.total:
-        page = duplicate_checksums.total
-        return redirect(url_for(request.endpoint, page=page))
-    elif page < 1:
-        page = 1
-        return redirect(url_for(request.endpoint, page=page))
 
-    # Since we paginate 1 item per "page", we only care about that first item.
-    checksum = list(duplicate_checksums)[0]
+@app.route("/thumbs/<checksum>/<int:size>")
+def thumbs(checksum, size):
+    # Anything else never reaches the cache directory.
+    if size not in THUMBNAIL_SIZES or not CHECKSUM_PATTERN.fullmatch(checksum):
+        abort(404)
+    # The checksum fixes the contents of the thumbnail, so the ETag can be strong and the response cached for good.
+    etag = f"{checksum}-{size}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        cache_dir = app.config["THUMBNAIL_DIR"]
+        thumbnail = thumbnail_path(cache_dir, checksum, size)
+        if not thumbnail.is_file():
+            source = db.session.scalar(select(File.name).where(File.sha256 == checksum).limit(1))
+            if source is None:
+                abort(404)
+            try:
+                thumbnail = get_thumbnail(cache_dir, checksum, source, size)
+            except OSError:
+                abort(404)
+        response = send_file(thumbnail, mimetype="image/jpeg", conditional=False, etag=False)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+    return response
 
-    statement = select(File).filter_by(sha256=checksum)
-    duplicates_of_checksum = [
-        Path(dupe_set.name) for dupe_set in [row.File for row in db.session.execute(statement).all()]
-    ]
 
-    prev_url = url_for("view_duplicates", page=duplicate_checksums.prev_num) if duplicate_checksums.has_prev else None
-    next_url = url_for("view_duplicates", page=duplicate_checksums.next_num) if duplicate_checksums.has_next else None
+@app.route("/dupes")
+def view_duplicates():
+    # Pages are addressed by the checksum they start after instead of an offset, so every page is an index lookup.
+    after = request.args.get("after", "")
+    per_page = duplicates_per_page()
+
+    groups = list(islice(iter_duplicate_groups(db.session, after, batch_size=per_page), per_page))
+    if not groups and after:
+        return redirect(url_for(request.endpoint, per_page=per_page))
 
-    all_files = [str(file) for file in duplicates_of_checksum]
+    next_url = None
+    if groups:
+        last_checksum = groups[-1][0].sha256
+        if db.session.scalar(select(DuplicateGroup.sha256).where(DuplicateGroup.sha256 > last_checksum).limit(1)):
+            next_url = url_for("view_duplicates", after=last_checksum, per_page=per_page)
+    prev_url = None
+    if after:
+        # The previous page starts after the checksum per_page groups before this one, or at the beginning.
+        previous = db.session.scalars(
+            select(DuplicateGroup.sha256)
+            .where(DuplicateGroup.sha256 < after)
+            .order_by(DuplicateGroup.sha256.desc())
+            .offset(per_page - 1)
+            .limit(1)
+        ).first()
+        prev_url = url_for("view_duplicates", after=previous or "", per_page=per_page)
+
+    duplicate_groups = [(group, [Path(file.name) for file in files]) for group, files in groups]
 
     return render_template(
         "duplicates.html",
-        duplicates_of_checksum=duplicates_of_checksum,
+        duplicate_groups=duplicate_groups,
+        next_url=next_url,
+        prev_url=prev_url,
+        after=after,
+        per_page=per_page,
+    )
+
+
+@app.route("/near")
+def view_near_duplicates():
+    """Page through the clusters of images which look alike, built by dupefinder.py --near."""
+    after = request.args.get("after", 0, type=int)
+    per_page = duplicates_per_page()
+
+    clusters = list(islice(iter_near_duplicates(db.session, after, batch_size=per_page), per_page))
+    if not clusters and after:
+        return redirect(url_for(request.endpoint, per_page=per_page))
+
+    next_url = None
+    if clusters:
+        last_cluster = clusters[-1][0]
+        if db.session.scalar(select(NearDuplicate.cluster_id).where(NearDuplicate.cluster_id > last_cluster).limit(1)):
+            next_url = url_for("view_near_duplicates", after=last_cluster, per_page=per_page)
+    prev_url = None
+    if after:
+        previous = db.session.scalars(
+            select(NearDuplicate.cluster_id)
+            .where(NearDuplicate.cluster_id < after)
+            .group_by(NearDuplicate.cluster_id)
+            .order_by(NearDuplicate.cluster_id.desc())
+            .offset(per_page - 1)
+            .limit(1)
+        ).first()
+        prev_url = url_for("view_near_duplicates", after=previous or 0, per_page=per_page)
+
+    return render_template(
+        "near_duplicates.html",
+        clusters=clusters,
         next_url=next_url,
         prev_url=prev_url,
-        checksum=checksum,
-        current=duplicate_checksums.page,
-        total=duplicate_checksums.total,
-        all_files=all_files,
+        after=after,
+        per_page=per_page,
     )
 
 
+@app.route("/dupes.json")
+def stream_duplicates():
+    """Stream duplicate groups as JSON lines, one group per line.
+
+    Query parameters: after, the checksum to resume after, and limit, the maximum number of groups, at most
+    DUPES_JSON_MAX_LIMIT. Groups are read from the database in batches while the response is sent, so clients can
+    work through every group in one request or resume from the last checksum they processed.
+    """
+    after = request.args.get("after", "")
+    limit = request.args.get("limit", None, type=int)
+    if limit is None and "limit" in request.args:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit is not None:
+        limit = min(max(limit, 1), app.config["DUPES_JSON_MAX_LIMIT"])
+
+    def generate():
+        for group, files in islice(iter_duplicate_groups(db.session, after), limit):
+            record = {
+                "sha256": group.sha256,
+                "count": group.count,
+                "total_bytes": group.total_bytes,
+                "files": [file.name for file in files],
+            }
+            yield json.dumps(record) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @app.route("/consolidate", methods=["POST"])
 def consolidate():
     rq = request.form
-    page = int(rq.get("page", "None"))
+    after = rq.get("after", "")
+    per_page = rq.get("per_page", None, type=int)
     file_to_keep = Path(rq.get("keep_file", "None"))
     all_files = [Path(file) for file in literal_eval(rq.get("all_files", "None"))]
 
+    # The page to return to, the exact duplicates unless the near duplicates were reviewed.
+    view = "view_near_duplicates" if rq.get("view") == "near" else "view_duplicates"
+
     consolidate_files(all_files, file_to_keep)
     consolidate_files_db(db.session, all_files, file_to_keep)
     # return f"We kept {file_to_keep}<br><br>All files {all_files}"
-    return redirect(url_for("view_duplicates", page=page))
+    return redirect(url_for(view, after=after, per_page=per_page))
+
+
+def json_decisions(body) -> tuple[list[tuple[str, str]], bool]:
+    """The (sha256, keep) decisions and the dry_run flag of a JSON body of /consolidate/bulk.
+
+    Raises:
+        ValueError: If the body is not an object with a list of decisions, each with a sha256 and a keep string, and
+            an optional boolean dry_run
+    """
+    if not isinstance(body, dict) or not isinstance(body.get("decisions", []), list):
+        raise ValueError('The body must be an object with a list of "decisions".')
+    # A string such as "false" would be truthy, so only JSON booleans are accepted.
+    dry_run = body.get("dry_run", False)
+    if not isinstance(dry_run, bool):
+        raise ValueError('"dry_run" must be true or false.')
+    decisions = []
+    for index, decision in enumerate(body.get("decisions", [])):
+        if not isinstance(decision, dict) or not all(isinstance(decision.get(key), str) for key in ("sha256", "keep")):
+            raise ValueError(f'Decision {index} must be an object with a "sha256" and a "keep" string.')
+        decisions.append((decision["sha256"], decision["keep"]))
+    return decisions, dry_run
+
+
+@app.route("/consolidate/bulk", methods=["POST"])
+def consolidate_bulk():
+    """Consolidate many duplicate groups in one request.
+
+    Takes either a JSON body {"decisions": [{"sha256": ..., "keep": ...}, ...], "dry_run": false}, answered with the
+    ConsolidationResult as JSON, or the form of the /dupes page with a keep:<sha256> field per group, which redirects
+    back to the page. A malformed JSON body is answered with 400 and an error message.
+    """
+    journal = app.config["CONSOLIDATE_JOURNAL"]
+    body = request.get_json(silent=True)
+    if body is not None:
+        try:
+            decisions, dry_run = json_decisions(body)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        result = consolidate_groups_db(db.session, decisions, journal, dry_run=dry_run)
+        return jsonify(result._asdict())
+
+    rq = request.form
+    decisions = [(key.removeprefix("keep:"), keep) for key, keep in rq.items() if key.startswith("keep:")]
+    consolidate_groups_db(db.session, decisions, journal)
+    return redirect(url_for("view_duplicates", after=rq.get("after", ""), per_page=rq.get("per_page", None, type=int)))
@@ -0,0 +1,74 @@
+"""Speed of datestring_to_date against the implementation it replaced.
+
+Run from the repository root:
+
+    python3 -m benchmarks.bench_datestring
+"""
+
+import random
+import re
+import timeit
+from datetime import datetime
+
+import click
+
+from utils import datestring_to_date
+
+
+def legacy_datestring_to_date(datestring: str):
+    # The implementation datestring_to_date had before it was compiled into a single pattern.
+    if datestring == "" or "0000" in datestring:
+        return None
+
+    PATTERNS = [
+        {"regex": r"([0-9]{4})-([0-9]{2})-([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})$", "format": "%Y-%m-%d %H:%M:%S"},
+        {"regex": r"([0-9]{4}):([0-9]{2}):([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})$", "format": "%Y:%m:%d %H:%M:%S"},
+        {
+            "regex": r"([0-9]{4})-([0-9]{2})-([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})\.([0-9]{0,6})$",
+            "format": "%Y-%m-%d %H:%M:%S.%f",
+        },
+        {
+            "regex": r"([0-9]{4}):([0-9]{2}):([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})\.([0-9]{0,6})$",
+            "format": "%Y:%m:%d %H:%M:%S.%f",
+        },
+    ]
+
+    for pattern in PATTERNS:
+        if re.match(pattern["regex"], datestring):
+            return datetime.strptime(datestring, pattern["format"])
+
+    raise ValueError(f"Unknown datetime format for {datestring}")
+
+
+def sample_datestrings(count: int, burst: int) -> list[str]:
+    # Cameras shooting bursts produce runs of photos sharing a timestamp.
+    random.seed(0)
+    datestrings = []
+    while len(datestrings) < count:
+        datestring = (
+            f"{random.randint(1990, 2024)}:{random.randint(1, 12):02}:{random.randint(1, 28):02} "
+            f"{random.randint(0, 23):02}:{random.randint(0, 59):02}:{random.randint(0, 59):02}"
+        )
+        datestrings.extend([datestring] * random.randint(1, 2 * burst - 1))
+    return datestrings[:count]
+
+
+@click.command()
+@click.option("--count", default=100_000, show_default=True, help="Number of timestamps converted per run.")
+@click.option("--burst", default=5, show_default=True, help="Average number of consecutive identical timestamps.")
+def main(count, burst):
+    datestrings = sample_datestrings(count, burst)
+    uncached = datestring_to_date.__wrapped__
+
+    timings = {
+        "legacy": lambda: [legacy_datestring_to_date(datestring) for datestring in datestrings],
+        "single pattern": lambda: [uncached(datestring) for datestring in datestrings],
+        "single pattern, cached": lambda: [datestring_to_date(datestring) for datestring in datestrings],
+    }
+    for name, function in timings.items():
+        seconds = min(timeit.repeat(function, setup=datestring_to_date.cache_clear, number=1, repeat=3))
+        print(f"{name:<24} {seconds * 1e6 / count:6.2f} µs per timestamp")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Timings of the duplicate queries without the SQLite pragmas and file indexes, with them, and reading the
+materialized duplicate_group table.
+
+Run from the repository root:
+
+    python3 -m benchmarks.bench_duplicate_queries --files 1000000
+"""
+
+import random
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import click
+import sqlalchemy as sa
+from sqlalchemy import create_engine, insert, select, text
+from sqlalchemy.orm import Session
+
+from db_utils import get_engine, rebuild_duplicate_groups
+from dupefinder import find_duplicate_checksums
+from models import Base, DuplicateGroup, File
+from roots import RootConfig, assign_directories, sync_roots
+
+# Groups per page, the default of the /dupes view.
+PER_PAGE = 10
+
+
+def fill(engine, files: int, duplicate_ratio: float):
+    random.seed(0)
+    unique = int(files * (1 - duplicate_ratio))
+    with Session(engine) as session:
+        [root] = sync_roots(session, [RootConfig(Path("/media"))])
+        batch = []
+        for number in range(files):
+            checksum = number if number < unique else random.randrange(unique)
+            path = f"{number // 1000}/{number}.jpg"
+            batch.append({"root_id": root.id, "path": path, "size": checksum, "sha256": f"{checksum:064x}"})
+            if len(batch) == 10_000 or number == files - 1:
+                session.execute(insert(File), assign_directories(session, batch))
+                batch.clear()
+        session.commit()
+
+
+def grouped_query():
+    # The query behind the /dupes view before the duplicate_group table.
+    return (
+        sa.select(File.sha256, sa.func.count(File.sha256).label("qty"))
+        .where(File.sha256.is_not(None))
+        .group_by(File.sha256)
+        .having(sa.func.count(File.sha256) > 1)
+    )
+
+
+def measure(engine, use_groups: bool) -> dict:
+    timings = {}
+    query = select(DuplicateGroup).order_by(DuplicateGroup.sha256) if use_groups else grouped_query()
+    checksum_column = DuplicateGroup.sha256 if use_groups else File.sha256
+    with Session(engine) as session:
+        start = time.perf_counter()
+        if use_groups:
+            checksums = list(find_duplicate_checksums(session))
+        else:
+            checksums = [row.sha256 for row in session.execute(query)]
+        timings["find_duplicate_checksums"] = time.perf_counter() - start
+
+        # A page halfway through, addressed by the checksum it starts after like the /dupes view does.
+        start = time.perf_counter()
+        session.execute(
+            query.where(checksum_column > checksums[len(checksums) // 2]).order_by(checksum_column).limit(PER_PAGE)
+        ).all()
+        timings["/dupes page (keyset)"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for checksum in checksums[:1000]:
+            session.execute(select(File).filter_by(sha256=checksum)).all()
+        timings["files of 1000 checksums"] = time.perf_counter() - start
+    return timings
+
+
+@click.command()
+@click.option("--files", default=1_000_000, show_default=True, help="Number of catalogued files.")
+@click.option("--duplicate-ratio", default=0.05, show_default=True, help="Fraction of files duplicating another.")
+def main(files, duplicate_ratio):
+    with TemporaryDirectory() as temp_dir:
+        before = create_engine(f"sqlite+pysqlite:///{Path(temp_dir).joinpath('before.db')}")
+        Base.metadata.create_all(before)
+        with before.begin() as connection:
+            for index in File.__table__.indexes:
+                connection.execute(text(f"DROP INDEX {index.name}"))
+        indexed = get_engine(Path(temp_dir).joinpath("indexed.db"))
+        Base.metadata.create_all(indexed)
+
+        results = {}
+        for label, engine in (("before", before), ("indexed", indexed)):
+            fill(engine, files, duplicate_ratio)
+            engine.dispose()
+            results[label] = measure(engine, use_groups=False)
+        with Session(indexed) as session:
+            rebuild_duplicate_groups(session)
+        indexed.dispose()
+        results["groups"] = measure(indexed, use_groups=True)
+
+        print(f"{'query':<32} " + " ".join(f"{label:>9}" for label in results))
+        for query in results["before"]:
+            print(f"{query:<32} " + " ".join(f"{timings[query]:>8.3f}s" for timings in results.values()))
+
+
+if __name__ == "__main__":
+    main()
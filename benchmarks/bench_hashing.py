@@ -0,0 +1,67 @@
+"""Throughput of the file hash algorithms and buffer sizes, in MB/s.
+
+Run from the repository root:
+
+    python3 -m benchmarks.bench_hashing --size-mb 512
+"""
+
+import hashlib
+import os
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import click
+
+from hashing import available_algorithms, hash_file
+
+
+def legacy_sha256(filename):
+    # The implementation get_sha256 had before hashing.hash_file, kept as the baseline.
+    with open(filename, "rb") as f:
+        file_hash = hashlib.sha256()
+        chunk = f.read(8192)
+        while chunk:
+            file_hash.update(chunk)
+            chunk = f.read(8192)
+    return file_hash.hexdigest()
+
+
+def throughput(function, path: Path, repeat: int) -> float:
+    size_mb = path.stat().st_size / 1_000_000
+    best = min(timed(function, path) for _ in range(repeat))
+    return size_mb / best
+
+
+def timed(function, path: Path) -> float:
+    start = time.perf_counter()
+    function(path)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--size-mb", default=256, show_default=True, help="Size of the generated test file.")
+@click.option("--repeat", default=3, show_default=True, help="Runs per measurement; the best one is reported.")
+@click.argument("path", required=False, type=click.Path(exists=True, dir_okay=False, path_type=Path))
+def main(size_mb, repeat, path):
+    """Hash PATH, or a generated file of random bytes, with every available algorithm."""
+    with TemporaryDirectory() as temp_dir:
+        if not path:
+            path = Path(temp_dir).joinpath("bench.bin")
+            with open(path, "wb") as f:
+                for _ in range(size_mb):
+                    f.write(os.urandom(1_000_000))
+
+        # The first read warms the page cache so every measurement reads from memory.
+        legacy_sha256(path)
+        print(f"{'algorithm':<10} {'buffer':>8} {'MB/s':>8}")
+        print(f"{'sha256':<10} {'8 KiB*':>8} {throughput(legacy_sha256, path, repeat):>8.0f}")
+        for algorithm in available_algorithms():
+            for buffer_kib in (64, 1024, 4096):
+                function = lambda file: hash_file(file, algorithm, buffer_kib * 1024)  # noqa: E731
+                print(f"{algorithm:<10} {f'{buffer_kib} KiB':>8} {throughput(function, path, repeat):>8.0f}")
+        print("* previous get_sha256 implementation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Timings of clustering perceptual hashes with and without numpy, like dupefinder.py --near.
+
+Run from the repository root:
+
+    python3 -m benchmarks.bench_perceptual --images 1000000
+"""
+
+import random
+import time
+
+import click
+
+import perceptual
+from perceptual import DEFAULT_THRESHOLD, cluster_hashes
+
+
+def generate_hashes(images: int, near_ratio: float) -> list[tuple[int, int]]:
+    # Unrelated images get random hashes, resized or recompressed copies differ from one of them in a few bits.
+    random.seed(0)
+    hashes = []
+    unique = int(images * (1 - near_ratio))
+    for number in range(images):
+        if number < unique:
+            value = random.getrandbits(64)
+        else:
+            value = hashes[random.randrange(unique)][1]
+            for bit in random.sample(range(64), random.randint(0, DEFAULT_THRESHOLD // 2)):
+                value ^= 1 << bit
+        hashes.append((number, value))
+    return hashes
+
+
+def timed_clustering(hashes, threshold: int, use_numpy: bool) -> tuple[float, int]:
+    numpy = perceptual.np
+    if not use_numpy:
+        perceptual.np = None
+    try:
+        start = time.perf_counter()
+        clusters = cluster_hashes(hashes, threshold)
+        return time.perf_counter() - start, len(clusters)
+    finally:
+        perceptual.np = numpy
+
+
+@click.command()
+@click.option("--images", default=100_000, show_default=True, help="Number of hashed images.")
+@click.option("--near-ratio", default=0.05, show_default=True, help="Fraction of images near duplicating another.")
+@click.option("--threshold", default=DEFAULT_THRESHOLD, show_default=True, help="Hamming distance of near duplicates.")
+@click.option("--skip-pure-python", is_flag=True, help="Only time clustering with numpy.")
+def main(images, near_ratio, threshold, skip_pure_python):
+    hashes = generate_hashes(images, near_ratio)
+    modes = ([True] if perceptual.np is not None else []) + ([] if skip_pure_python else [False])
+    if not modes:
+        raise click.UsageError("Install numpy or leave out --skip-pure-python.")
+    print(f"{'clustering':<12} {'clusters':>9} {'time':>9}")
+    for use_numpy in modes:
+        elapsed, clusters = timed_clustering(hashes, threshold, use_numpy)
+        print(f"{'numpy' if use_numpy else 'pure Python':<12} {clusters:>9} {elapsed:>8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,40 @@
 import logging
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
+from functools import partial
 from pathlib import Path
+from typing import NamedTuple
 
-from sqlalchemy import create_engine
+import click
+from more_itertools import chunked
+from sqlalchemy import and_, delete, func, insert, or_, select, update
 from sqlalchemy.orm import Session
 
+from db_utils import SQLITE_BATCH_SIZE, get_engine, refresh_duplicate_groups
+from hashing import DEFAULT_ALGORITHM, available_algorithms, hash_file
 from logging_setup import logging_setup
-from models import Base, File
-from utils import get_datestamp, get_media_type, get_sha256, is_image, load_config
+from models import Base, Directory, File, Root
+from perceptual import available_hashes, hash_images
+from roots import (
+    RootConfig,
+    assign_directories,
+    load_roots,
+    prune_directories,
+    sync_roots,
+)
+from utils import (
+    MediaType,
+    get_datestamp,
+    get_media_type,
+    get_partial_hash,
+    is_image,
+    load_config,
+    probe_file,
+)
 
 logging_setup()
 logger = logging.getLogger(__name__)
@@ -17,61 +45,574 @@ if debug:
     logger.setLevel(logging.DEBUG)
 
 
-def fill_database(session: Session, dir: Path, commit_every=20):
-    logger.debug(f"Beginning investigation of {dir}")
-    # all_files = [file for file in dir.rglob("*") if file.is_file()]
-    # print("Got all_files")
-    existing_paths = [path.name for path in session.query(File.name).all()]
+def stat_signature(stat_result: os.stat_result) -> dict:
+    """Stat signature of a file
 
-    # for file in all_files:
-    counter = 0
+    Args:
+        stat_result (os.stat_result): The result of stat() on the file
+
+    Returns:
+        dict: The File columns which together tell whether the file changed since it was last inspected.
+    """
+    return {
+        "size": stat_result.st_size,
+        "mtime_ns": stat_result.st_mtime_ns,
+        "ctime_ns": stat_result.st_ctime_ns,
+        "inode": stat_result.st_ino,
+        "device": stat_result.st_dev,
+    }
+
+
+def signature_changed(record, signature: dict) -> bool:
+    # ctime is recorded but deliberately not compared; it also moves on chmod/chown which do not alter content.
+    return any(getattr(record, column) != signature[column] for column in ("size", "mtime_ns", "inode", "device"))
+
+
+class ScanTarget(NamedTuple):
+    """A root being scanned, with what its scanning thread needs to know about it outside of the session."""
+
+    root_id: int
+    name: str
+    path: str
+    # Number of workers inspecting files of the root.
+    workers: int
+    # Rows of the catalogued files of the root from load_existing_files, by directory and basename.
+    existing_files: dict
+    # Names of the files walked.
+    seen_paths: set
+
+
+def prune_missing_files(session: Session, missing_ids: list[int]) -> int:
+    for batch in chunked(missing_ids, SQLITE_BATCH_SIZE):
+        checksums = session.scalars(delete(File).where(File.id.in_(batch)).returning(File.sha256)).all()
+        refresh_duplicate_groups(session, checksums)
+    session.commit()
+    return len(missing_ids)
+
+
+def inspect_file(
+    pathname: str,
+    datestamp_only: bool = False,
+    staged: bool = False,
+    hash_algorithm: str = DEFAULT_ALGORITHM,
+    sniff: bool = False,
+) -> dict:
+    """Gather the File columns of a single file.
+
+    This runs in the worker pool of fill_database so it must not touch the database session.
+
+    Args:
+        pathname (str): The path of the file
+        datestamp_only (bool, optional): Only read the datestamp, which is omitted if the image has none. Defaults to False.
+        staged (bool, optional): Leave the checksums to hash_size_collisions. Defaults to False.
+        hash_algorithm (str, optional): The algorithm of the checksum. Defaults to DEFAULT_ALGORITHM.
+        sniff (bool, optional): Recognize the media type from the content of the file. Defaults to False.
+
+    Returns:
+        dict: The File columns and their values
+    """
+    if datestamp_only:
+        datestamp = probe_file(pathname, compute_hash=False, sniff=True).datestamp if sniff else get_datestamp(pathname)
+        return {"datestamp": datestamp} if datestamp else {}
+
+    probe = probe_file(pathname, hash_algorithm, compute_hash=not staged, sniff=sniff)
+    values = stat_signature(probe.stat)
+    values["sha256"] = probe.digest
+    values["hash_algorithm"] = None if staged else hash_algorithm
+    values["partial_hash"] = None
+    values["filetype"] = probe.filetype
+    values["datestamp"] = probe.datestamp
+    # The content may have changed, hash_perceptual computes them again.
+    values["dhash"] = None
+    values["phash"] = None
+    values["perceptual_error"] = None
+    return values
+
+
+def inspect_in_pool(work, inspect=inspect_file, workers=0, queue_depth=64, use_processes=False):
+    """Run the inspection jobs of planned work, yielding the results in the order the work was planned.
+
+    Args:
+        work (Iterable): Tuples of (pathname, row, values, job) where job is None or the arguments of inspect
+        inspect (Callable, optional): inspect_file or a partial of it binding the scan options. Defaults to inspect_file.
+        workers (int, optional): Size of the worker pool. 0 inspects the files serially. Defaults to 0.
+        queue_depth (int, optional): Maximum number of files planned ahead of the writer. Defaults to 64.
+        use_processes (bool, optional): Use worker processes instead of threads. Defaults to False.
+
+    Yields:
+        tuple: (pathname, row, values) where values includes the inspection results
+    """
+    if workers == 0:
+        for pathname, row, values, job in work:
+            if job:
+                values.update(inspect(*job))
+            yield pathname, row, values
+        return
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        pending = deque()
+        for pathname, row, values, job in work:
+            future = executor.submit(inspect, *job) if job else None
+            pending.append((pathname, row, values, future))
+            while len(pending) >= queue_depth:
+                yield _resolve(pending.popleft())
+        while pending:
+            yield _resolve(pending.popleft())
+
+
+def _resolve(item):
+    pathname, row, values, future = item
+    if future:
+        values.update(future.result())
+    return pathname, row, values
+
+
+# What plan_file needs to know about a catalogued file.
+EXISTING_FILE_COLUMNS = [
+    File.id,
+    File.size,
+    File.mtime_ns,
+    File.inode,
+    File.device,
+    File.filetype.is_not(None).label("has_filetype"),
+    File.datestamp.is_not(None).label("has_datestamp"),
+    File.sha256,
+    File.hash_algorithm,
+]
+
+
+def load_existing_files(session: Session, root: Root) -> dict:
+    """Load what the scan needs to know about every catalogued file of a root in a single query.
+
+    The rows are grouped by directory, so the walk looks up each directory once and its files by basename, and the
+    path of a directory is kept once however many files it has.
+
+    Args:
+        session (Session): The database session
+        root (Root): The root
+
+    Returns:
+        dict: Rows of (id, size, mtime_ns, inode, device, has_filetype, has_datestamp, sha256, hash_algorithm)
+            keyed by basename, in dicts keyed by the absolute path of their directory ending with a separator
+    """
+    statement = select(Directory.path.label("directory"), File.basename, *EXISTING_FILE_COLUMNS).join(File.directory)
+    existing_files = {}
+    prefix = root.path
+    for row in session.execute(statement.where(Directory.root_id == root.id)):
+        directory = existing_files.get(row.directory)
+        if directory is None:
+            directory = existing_files[row.directory] = {}
+        directory[row.basename] = row
+    return {prefix + directory: rows for directory, rows in existing_files.items()}
+
+
+def plan_work(
+    dir: Path, existing_files: dict, seen_paths: set, incremental=False, hash_algorithm=DEFAULT_ALGORITHM, sniff=False
+):
+    """Walk a directory and decide what has to be inspected for each image.
+
+    Every path walked is added to seen_paths, unless it is None.
+
+    Yields:
+        tuple: (pathname, row, values, job) where row is the existing row from load_existing_files or None for a new
+            file, values are columns already known and job is None or the arguments of inspect_file
+    """
     for root, dirs, files in dir.walk():
         if len(files) > 0:
             logger.info(f"Root: {root}")
-            paths = [Path(root).joinpath(file) for file in files]
-            for file in paths:
-                pathname = str(file)
-                # print(pathname)
-                logger.debug(f"Inspecting file {pathname}")
-                if pathname not in existing_paths and (is_image(pathname)):
-                    logger.debug(f"Adding file {pathname}")
-                    size = file.stat().st_size
-                    sha256 = get_sha256(file)
-                    media_type = get_media_type(pathname)
-                    datestamp = get_datestamp(pathname) if is_image(pathname) else None
-                    this_file = File(name=pathname, size=size, sha256=sha256, filetype=media_type, datestamp=datestamp)
-                    session.add(this_file)
-                    counter += 1
-                elif pathname in existing_paths and (is_image(pathname)):
-                    updated = False
-                    logger.debug(f"Checking {pathname} for updates.")
-                    existing_record = session.query(File).filter(File.name == pathname).one_or_none()
-                    if not existing_record.datestamp:
-                        # Check if the file has a datestamp and update it in the database only if it does.
-                        this_datestamp = get_datestamp(pathname) if is_image(pathname) else None
-                        if this_datestamp:
-                            existing_record.datestamp = this_datestamp
-                            updated = True
-                    if not existing_record.filetype:
-                        existing_record.filetype = get_media_type(pathname)
-                        updated = True
-                    if updated:
-                        logger.debug(f"Updating file {pathname}")
-                        counter += 1
-                if counter == commit_every:
-                    session.commit()
-                    counter = 0
-            session.commit()
+            # Joined as strings, as pathlib interns the parts of every path it parses and would keep them all. Like
+            # pathlib, the names of files directly under "." have no directory.
+            directory = "" if str(root) == "." else str(root)
+            existing_rows = existing_files.get(os.path.join(directory, ""), {})
+            for file in files:
+                pathname = os.path.join(directory, file)
+                if seen_paths is not None:
+                    seen_paths.add(pathname)
+                work = plan_file(pathname, existing_rows.get(file), incremental, hash_algorithm, sniff)
+                if work is not None:
+                    yield work
+
+
+def plan_file(pathname: str, existing_row, incremental=False, hash_algorithm=DEFAULT_ALGORITHM, sniff=False):
+    """Decide what has to be inspected for a single file, see plan_work.
+
+    Args:
+        pathname (str): The path of the file
+        existing_row (Row): The row of the file from load_existing_files, or None if it is not catalogued
+        incremental (bool, optional): Only re-inspect the file if its stat signature changed. Defaults to False.
+        hash_algorithm (str, optional): The algorithm of the checksums. Defaults to DEFAULT_ALGORITHM.
+        sniff (bool, optional): Also plan images whose extension does not say so. Defaults to False.
+
+    Returns:
+        tuple: (pathname, row, values, job) like plan_work, or None if the file is not an image or needs nothing
+    """
+    logger.debug(f"Inspecting file {pathname}")
+    if not is_image(pathname) and not (sniff and get_media_type(pathname, sniff=True) == MediaType.image):
+        return None
+    if existing_row is None:
+        return pathname, None, {}, (pathname,)
+    if incremental:
+        signature = stat_signature(os.stat(pathname))
+        if existing_row.mtime_ns is None and existing_row.size == signature["size"]:
+            # Catalogued before signatures were recorded; trust the stored hash and adopt the signature.
+            logger.debug(f"Recording signature of {pathname}")
+            return pathname, existing_row, signature, None
+        if signature_changed(existing_row, signature):
+            logger.debug(f"Signature of {pathname} changed, re-inspecting.")
+            return pathname, existing_row, {}, (pathname,)
+        if existing_row.sha256 and (existing_row.hash_algorithm or "sha256") != hash_algorithm:
+            # Digests of different algorithms can not be compared, so bring the file to the current one.
+            logger.debug(f"Re-hashing {pathname} with {hash_algorithm}.")
+            return pathname, existing_row, {}, (pathname,)
+        return None
+    logger.debug(f"Checking {pathname} for updates.")
+    values = {} if existing_row.has_filetype else {"filetype": get_media_type(pathname)}
+    # Only look for a datestamp when missing, and keep the record untouched if the file has none.
+    job = None if existing_row.has_datestamp else (pathname, True)
+    return (pathname, existing_row, values, job) if values or job else None
+
+
+def scan_root(target: ScanTarget, inspect, incremental=False, hash_algorithm=DEFAULT_ALGORITHM, sniff=False, **pool):
+    """Plan and inspect the work of a root, see plan_work and inspect_in_pool.
+
+    Yields:
+        tuple: (target, pathname, row, values)
+    """
+    work = plan_work(Path(target.path), target.existing_files, target.seen_paths, incremental, hash_algorithm, sniff)
+    for pathname, row, values in inspect_in_pool(work, inspect, target.workers, **pool):
+        yield target, pathname, row, values
+
+
+def merge_in_threads(generators: list, queue_depth=64):
+    """Run generators on a thread each and yield their items as they come.
+
+    A single generator runs on the calling thread. An exception raised by a generator is raised again by the
+    caller, and the other generators are stopped and closed.
+
+    Args:
+        generators (list): The generators
+        queue_depth (int, optional): Maximum number of items waiting for the caller. Defaults to 64.
+
+    Yields:
+        Any: The items of all the generators, in the order of each generator
+    """
+    if len(generators) == 1:
+        yield from generators[0]
+        return
+
+    results = queue.Queue(maxsize=queue_depth)
+    stopping = threading.Event()
+
+    def put(item) -> bool:
+        while not stopping.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(generator):
+        with closing(generator):
+            try:
+                for item in generator:
+                    if not put(("item", item)):
+                        return
+            except Exception as error:
+                put(("error", error))
+        put(("done", None))
+
+    threads = [threading.Thread(target=run, args=(generator,), daemon=True) for generator in generators]
+    for thread in threads:
+        thread.start()
+    try:
+        running = len(threads)
+        while running:
+            kind, item = results.get()
+            if kind == "item":
+                yield item
+            elif kind == "error":
+                raise item
+            else:
+                running -= 1
+    finally:
+        stopping.set()
+        for thread in threads:
+            thread.join()
+
+
+def write_batch(session: Session, inserts: list[dict], updates: list[dict], checksums: set):
+    """Write a batch of new and changed files as executemany statements, refresh the duplicate groups of the
+    checksums they touched and commit. Inserted rows name their file by root_id and path, see
+    roots.assign_directories."""
+    if inserts:
+        session.execute(insert(File), assign_directories(session, inserts))
+    if updates:
+        session.execute(update(File), updates)
+    refresh_duplicate_groups(session, checksums)
+    session.commit()
+    inserts.clear()
+    updates.clear()
+    checksums.clear()
+
+
+def write_results(session: Session, results, batch_size=500):
+    """Write the inspected files of scan_root to the database, batch_size rows per write_batch.
+
+    Args:
+        session (Session): The database session
+        results (Iterable): Tuples of (target, pathname, row, values) where target is the ScanTarget of the file
+        batch_size (int, optional): How many added or updated rows to write per executemany batch. Defaults to 500.
+    """
+    inserts, updates, checksums = [], [], set()
+    for target, pathname, row, values in results:
+        if row is None:
+            logger.debug(f"Adding file {pathname}")
+            inserts.append({"root_id": target.root_id, "path": pathname[len(target.path) :], **values})
+            checksums.add(values["sha256"])
+        elif values:
+            logger.debug(f"Updating file {pathname}")
+            updates.append({"id": row.id, **values})
+            if "sha256" in values:
+                checksums.update((row.sha256, values["sha256"]))
+        if len(inserts) + len(updates) >= batch_size:
+            write_batch(session, inserts, updates, checksums)
+    write_batch(session, inserts, updates, checksums)
+
+
+def fill_database(
+    session: Session,
+    roots: Path | list[RootConfig],
+    batch_size=500,
+    incremental=False,
+    workers=0,
+    queue_depth=64,
+    use_processes=False,
+    staged=False,
+    hash_algorithm=DEFAULT_ALGORITHM,
+    sniff=False,
+    perceptual=False,
+):
+    """Record the images found under one or more roots in the database.
+
+    Every root is walked and planned on a thread of its own and its files are inspected (hashed, typed and dated) by
+    a pool of workers of its own. Roots on different disks are scanned in parallel, while the workers of a root bound
+    how many of its files are read at once. Files are written back on the calling thread, in walk order within each
+    root, so the result does not depend on the number of workers.
+
+    Args:
+        session (Session): The database session
+        roots (Path | list[RootConfig]): The directory to scan, or the roots to scan, see roots.load_roots
+        batch_size (int, optional): How many added or updated rows to write per executemany batch. Defaults to 500.
+        incremental (bool, optional): Only re-inspect known files whose stat signature changed, and prune rows of
+            files that are no longer on disk. Defaults to False.
+        workers (int, optional): Number of workers inspecting the files of each root, unless the root sets its own.
+            0 inspects them serially. Defaults to 0.
+        queue_depth (int, optional): Maximum number of files waiting to be written. Defaults to 64.
+        use_processes (bool, optional): Use worker processes instead of threads. Defaults to False.
+        staged (bool, optional): Only compute full checksums for files whose size and partial hash collide, see
+            hash_size_collisions. Defaults to False.
+        hash_algorithm (str, optional): The algorithm of the checksums, see hashing.available_algorithms(). Incremental
+            scans re-hash files whose checksum was computed with another algorithm. Defaults to DEFAULT_ALGORITHM.
+        sniff (bool, optional): Also catalog images whose extension does not say so, recognized from their first
+            bytes. This reads the start of every file. Defaults to False.
+        perceptual (bool, optional): Also compute the perceptual hashes of images which have none, see
+            hash_perceptual. Defaults to False.
+    """
+    if isinstance(roots, Path):
+        roots = [RootConfig(roots)]
+    targets = []
+    for config, root in zip(roots, sync_roots(session, roots)):
+        logger.debug(f"Beginning investigation of {root.name} at {root.path}")
+        root_workers = workers if config.workers is None else config.workers
+        targets.append(
+            ScanTarget(root.id, root.name, root.path, root_workers, load_existing_files(session, root), set())
+        )
+
+    inspect = partial(inspect_file, staged=staged, hash_algorithm=hash_algorithm, sniff=sniff)
+    pool = {"queue_depth": queue_depth, "use_processes": use_processes}
+    scans = [scan_root(target, inspect, incremental, hash_algorithm, sniff, **pool) for target in targets]
+    write_results(session, merge_in_threads(scans, queue_depth), batch_size)
+
+    if incremental:
+        for target in targets:
+            missing_ids = [
+                row.id
+                for directory, rows in target.existing_files.items()
+                for basename, row in rows.items()
+                if directory + basename not in target.seen_paths
+            ]
+            if missing_ids and not target.seen_paths:
+                # An empty walk more likely means an unmounted volume than an emptied library.
+                logger.warning(f"No files found under {target.path}; not pruning {len(missing_ids)} catalogued files.")
+            elif missing_ids:
+                pruned = prune_missing_files(session, missing_ids)
+                logger.info(f"Pruning {pruned} files of {target.name} no longer on disk.")
+                prune_directories(session, target.root_id)
+                session.commit()
+    if staged:
+        hash_size_collisions(session, batch_size, workers, hash_algorithm)
+    if perceptual:
+        hash_perceptual(session, batch_size, workers)
     logger.info("Completed database fill.")
 
 
-def main():
-    DATA_DIR, DBFILE = load_config("mediatool.ini", force_previous_database=False)
-    engine = create_engine(f"sqlite+pysqlite:///{DBFILE}", echo=False)
+def hash_size_collisions(session: Session, batch_size=500, workers=0, hash_algorithm=DEFAULT_ALGORITHM):
+    """Compute the checksums a staged scan left out, but only for files which may have duplicates.
+
+    A file with a unique size can not have a duplicate. Files sharing a size get a partial hash of their head and
+    tail, and only files whose size and partial hash both collide get a full checksum.
+
+    Args:
+        session (Session): The database session
+        batch_size (int, optional): How many rows to update per executemany batch. Defaults to 500.
+        workers (int, optional): Number of threads hashing files. 0 hashes them serially. Defaults to 0.
+        hash_algorithm (str, optional): The algorithm of the full checksums. Defaults to DEFAULT_ALGORITHM.
+    """
+    colliding_sizes = select(File.size).group_by(File.size).having(func.count() > 1)
+    statement = select(File.id, File.name, File.sha256).where(
+        File.size.in_(colliding_sizes), File.partial_hash.is_(None)
+    )
+    hashed = hash_rows(session, statement, "partial_hash", get_partial_hash, batch_size, workers)
+    logger.info(f"Computed partial hashes of {hashed} files sharing a size.")
+
+    colliding = (
+        select(File.size, File.partial_hash)
+        .where(File.partial_hash.is_not(None))
+        .group_by(File.size, File.partial_hash)
+        .having(func.count() > 1)
+        .subquery()
+    )
+    statement = (
+        select(File.id, File.name, File.sha256)
+        .join(colliding, and_(File.size == colliding.c.size, File.partial_hash == colliding.c.partial_hash))
+        .where(or_(File.sha256.is_(None), func.coalesce(File.hash_algorithm, "sha256") != hash_algorithm))
+    )
+    hash_function = partial(hash_file, algorithm=hash_algorithm)
+    hashed = hash_rows(session, statement, "sha256", hash_function, batch_size, workers, hash_algorithm=hash_algorithm)
+    logger.info(f"Computed checksums of {hashed} files sharing a size and partial hash.")
+
+
+def hash_perceptual(session: Session, batch_size=500, workers=0) -> int:
+    """Compute the perceptual hashes of catalogued images which miss one, for finding near duplicates.
+
+    Images are hashed batch_size at a time by perceptual.hash_images, so the hashes of a batch are computed together.
+    Images which can not be decoded are marked with perceptual_error and left out of later runs, until their content
+    changes.
+
+    Args:
+        session (Session): The database session
+        batch_size (int, optional): How many images to hash and update per batch. Defaults to 500.
+        workers (int, optional): Number of threads decoding images. 0 decodes them serially. Defaults to 0.
+
+    Returns:
+        int: The number of images hashed
+    """
+    missing = or_(*(getattr(File, column).is_(None) for column in available_hashes()))
+    statement = select(File.id, File.name).where(
+        File.filetype == MediaType.image, missing, File.perceptual_error.is_not(True)
+    )
+    rows = session.execute(statement).all()
+    failed = 0
+    for batch in chunked(rows, batch_size):
+        hashes = hash_images([row.name for row in batch], workers)
+        updates = [
+            {"id": row.id, "dhash": dhash, "phash": phash, "perceptual_error": dhash is None}
+            for row, (dhash, phash) in zip(batch, hashes)
+        ]
+        failed += sum(update["perceptual_error"] for update in updates)
+        write_batch(session, [], updates, set())
+    logger.info(f"Computed perceptual hashes of {len(rows) - failed} images, {failed} could not be decoded.")
+    return len(rows)
+
+
+def hash_rows(session: Session, statement, column: str, hash_function, batch_size=500, workers=0, **values) -> int:
+    rows = session.execute(statement).all()
+    names = [row.name for row in rows]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        digests = executor.map(hash_function, names) if workers else map(hash_function, names)
+        updates, checksums = [], set()
+        for row, digest in zip(rows, digests):
+            updates.append({"id": row.id, column: digest, **values})
+            if column == "sha256":
+                checksums.update((row.sha256, digest))
+            if len(updates) >= batch_size:
+                write_batch(session, [], updates, checksums)
+        write_batch(session, [], updates, checksums)
+    return len(rows)
+
+
+def configured_roots(config_file, root_names) -> list[RootConfig]:
+    """The roots of mediatool.ini named on the command line, or all of them.
+
+    Raises:
+        click.UsageError: If a name is not configured or no root is
+    """
+    roots = load_roots(config_file)
+    unknown = set(root_names) - {root.name for root in roots}
+    if unknown:
+        raise click.UsageError(f"No root named {', '.join(sorted(unknown))} in {config_file}.")
+    if root_names:
+        roots = [root for root in roots if root.name in root_names]
+    if not roots:
+        raise click.UsageError(f"Configure data_dir or a [root:<name>] section in {config_file}.")
+    return roots
+
+
+@click.command()
+@click.option(
+    "--incremental/--full",
+    default=False,
+    help="Only re-inspect files whose size, mtime, inode or device changed and prune files missing from disk.",
+)
+@click.option(
+    "--root",
+    "root_names",
+    multiple=True,
+    help="Only scan the configured root of this name. Can be repeated. Defaults to every root.",
+)
+@click.option(
+    "--workers",
+    default=os.cpu_count(),
+    show_default=True,
+    help="Number of workers inspecting the files of each root without workers of its own.",
+)
+@click.option("--queue-depth", default=64, show_default=True, help="Maximum number of files waiting to be written.")
+@click.option("--processes", is_flag=True, help="Inspect files in worker processes instead of threads.")
+@click.option(
+    "--staged",
+    is_flag=True,
+    help="Only compute full checksums of files whose size and head/tail sample collide with another file.",
+)
+@click.option(
+    "--hash-algorithm",
+    type=click.Choice(available_algorithms()),
+    default=DEFAULT_ALGORITHM,
+    show_default=True,
+    help="Algorithm of the file checksums.",
+)
+@click.option("--sniff", is_flag=True, help="Also catalog images with a misleading extension, recognized by content.")
+@click.option("--perceptual", is_flag=True, help="Also compute the perceptual hashes used to find near duplicates.")
+def main(root_names, incremental, workers, queue_depth, processes, staged, hash_algorithm, sniff, perceptual):
+    _, DBFILE = load_config("mediatool.ini", force_previous_database=False)
+    roots = configured_roots("mediatool.ini", root_names)
+    engine = get_engine(DBFILE)
     Base.metadata.create_all(engine)
 
     with Session(engine) as session:
-        fill_database(session, DATA_DIR)
+        fill_database(
+            session,
+            roots,
+            incremental=incremental,
+            workers=workers,
+            queue_depth=queue_depth,
+            use_processes=processes,
+            staged=staged,
+            hash_algorithm=hash_algorithm,
+            sniff=sniff,
+            perceptual=perceptual,
+        )
 
 
 if __name__ == "__main__":
@@ -1,14 +1,231 @@
+import json
 import logging
+import os
+from collections import defaultdict
+from itertools import groupby
+from operator import attrgetter
 from pathlib import Path, PosixPath
-from typing import List
+from typing import Iterable, Iterator, List, NamedTuple
 
-from sqlalchemy.orm import Session
+from more_itertools import chunked
+from sqlalchemy import (
+    Engine,
+    create_engine,
+    delete,
+    event,
+    func,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.orm import Session, selectinload
 
-from models import File
+from models import Directory, DuplicateGroup, File, NearDuplicate
+from perceptual import DEFAULT_THRESHOLD, cluster_hashes, to_unsigned64
+from roots import (
+    assign_directories,
+    destination_roots,
+    innermost_roots,
+    locate_name,
+    names_criteria,
+    under_directory,
+)
+from utils import MediaType
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Applied to every new SQLite connection. WAL lets the web view read while the catalog writes, and NORMAL
+# synchronous is safe with WAL. Negative cache_size is in KiB.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+def get_engine(dbfile: Path, echo: bool = False) -> Engine:
+    """Create an engine for the catalog database with the performance pragmas of SQLITE_PRAGMAS.
+
+    Args:
+        dbfile (Path): The SQLite database file
+        echo (bool, optional): Log all statements. Defaults to False.
+
+    Returns:
+        Engine: The engine
+    """
+    engine = create_engine(f"sqlite+pysqlite:///{dbfile}", echo=echo)
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+# Values bound per statement, or rows per INSERT, well below SQLite's limit of bound parameters.
+SQLITE_BATCH_SIZE = 500
+DUPLICATE_GROUP_COLUMNS = ["sha256", "count", "total_bytes", "representative_id"]
+
+
+def duplicate_groups_select(*criteria):
+    return (
+        select(File.sha256, func.count(), func.sum(File.size), func.min(File.id))
+        .where(File.sha256.is_not(None), *criteria)
+        .group_by(File.sha256)
+        .having(func.count() > 1)
+    )
+
+
+def refresh_duplicate_groups(session: Session, checksums: Iterable[str]) -> None:
+    """Recompute the duplicate groups of checksums whose files were added, changed or removed.
+
+    The caller commits, so the groups change in the same transaction as the files.
+
+    Args:
+        session (Session): The database session
+        checksums (Iterable[str]): The old and new checksums of the files. None values are ignored.
+    """
+    checksums = sorted({checksum for checksum in checksums if checksum})
+    for start in range(0, len(checksums), SQLITE_BATCH_SIZE):
+        batch = checksums[start : start + SQLITE_BATCH_SIZE]
+        session.execute(delete(DuplicateGroup).where(DuplicateGroup.sha256.in_(batch)))
+        session.execute(
+            insert(DuplicateGroup).from_select(DUPLICATE_GROUP_COLUMNS, duplicate_groups_select(File.sha256.in_(batch)))
+        )
+
+
+def rebuild_duplicate_groups(session: Session) -> int:
+    """Recompute every duplicate group from the file table and commit.
+
+    Returns:
+        int: The number of duplicate groups
+    """
+    session.execute(delete(DuplicateGroup))
+    session.execute(insert(DuplicateGroup).from_select(DUPLICATE_GROUP_COLUMNS, duplicate_groups_select()))
+    session.commit()
+    return session.scalar(select(func.count()).select_from(DuplicateGroup))
+
+
+def iter_duplicate_groups(
+    session: Session, after: str = "", batch_size: int = SQLITE_BATCH_SIZE
+) -> Iterator[tuple[DuplicateGroup, list[File]]]:
+    """Lazily yield duplicate groups ordered by checksum, together with their files.
+
+    Groups are read batch_size at a time with a keyset query on the checksum, followed by one query for the files of
+    the whole batch and one for their directories. Resuming after any checksum therefore costs the same as starting
+    from the beginning.
+
+    Args:
+        session (Session): The database session
+        after (str, optional): Only yield groups with a checksum greater than this one. Defaults to "", all groups.
+        batch_size (int, optional): Number of groups read per query. Defaults to SQLITE_BATCH_SIZE.
+
+    Yields:
+        tuple[DuplicateGroup, list[File]]: A group and its files ordered by id
+    """
+    while True:
+        groups = session.scalars(
+            select(DuplicateGroup)
+            .where(DuplicateGroup.sha256 > after)
+            .order_by(DuplicateGroup.sha256)
+            .limit(batch_size)
+        ).all()
+        if not groups:
+            return
+        files = session.scalars(
+            select(File)
+            .where(File.sha256.in_([group.sha256 for group in groups]))
+            .order_by(File.sha256, File.id)
+            .options(selectinload(File.directory))
+        )
+        files_by_checksum = {
+            checksum: list(checksum_files) for checksum, checksum_files in groupby(files, key=attrgetter("sha256"))
+        }
+        for group in groups:
+            yield group, files_by_checksum.get(group.sha256, [])
+        after = groups[-1].sha256
+
+
+def rebuild_near_duplicates(session: Session, threshold: int = DEFAULT_THRESHOLD, hash_name: str = "dhash") -> int:
+    """Cluster the catalogued images by perceptual hash, replace the near_duplicate table with the clusters and commit.
+
+    Each checksum is one point, so exact copies do not form clusters of their own, they are reviewed as duplicate
+    groups.
+
+    Args:
+        session (Session): The database session
+        threshold (int, optional): The largest Hamming distance between the hashes of a cluster's neighbouring
+            images. Defaults to DEFAULT_THRESHOLD.
+        hash_name (str, optional): The perceptual hash compared, dhash or phash. Defaults to "dhash".
+
+    Returns:
+        int: The number of clusters
+    """
+    column = getattr(File, hash_name)
+    hashes = session.execute(
+        select(File.sha256, func.min(column))
+        .where(File.filetype == MediaType.image, File.sha256.is_not(None), column.is_not(None))
+        .group_by(File.sha256)
+    )
+    clusters = cluster_hashes(((checksum, to_unsigned64(value)) for checksum, value in hashes), threshold)
+    rows = [
+        {"sha256": checksum, "cluster_id": cluster_id}
+        for cluster_id, checksums in enumerate(clusters, start=1)
+        for checksum in checksums
+    ]
+    session.execute(delete(NearDuplicate))
+    for batch in chunked(rows, SQLITE_BATCH_SIZE):
+        session.execute(insert(NearDuplicate), batch)
+    session.commit()
+    return len(clusters)
+
+
+def iter_near_duplicates(
+    session: Session, after: int = 0, batch_size: int = SQLITE_BATCH_SIZE
+) -> Iterator[tuple[int, list[File]]]:
+    """Lazily yield near duplicate clusters ordered by id, together with their files.
+
+    Like iter_duplicate_groups, clusters are read batch_size at a time with a keyset query followed by one query for
+    their files. Clusters left with fewer than two files, because files were removed since the last rebuild, are
+    skipped.
+
+    Args:
+        session (Session): The database session
+        after (int, optional): Only yield clusters with a greater id. Defaults to 0, all clusters.
+        batch_size (int, optional): Number of clusters read per query. Defaults to SQLITE_BATCH_SIZE.
+
+    Yields:
+        tuple[int, list[File]]: A cluster id and its files ordered by checksum and id
+    """
+    while True:
+        cluster_ids = session.scalars(
+            select(NearDuplicate.cluster_id)
+            .where(NearDuplicate.cluster_id > after)
+            .group_by(NearDuplicate.cluster_id)
+            .order_by(NearDuplicate.cluster_id)
+            .limit(batch_size)
+        ).all()
+        if not cluster_ids:
+            return
+        rows = session.execute(
+            select(NearDuplicate.cluster_id, File)
+            .join(File, File.sha256 == NearDuplicate.sha256)
+            .where(NearDuplicate.cluster_id.in_(cluster_ids))
+            .order_by(NearDuplicate.cluster_id, File.sha256, File.id)
+            .options(selectinload(File.directory))
+        )
+        for cluster_id, cluster_rows in groupby(rows, key=attrgetter("cluster_id")):
+            files = [row.File for row in cluster_rows]
+            if len(files) > 1:
+                yield cluster_id, files
+        after = cluster_ids[-1]
+
 
 def consolidate_files_db(
     session: Session, paths_to_consolidate: List[Path | PosixPath], target_path: Path, dry_run: bool = False
@@ -23,16 +240,218 @@ def consolidate_files_db(
         temp_source = paths_to_consolidate.pop()
         if not dry_run:
             temp_source.rename(target_path)
+            # The row follows the file, which keeps its checksum and hashes.
+            move_files_db(session, [(str(temp_source), str(target_path))])
         paths_to_remove = paths_to_consolidate
         logger.debug(f"T not in P: Paths to remove = {paths_to_remove}")
 
     # Delete paths_to_remove
-    total_files_deleted = 0
-    for path in paths_to_remove:
-        logger.debug(f"Deleting {str(path)} from database.")
-        if not dry_run:
-            session.query(File).filter(File.name == str(path)).delete()
-        total_files_deleted += 1
+    names_to_remove = [str(path) for path in paths_to_remove]
+    logger.debug(f"Deleting {names_to_remove} from database.")
+    if not dry_run:
+        delete_files_db(session, names_to_remove)
+    session.commit()
+    return len(names_to_remove)
+
 
+def delete_files_db(session: Session, names: List[str]) -> int:
+    """Delete files from the catalog with one DELETE per batch of names and refresh their duplicate groups.
+
+    The caller commits, so all the batches are one transaction.
+
+    Returns:
+        int: The number of rows deleted
+    """
+    checksums = []
+    for batch in chunked(names, SQLITE_BATCH_SIZE):
+        checksums += session.scalars(delete(File).where(names_criteria(session, batch)).returning(File.sha256)).all()
+    refresh_duplicate_groups(session, checksums)
+    return len(checksums)
+
+
+def move_files_db(session: Session, moves: Iterable[tuple[str, str]]) -> int:
+    """Point the rows of moved files at their new directory and basename, without inspecting them again.
+
+    A row already catalogued under the new name is replaced, like the file was. Files moved out of every root are
+    deleted from the catalog, see destination_roots. The caller commits.
+
+    Args:
+        session (Session): The database session
+        moves (Iterable[tuple[str, str]]): The old and new absolute names of the files
+
+    Returns:
+        int: The number of rows moved
+    """
+    roots = destination_roots(innermost_roots(session))
+    moved = 0
+    for source, target in moves:
+        located = locate_name(roots, target)
+        if located is None:
+            delete_files_db(session, [source])
+            continue
+        [row] = assign_directories(session, [{"root_id": located[0], "path": located[1]}])
+        replaced = session.scalars(delete(File).where(names_criteria(session, [target])).returning(File.sha256)).all()
+        refresh_duplicate_groups(session, replaced)
+        moved += session.execute(update(File).where(names_criteria(session, [source])).values(**row)).rowcount
+    return moved
+
+
+def move_directory_db(session: Session, source: str, target: str) -> int:
+    """Point the rows of a moved directory and of the directories under it at their new path.
+
+    Their files keep their rows. Rows of a directory previously catalogued under the new name are replaced, and a
+    directory moved out of every root is deleted from the catalog, see destination_roots. The caller commits.
+
+    Args:
+        session (Session): The database session
+        source (str): The old absolute name of the directory
+        target (str): The new absolute name of the directory
+
+    Returns:
+        int: The number of directories moved
+    """
+    roots = innermost_roots(session)
+    source_located = locate_name(roots, os.path.join(source, ""))
+    target_located = locate_name(destination_roots(roots), os.path.join(target, ""))
+    if source_located is None:
+        return 0
+    if target_located is None:
+        delete_directory_db(session, source)
+        return 0
+    delete_directory_db(session, target)
+    root_id, target_prefix = target_located
+    path = target_prefix + func.substr(Directory.path, len(source_located[1]) + 1)
+    statement = update(Directory).where(under_directory(roots, source)).values(root_id=root_id, path=path)
+    return session.execute(statement).rowcount
+
+
+def delete_directory_db(session: Session, name: str) -> int:
+    """Delete the files of a directory and of the directories under it from the catalog, and their directories.
+
+    The caller commits.
+
+    Returns:
+        int: The number of files deleted
+    """
+    roots = innermost_roots(session)
+    criteria = under_directory(roots, name)
+    if criteria is None:
+        return 0
+    directory_ids = select(Directory.id).where(criteria)
+    checksums = session.scalars(delete(File).where(File.directory_id.in_(directory_ids)).returning(File.sha256)).all()
+    session.execute(delete(Directory).where(criteria))
+    refresh_duplicate_groups(session, checksums)
+    return len(checksums)
+
+
+class ConsolidationResult(NamedTuple):
+    groups: int
+    deleted: int
+    unlinked: int
+    skipped: list[str]
+
+
+def consolidation_journal_path(dbfile: Path) -> Path:
+    return dbfile.with_name(f"{dbfile.stem}-consolidate.jsonl")
+
+
+def consolidate_groups_db(
+    session: Session, decisions: Iterable[tuple[str, str]], journal: Path, dry_run: bool = False
+) -> ConsolidationResult:
+    """Keep one file of each of many duplicate groups and delete the other files from the catalog and the disk.
+
+    All the rows are deleted in a single transaction. The files are only unlinked once it is committed, and are listed
+    in a journal first, so an interrupted run is completed by the next one through replay_consolidation_journal.
+
+    Args:
+        session (Session): The database session
+        decisions (Iterable[tuple[str, str]]): Pairs of a checksum and the path of the file to keep
+        journal (Path): The journal of files to unlink, see consolidation_journal_path
+        dry_run (bool, optional): Only count what would be deleted. Defaults to False.
+
+    Returns:
+        ConsolidationResult: The number of groups consolidated, rows deleted and files unlinked, and the checksums
+            skipped because their file to keep is not one of their catalogued duplicates
+    """
+    if not dry_run:
+        replay_consolidation_journal(session, journal)
+
+    keep_by_checksum = {checksum: str(keep) for checksum, keep in decisions}
+    names_by_checksum = defaultdict(list)
+    for batch in chunked(sorted(keep_by_checksum), SQLITE_BATCH_SIZE):
+        for name, checksum in session.execute(select(File.name, File.sha256).where(File.sha256.in_(batch))):
+            names_by_checksum[checksum].append(name)
+
+    plans, skipped = [], []
+    for checksum, keep in keep_by_checksum.items():
+        names = names_by_checksum[checksum]
+        if keep not in names or len(names) < 2:
+            logger.warning(f"Skipping {checksum}, {keep} is not one of its duplicates.")
+            skipped.append(checksum)
+            continue
+        plans.append({"sha256": checksum, "keep": keep, "remove": [name for name in names if name != keep]})
+    names_to_remove = [name for plan in plans for name in plan["remove"]]
+    logger.info(f"Consolidating {len(plans)} duplicate groups, removing {len(names_to_remove)} files.")
+    if dry_run:
+        return ConsolidationResult(len(plans), len(names_to_remove), 0, skipped)
+
+    with open(journal, "w") as f:
+        f.writelines(json.dumps(plan) + "\n" for plan in plans)
+        f.flush()
+        os.fsync(f.fileno())
+
+    deleted = delete_files_db(session, names_to_remove)
     session.commit()
-    return total_files_deleted
+
+    unlinked = unlink_duplicates(plans)
+    journal.unlink()
+    return ConsolidationResult(len(plans), deleted, unlinked, skipped)
+
+
+def unlink_duplicates(plans: Iterable[dict]) -> int:
+    """Unlink the files to remove of consolidation plans, as long as the file kept is still there with the same size."""
+    unlinked = 0
+    for plan in plans:
+        try:
+            size = os.stat(plan["keep"]).st_size
+        except FileNotFoundError:
+            logger.error(f"Not removing the duplicates of {plan['keep']}, which no longer exists.")
+            continue
+        for name in plan["remove"]:
+            try:
+                if os.stat(name).st_size != size:
+                    logger.warning(f"Not removing {name}, which changed since it was catalogued.")
+                    continue
+                os.unlink(name)
+            except FileNotFoundError:
+                continue
+            logger.debug(f"Deleted file {name}")
+            unlinked += 1
+    return unlinked
+
+
+def replay_consolidation_journal(session: Session, journal: Path) -> int:
+    """Finish a consolidation that was interrupted before all its files were unlinked.
+
+    Only files which are no longer in the catalog are unlinked, so a journal left by a transaction that never
+    committed removes nothing.
+
+    Returns:
+        int: The number of files unlinked
+    """
+    if not journal.is_file():
+        return 0
+    with open(journal) as f:
+        plans = [json.loads(line) for line in f if line.strip()]
+    logger.info(f"Replaying the consolidation of {len(plans)} duplicate groups from {journal}.")
+
+    names = [name for plan in plans for name in plan["remove"]]
+    catalogued = set()
+    for batch in chunked(names, SQLITE_BATCH_SIZE):
+        catalogued.update(session.scalars(select(File.name).where(names_criteria(session, batch))))
+    for plan in plans:
+        plan["remove"] = [name for name in plan["remove"] if name not in catalogued]
+
+    unlinked = unlink_duplicates(plans)
+    journal.unlink()
+    return unlinked
@@ -1,16 +1,29 @@
 import logging
+from itertools import groupby
+from operator import attrgetter
 from pathlib import Path
 
+import click
 from more_itertools import first
 from rich.console import Console
 from rich.prompt import IntPrompt
 from rich.table import Table
-from sqlalchemy import create_engine, select, text
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from db_utils import consolidate_files_db
+from db_utils import (
+    consolidate_files_db,
+    consolidate_groups_db,
+    consolidation_journal_path,
+    get_engine,
+    iter_near_duplicates,
+    rebuild_duplicate_groups,
+    rebuild_near_duplicates,
+)
 from logging_setup import logging_setup
-from models import Base, File
+from models import Base, DuplicateGroup, File
+from perceptual import DEFAULT_THRESHOLD, available_hashes
+from policies import POLICIES, parse_rule, resolve_duplicates
 from utils import consolidate_files, get_recommended_filename, load_config
 
 logging_setup()
@@ -23,59 +36,186 @@ if debug:
 
 
 def find_duplicate_checksums(session: Session):
-    stmt = text("select sha256 from (select sha256, count(sha256) as qty from file group by sha256) WHERE qty>1;")
-    checksums = (checksum.sha256 for checksum in session.execute(stmt))
-    return checksums
+    # The catalog keeps duplicate_group up to date, so there is no need to group the whole file table here.
+    return session.scalars(select(DuplicateGroup.sha256).order_by(DuplicateGroup.sha256))
+
+
+def find_duplicate_files(session: Session) -> list[tuple[str, list]]:
+    """All duplicate groups with the name and stored datestamp of their files, read with one ordered query.
+
+    Returns:
+        list[tuple[str, list]]: Pairs of a checksum and its (sha256, name, datestamp) rows ordered by id
+    """
+    statement = (
+        select(File.sha256, File.name, File.datestamp)
+        .join(DuplicateGroup, DuplicateGroup.sha256 == File.sha256)
+        .order_by(File.sha256, File.id)
+    )
+    # Read everything before consolidating, which commits while the groups are reviewed.
+    rows = session.execute(statement).all()
+    return [(checksum, list(group)) for checksum, group in groupby(rows, key=attrgetter("sha256"))]
+
+
+def review_group(session: Session, console: Console, title: str, rows):
+    """Ask which file of a group to keep, then consolidate the group on disk and in the catalog.
+
+    Args:
+        session (Session): The database session
+        console (Console): The console to print to
+        title (str): The title of the table of files
+        rows: The files of the group, with a name and a datestamp
+    """
+    duplicates_of_checksum = [Path(row.name) for row in rows]
+
+    number_of_files_found = len(duplicates_of_checksum)
+    table = Table(title=title)
+    table.add_column("")
+    table.add_column("Parent")
+    table.add_column("Filename")
+    for file_number, file in enumerate(duplicates_of_checksum, start=1):
+        parent = str(file.parent)
+        name = str(file.name)
+        table.add_row(str(file_number), parent, name)
+    console.print(table)
+
+    while True:
+        keep_number = IntPrompt.ask("Which one to keep?", default=1)
+        if keep_number >= 1 and keep_number <= number_of_files_found:
+            break
+
+    file_to_keep = duplicates_of_checksum[keep_number - 1]
+    console.print(f"We want to keep file {keep_number} which is {file_to_keep}")
+
+    # For now just display a single recommended filename but do not do anything with it.
+    # The datestamps stored by the catalog save opening every image again.
+    recommended_filenames = [
+        get_recommended_filename(Path(row.name), datestamp=row.datestamp) for row in rows if row.datestamp
+    ]
+    recommended_filenames = {str(file.name) for file in recommended_filenames if file}
+    recommended_filename = str(first(recommended_filenames, "N/A"))
+    console.print(f"Recommended filenames: {recommended_filename}")
+
+    consolidate_files(duplicates_of_checksum, file_to_keep)
+    consolidate_files_db(session, duplicates_of_checksum, file_to_keep)
 
 
 def process_duplicates(session):
     logger.debug("Searching for duplicate checksums from the database.")
-    duplicate_checksums = [checksum for checksum in find_duplicate_checksums(session)]
-    logger.info(f"Found {len(duplicate_checksums)} duplicate checksums.")
+    duplicate_groups = find_duplicate_files(session)
+    logger.info(f"Found {len(duplicate_groups)} duplicate checksums.")
     console = Console()
 
-    for checksum in duplicate_checksums:
-        statement = select(File).filter_by(sha256=checksum)
-        duplicates_of_checksum = [
-            Path(dupe_set.name) for dupe_set in [row.File for row in session.execute(statement).all()]
-        ]
-
-        number_of_files_found = len(duplicates_of_checksum)
-        table = Table(title=f"Duplicates of {checksum}")
-        table.add_column("")
-        table.add_column("Parent")
-        table.add_column("Filename")
-        for file_number, file in enumerate(duplicates_of_checksum, start=1):
-            parent = str(file.parent)
-            name = str(file.name)
-            table.add_row(str(file_number), parent, name)
-        console.print(table)
-
-        while True:
-            keep_number = IntPrompt.ask("Which one to keep?", default=1)
-            if keep_number >= 1 and keep_number <= number_of_files_found:
-                break
-
-        file_to_keep = duplicates_of_checksum[keep_number - 1]
-        console.print(f"We want to keep file {keep_number} which is {file_to_keep}")
-
-        # For now just display a single recommended filename but do not do anything with it.
-        recommended_filenames = [get_recommended_filename(path) for path in duplicates_of_checksum]
-        recommended_filenames = {str(file.name) for file in recommended_filenames if file}
-        recommended_filename = str(first(recommended_filenames, "N/A"))
-        console.print(f"Recommended filenames: {recommended_filename}")
-
-        consolidate_files(duplicates_of_checksum, file_to_keep)
-        consolidate_files_db(session, duplicates_of_checksum, file_to_keep)
-
-
-def main():
+    for checksum, rows in duplicate_groups:
+        review_group(session, console, f"Duplicates of {checksum}", rows)
+
+
+def process_near_duplicates(session: Session, threshold: int = DEFAULT_THRESHOLD, hash_name: str = "dhash"):
+    """Cluster the images by perceptual hash and review the clusters like exact duplicates."""
+    logger.info(f"Found {rebuild_near_duplicates(session, threshold, hash_name)} clusters of near duplicates.")
+    # Read everything before consolidating, which commits while the clusters are reviewed.
+    clusters = list(iter_near_duplicates(session))
+    console = Console()
+
+    for cluster_id, files in clusters:
+        review_group(session, console, f"Near duplicates, cluster {cluster_id}", files)
+
+
+def parse_policy(ctx, param, specs) -> list:
+    try:
+        return [parse_rule(spec) for spec in specs]
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from e
+
+
+def apply_policy(session: Session, rules: list, journal: Path, dry_run: bool = False) -> int:
+    """Consolidate every duplicate group without asking, keeping the file chosen by the policy rules.
+
+    Returns:
+        int: The number of bytes reclaimed, or reclaimable in a dry run
+    """
+    console = Console()
+    resolutions = list(resolve_duplicates(session, rules))
+    for resolution in resolutions:
+        console.print(f"{resolution.sha256}: keep {resolution.keep}")
+        for name in resolution.remove:
+            console.print(f"    remove {name}")
+
+    reclaimable_bytes = sum(resolution.reclaimable_bytes for resolution in resolutions)
+    files_to_remove = sum(len(resolution.remove) for resolution in resolutions)
+    if dry_run:
+        console.print(
+            f"{len(resolutions)} duplicate groups, {files_to_remove} files to remove, "
+            f"{reclaimable_bytes / 1024**2:,.1f} MiB ({reclaimable_bytes:,} bytes) reclaimable."
+        )
+        return reclaimable_bytes
+
+    result = consolidate_groups_db(
+        session, [(resolution.sha256, resolution.keep) for resolution in resolutions], journal
+    )
+    console.print(
+        f"Consolidated {result.groups} duplicate groups, removed {result.unlinked} files, "
+        f"reclaimed {reclaimable_bytes / 1024**2:,.1f} MiB."
+    )
+    return reclaimable_bytes
+
+
+@click.command()
+@click.option(
+    "--rebuild-groups",
+    is_flag=True,
+    help="Recompute the duplicate groups from the file table first, e.g. after editing the database by hand.",
+)
+@click.option(
+    "--policy",
+    "rules",
+    multiple=True,
+    callback=parse_policy,
+    help="Keep files by rule instead of asking: "
+    + ", ".join(POLICIES)
+    + ". Rules may be repeated, e.g. --policy under-root=/photos --policy shortest-path, each one breaking the ties"
+    " of the rules before it.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="With --policy, only report what would be removed and the bytes reclaimable."
+)
+@click.option(
+    "--near",
+    is_flag=True,
+    help="Review clusters of images which look alike, e.g. resized or recompressed copies, instead of exact "
+    "duplicates. Needs the perceptual hashes of catalog.py --perceptual.",
+)
+@click.option(
+    "--threshold",
+    default=DEFAULT_THRESHOLD,
+    show_default=True,
+    help="With --near, the most bits in which the perceptual hashes of two alike images may differ.",
+)
+@click.option(
+    "--hash",
+    "hash_name",
+    type=click.Choice(available_hashes()),
+    default="dhash",
+    show_default=True,
+    help="With --near, the perceptual hash to compare. phash needs numpy.",
+)
+def main(rebuild_groups, rules, dry_run, near, threshold, hash_name):
+    if dry_run and not rules:
+        raise click.UsageError("--dry-run needs a --policy.")
+    if near and rules:
+        raise click.UsageError("Policies only apply to exact duplicates, --near reviews every cluster.")
     DATA_DIR, DBFILE = load_config("mediatool.ini")
-    engine = create_engine(f"sqlite+pysqlite:///{DBFILE}", echo=False)
+    engine = get_engine(DBFILE)
     Base.metadata.create_all(engine)
 
     with Session(engine) as session:
-        process_duplicates(session)
+        if rebuild_groups:
+            logger.info(f"Rebuilt {rebuild_duplicate_groups(session)} duplicate groups.")
+        if near:
+            process_near_duplicates(session, threshold, hash_name)
+        elif rules:
+            apply_policy(session, rules, consolidation_journal_path(DBFILE), dry_run)
+        else:
+            process_duplicates(session)
 
 
 if __name__ == "__main__":
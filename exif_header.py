@@ -0,0 +1,144 @@
+"""Read EXIF timestamps straight from the header of JPEG and PNG files.
+
+Opening an image with Pillow to call getexif() parses every marker of a JPEG and decodes the whole image of a PNG
+without an early eXIf chunk. The timestamp only needs the EXIF block, which sits in the first few KB of a JPEG and
+in a chunk that can be found by skipping over the others in a PNG.
+
+The tags are looked up the way Image.getexif() exposes them, in IFD0 only, so both readers agree on well-formed files.
+Anything this reader does not understand raises ExifHeaderError, upon which callers fall back to Pillow.
+"""
+
+import struct
+
+from PIL.ExifTags import Base as ExifBase
+
+JPEG_SIGNATURE = b"\xff\xd8"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+EXIF_PREFIX = b"Exif\x00\x00"
+ASCII_TYPE = 2
+
+# JPEG markers which are not followed by a segment length.
+STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+START_OF_SCAN = 0xDA
+END_OF_IMAGE = 0xD9
+APP1 = 0xE1
+
+# Pillow reads EXIF stored as text in these chunks, which is not worth duplicating here.
+PNG_TEXT_CHUNKS = {b"tEXt", b"zTXt", b"iTXt"}
+PNG_RAW_EXIF_KEYWORD = b"Raw profile type exif"
+
+
+class ExifHeaderError(ValueError):
+    """The header is not one this module can read without Pillow."""
+
+
+def read_exif_datestring(image_file) -> str | None:
+    """Read the EXIF timestamp of an open JPEG or PNG file.
+
+    Args:
+        image_file: A binary file object positioned anywhere
+
+    Raises:
+        ExifHeaderError: When the file is not a JPEG or PNG this module can parse.
+
+    Returns:
+        str | None: The DateTimeOriginal tag, or else the DateTime tag, of IFD0. None if there is neither.
+    """
+    image_file.seek(0)
+    signature = image_file.read(8)
+    try:
+        if signature.startswith(JPEG_SIGNATURE):
+            image_file.seek(2)
+            exif = find_jpeg_exif(image_file)
+        elif signature == PNG_SIGNATURE:
+            exif = find_png_exif(image_file)
+        else:
+            raise ExifHeaderError("Not a JPEG or PNG file.")
+        return exif_datestring(exif) if exif else None
+    except (struct.error, IndexError) as e:
+        raise ExifHeaderError(f"Malformed header: {e}") from e
+
+
+def find_jpeg_exif(image_file) -> bytes | None:
+    while True:
+        marker = image_file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ExifHeaderError("Expected a JPEG marker.")
+        # Markers may be preceded by any number of 0xFF fill bytes.
+        while marker[1] == 0xFF:
+            marker = marker[1:] + image_file.read(1)
+        code = marker[1]
+        if code in (START_OF_SCAN, END_OF_IMAGE):
+            # Pillow stops looking for metadata at the image data as well.
+            return None
+        if code in STANDALONE_MARKERS:
+            continue
+        (length,) = struct.unpack(">H", image_file.read(2))
+        if code == APP1:
+            segment = image_file.read(length - 2)
+            if segment.startswith(EXIF_PREFIX):
+                return segment
+        else:
+            image_file.seek(length - 2, 1)
+
+
+def find_png_exif(image_file) -> bytes | None:
+    while True:
+        length, chunk_type = struct.unpack(">I4s", image_file.read(8))
+        if chunk_type == b"eXIf":
+            return image_file.read(length)
+        if chunk_type == b"IEND":
+            return None
+        if chunk_type in PNG_TEXT_CHUNKS:
+            keyword = image_file.read(min(length, len(PNG_RAW_EXIF_KEYWORD) + 1))
+            if keyword.rstrip(b"\x00") == PNG_RAW_EXIF_KEYWORD:
+                raise ExifHeaderError("EXIF stored in a text chunk.")
+            image_file.seek(length - len(keyword), 1)
+        else:
+            image_file.seek(length, 1)
+        # Skip the CRC.
+        image_file.seek(4, 1)
+
+
+def exif_datestring(exif: bytes) -> str | None:
+    """Find the timestamp in a TIFF structured EXIF block.
+
+    Args:
+        exif (bytes): The EXIF block, with or without its 'Exif' prefix
+
+    Returns:
+        str | None: The DateTimeOriginal tag, or else the DateTime tag, of IFD0. None if there is neither.
+    """
+    if exif.startswith(EXIF_PREFIX):
+        exif = exif[len(EXIF_PREFIX) :]
+    byte_order = {b"II": "<", b"MM": ">"}.get(exif[:2])
+    if byte_order is None:
+        raise ExifHeaderError("Unknown TIFF byte order.")
+    magic, ifd_offset = struct.unpack(f"{byte_order}HI", exif[2:8])
+    if magic != 42:
+        raise ExifHeaderError("Not a classic TIFF header.")
+
+    (entry_count,) = struct.unpack(f"{byte_order}H", exif[ifd_offset : ifd_offset + 2])
+    datestrings = {}
+    for entry in range(entry_count):
+        start = ifd_offset + 2 + 12 * entry
+        tag, value_type, count, value = struct.unpack(f"{byte_order}HHI4s", exif[start : start + 12])
+        if tag not in (ExifBase.DateTimeOriginal, ExifBase.DateTime):
+            continue
+        if value_type != ASCII_TYPE:
+            raise ExifHeaderError(f"Tag {tag} is not stored as ASCII.")
+        if count > 4:
+            (value_offset,) = struct.unpack(f"{byte_order}I", value)
+            value = exif[value_offset : value_offset + count]
+            if len(value) < count:
+                raise ExifHeaderError(f"Tag {tag} points beyond the EXIF block.")
+        else:
+            value = value[:count]
+        # Decoded the way Pillow decodes ASCII tags.
+        if value.endswith(b"\x00"):
+            value = value[:-1]
+        datestrings[tag] = value.decode("latin-1", "replace")
+
+    if ExifBase.DateTimeOriginal in datestrings:
+        return datestrings[ExifBase.DateTimeOriginal]
+    return datestrings.get(ExifBase.DateTime)
@@ -2,7 +2,13 @@
 import json
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from mimetypes import guess_type
+from typing import NamedTuple
 
+import requests
 from google.auth.transport.requests import AuthorizedSession
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -16,6 +22,15 @@ debug = True
 if debug:
     logger.setLevel(logging.DEBUG)
 
+# Overridable to point the uploader at a stand-in of the Library API.
+API_BASE = os.environ.get("MEDIATOOL_PHOTOS_API", "https://photoslibrary.googleapis.com/v1")
+# batchCreate accepts at most 50 new media items per call.
+BATCH_CREATE_SIZE = 50
+# Files larger than this, typically videos, are uploaded with the resumable protocol.
+RESUMABLE_THRESHOLD = 32 * 1024 * 1024
+RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024
+RESUMABLE_RETRIES = 5
+
 
 def save_cred(cred, auth_file):
     cred_dict = {
@@ -76,27 +91,27 @@ def get_authorized_session(auth_token_file):
     return session
 
 
-def getAlbums(session, appCreatedOnly=False):
-    params = {"excludeNonAppCreatedData": appCreatedOnly}
+def album_pages(session, appCreatedOnly=False):
+    """The responses of the album listing, up to the last page or the first response without albums."""
+    params = {"excludeNonAppCreatedData": appCreatedOnly, "pageSize": 50}
 
     while True:
-        albums = session.get("https://photoslibrary.googleapis.com/v1/albums", params=params).json()
+        albums = session.get(f"{API_BASE}/albums", params=params).json()
 
         logger.debug("Server response: {}".format(albums))
 
-        if "albums" in albums:
-            for a in albums["albums"]:
-                yield a
-
-            if "nextPageToken" in albums:
-                params["pageToken"] = albums["nextPageToken"]
-            else:
-                return
-
+        yield albums
+        if "albums" in albums and "nextPageToken" in albums:
+            params["pageToken"] = albums["nextPageToken"]
         else:
             return
 
 
+def getAlbums(session, appCreatedOnly=False):
+    for page in album_pages(session, appCreatedOnly):
+        yield from page.get("albums", [])
+
+
 def create_or_retrieve_album(session, album_title):
     # Find albums created by this app to see if one matches album_title
 
@@ -108,88 +123,209 @@ def create_or_retrieve_album(session, album_title):
             return album_id
 
     # No matches, create new album
+    album = create_album(session, album_title)
+    return album["id"] if album else None
+
 
+def create_album(session, album_title) -> dict | None:
     create_album_body = json.dumps({"album": {"title": album_title}})
-    # print(create_album_body)
-    response = session.post("https://photoslibrary.googleapis.com/v1/albums", create_album_body).json()
+    response = session.post(f"{API_BASE}/albums", create_album_body).json()
 
     logger.debug(f"Server response: {response}")
 
     if "id" in response:
         logger.info(f"Creating NEW photo album -- '{album_title}'")
-        return response["id"]
+        return response
     else:
         logger.error(f"Could not find or create photo album '{album_title}'. Server Response: {response}")
         return None
 
 
-def upload_photos(session, photo_file_list, album_name):
-    album_id = create_or_retrieve_album(session, album_name) if album_name else None
+class UploadResult(NamedTuple):
+    filename: str
+    media_item: dict | None
+    error: str | None
 
-    # interrupt upload if an upload was requested but could not be created
-    if album_name and not album_id:
-        return
 
-    session.headers["Content-type"] = "application/octet-stream"
-    session.headers["X-Goog-Upload-Protocol"] = "raw"
+def upload_raw(session, photo_file_name, mime_type: str) -> str:
+    """Upload a file in a single request, streaming its contents, and return the upload token."""
+    headers = {
+        "Content-type": "application/octet-stream",
+        "X-Goog-Upload-Content-Type": mime_type,
+        "X-Goog-Upload-File-Name": os.path.basename(photo_file_name),
+        "X-Goog-Upload-Protocol": "raw",
+    }
+    with open(photo_file_name, mode="rb") as photo_file:
+        response = session.post(f"{API_BASE}/uploads", data=photo_file, headers=headers)
+    response.raise_for_status()
+    return response.content.decode()
+
+
+def upload_resumable(session, photo_file_name, mime_type: str, chunk_size: int = RESUMABLE_CHUNK_SIZE) -> str:
+    """Upload a file with the resumable protocol and return the upload token.
+
+    The file is sent in chunks of about chunk_size bytes. When a chunk fails, the server is asked how many bytes it
+    received and the upload resumes from there, up to RESUMABLE_RETRIES times.
+    """
+    size = os.path.getsize(photo_file_name)
+    start = session.post(
+        f"{API_BASE}/uploads",
+        headers={
+            "Content-Length": "0",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Content-Type": mime_type,
+            "X-Goog-Upload-File-Name": os.path.basename(photo_file_name),
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Raw-Size": str(size),
+        },
+    )
+    start.raise_for_status()
+    upload_url = start.headers["X-Goog-Upload-URL"]
+    # Every chunk but the last must be a multiple of the granularity.
+    granularity = int(start.headers.get("X-Goog-Upload-Chunk-Granularity", 1))
+    chunk_size = max(chunk_size // granularity, 1) * granularity
+
+    offset, retries = 0, 0
+    with open(photo_file_name, mode="rb") as photo_file:
+        while True:
+            photo_file.seek(offset)
+            chunk = photo_file.read(chunk_size)
+            last = offset + len(chunk) >= size
+            try:
+                response = session.post(
+                    upload_url,
+                    data=chunk,
+                    headers={
+                        "X-Goog-Upload-Command": "upload, finalize" if last else "upload",
+                        "X-Goog-Upload-Offset": str(offset),
+                    },
+                )
+                response.raise_for_status()
+            except requests.RequestException as err:
+                retries += 1
+                if retries > RESUMABLE_RETRIES:
+                    raise
+                logger.warning(f"Resuming upload of '{photo_file_name}' after error -- {err}")
+                query = session.post(upload_url, headers={"X-Goog-Upload-Command": "query"})
+                query.raise_for_status()
+                offset = int(query.headers["X-Goog-Upload-Size-Received"])
+                continue
+            if last:
+                return response.content.decode()
+            offset += len(chunk)
+
+
+def upload_file(session, photo_file_name) -> str:
+    mime_type = guess_type(photo_file_name)[0] or "application/octet-stream"
+    logger.info("Uploading photo -- '{}'".format(photo_file_name))
+    if os.path.getsize(photo_file_name) > RESUMABLE_THRESHOLD:
+        return upload_resumable(session, photo_file_name, mime_type)
+    return upload_raw(session, photo_file_name, mime_type)
+
+
+def batch_create(session, album_id, uploads: list[tuple[str, str]]) -> list[UploadResult]:
+    """Add up to BATCH_CREATE_SIZE uploaded files to the library, and to an album if album_id is set.
+
+    Args:
+        session: The authorized session
+        album_id: The id of the album or None
+        uploads (list[tuple[str, str]]): Pairs of a file name and its upload token
+
+    Returns:
+        list[UploadResult]: The media item or error of every file, in order
+    """
+    create_body = {
+        "newMediaItems": [
+            {"description": "", "simpleMediaItem": {"uploadToken": token, "fileName": os.path.basename(name)}}
+            for name, token in uploads
+        ]
+    }
+    if album_id:
+        create_body["albumId"] = album_id
+    response = session.post(f"{API_BASE}/mediaItems:batchCreate", json.dumps(create_body)).json()
 
-    for photo_file_name in photo_file_list:
-        try:
-            with open(photo_file_name, mode="rb") as photo_file:
-                photo_bytes = photo_file.read()
-        except OSError as err:
-            logger.error(f"Could not read file '{photo_file_name}' -- {err}")
-            continue
+    logger.debug(f"Server response: {response}")
 
-        session.headers["X-Goog-Upload-File-Name"] = os.path.basename(photo_file_name)
-
-        logger.info("Uploading photo -- '{}'".format(photo_file_name))
-
-        upload_token = session.post("https://photoslibrary.googleapis.com/v1/uploads", photo_bytes)
-
-        if (upload_token.status_code == 200) and (upload_token.content):
-            create_body = json.dumps(
-                {
-                    "albumId": album_id,
-                    "newMediaItems": [
-                        {
-                            "description": "",
-                            "simpleMediaItem": {"uploadToken": upload_token.content.decode()},
-                        }
-                    ],
-                },
-                indent=4,
-            )
-
-            response = session.post(
-                "https://photoslibrary.googleapis.com/v1/mediaItems:batchCreate",
-                create_body,
-            ).json()
-
-            logger.debug(f"Server response: {response}")
-
-            if "newMediaItemResults" in response:
-                status = response["newMediaItemResults"][0]["status"]
-                if status.get("code") and (status.get("code") > 0):
-                    logger.error(
-                        f"Could not add '{os.path.basename(photo_file_name)}' to library -- {status["message"]}"
-                    )
-                else:
-                    logger.info(f"Added '{os.path.basename(photo_file_name)}' to library and album '{album_name}'")
-            else:
-                logger.error(
-                    f"Could not add '{os.path.basename(photo_file_name)}' to library. Server Response -- {response}"
-                )
+    if "newMediaItemResults" not in response:
+        error = f"Server Response -- {response}"
+        return [UploadResult(name, None, error) for name, _ in uploads]
 
+    results_by_token = {result.get("uploadToken"): result for result in response["newMediaItemResults"]}
+    results = []
+    for name, token in uploads:
+        result = results_by_token.get(token)
+        if result is None:
+            results.append(UploadResult(name, None, "no result returned"))
+            continue
+        status = result.get("status", {})
+        if status.get("code") and (status.get("code") > 0):
+            results.append(UploadResult(name, None, status.get("message")))
         else:
-            logger.error(f"Could not upload '{os.path.basename(photo_file_name)}'. Server Response - {upload_token}")
+            results.append(UploadResult(name, result.get("mediaItem"), None))
+    return results
+
+
+def upload_photos(
+    session, photo_file_list, album_name, workers: int = 4, session_factory=None, album_id=None
+) -> list[UploadResult]:
+    """Upload files to the library, and to an album if album_name is set.
+
+    Files are uploaded by a pool of worker threads, each with its own session, and streamed from disk. Files larger
+    than RESUMABLE_THRESHOLD use the resumable protocol. The upload tokens are added to the library BATCH_CREATE_SIZE
+    at a time while the remaining files upload.
+
+    Args:
+        session: The authorized session, used for the album and batchCreate calls
+        photo_file_list: Paths of the files to upload
+        album_name: The title of the album, created if needed, or None
+        workers (int, optional): Number of upload threads. Defaults to 4.
+        session_factory (optional): Creates the session of each worker. Defaults to a new AuthorizedSession with the
+            credentials of session.
+        album_id (optional): The id of the album when it is already known, e.g. from photos_cache. Defaults to None.
+
+    Returns:
+        list[UploadResult]: The media item or error of every file, in order
+    """
+    if album_name and not album_id:
+        album_id = create_or_retrieve_album(session, album_name)
 
-    try:
-        del session.headers["Content-type"]
-        del session.headers["X-Goog-Upload-Protocol"]
-        del session.headers["X-Goog-Upload-File-Name"]
-    except KeyError:
-        pass
+    # interrupt upload if an upload was requested but could not be created
+    if album_name and not album_id:
+        return []
+
+    if session_factory is None:
+        session_factory = partial(AuthorizedSession, session.credentials)
+    worker_sessions = threading.local()
+
+    def upload(photo_file_name):
+        if not hasattr(worker_sessions, "session"):
+            worker_sessions.session = session_factory()
+        try:
+            token = upload_file(worker_sessions.session, photo_file_name)
+        except (OSError, requests.RequestException) as err:
+            return photo_file_name, None, str(err)
+        return photo_file_name, token, None if token else "Empty upload token"
+
+    results, uploads = [], []
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for photo_file_name, token, error in executor.map(upload, photo_file_list):
+            if error:
+                logger.error(f"Could not upload '{os.path.basename(photo_file_name)}' -- {error}")
+                results.append(UploadResult(photo_file_name, None, error))
+                continue
+            uploads.append((photo_file_name, token))
+            if len(uploads) == BATCH_CREATE_SIZE:
+                results += batch_create(session, album_id, uploads)
+                uploads = []
+        if uploads:
+            results += batch_create(session, album_id, uploads)
+
+    for result in results:
+        if result.error:
+            logger.error(f"Could not add '{os.path.basename(result.filename)}' to library -- {result.error}")
+        else:
+            logger.info(f"Added '{os.path.basename(result.filename)}' to library and album '{album_name}'")
+    return results
 
 
 def get_photos_from_album(session, album_name):
@@ -201,13 +337,15 @@ def get_photos_from_album(session, album_name):
 
     print(f"Found album {album_name} with id {album_id}.")
 
-    album_list_body = {"albumId": album_id}
+    yield from search_media_items(session, album_id)
+
+
+def search_media_items(session, album_id):
+    album_list_body = {"albumId": album_id, "pageSize": 100}
     while True:
         album_list_body_json = json.dumps(album_list_body)
 
-        media_items = session.post(
-            "https://photoslibrary.googleapis.com/v1/mediaItems:search", album_list_body_json
-        ).json()
+        media_items = session.post(f"{API_BASE}/mediaItems:search", album_list_body_json).json()
 
         logger.debug("Server response: {}".format(media_items))
 
@@ -0,0 +1,81 @@
+import hashlib
+import logging
+from functools import partial
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALGORITHM = "sha256"
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+HASHERS = {
+    "sha256": hashlib.sha256,
+    # A 32 byte digest keeps BLAKE2b digests the same length as sha256 ones.
+    "blake2b": partial(hashlib.blake2b, digest_size=32),
+}
+if xxhash:
+    HASHERS["xxh3_128"] = xxhash.xxh3_128
+if blake3:
+    HASHERS["blake3"] = blake3.blake3
+
+
+def available_algorithms() -> list[str]:
+    """Hash algorithms usable in this environment. xxh3_128 and blake3 need the optional xxhash and blake3 packages."""
+    return list(HASHERS)
+
+
+def new_hasher(algorithm: str = DEFAULT_ALGORITHM):
+    """Create a hash object for an algorithm
+
+    Args:
+        algorithm (str, optional): One of available_algorithms(). Defaults to DEFAULT_ALGORITHM.
+
+    Raises:
+        ValueError: If the algorithm is unknown or its optional package is not installed.
+
+    Returns:
+        A hash object with update() and hexdigest()
+    """
+    try:
+        return HASHERS[algorithm]()
+    except KeyError:
+        raise ValueError(f"Hash algorithm {algorithm} is not available. Choose from {', '.join(HASHERS)}.") from None
+
+
+def hash_file(filename, algorithm: str = DEFAULT_ALGORITHM, buffer_size: int = DEFAULT_BUFFER_SIZE) -> str:
+    """Hash the contents of a file
+
+    The file is read with readinto() into a single reusable buffer, so large files cost one syscall per buffer_size
+    bytes and no allocation per chunk.
+
+    Args:
+        filename: The path of the file
+        algorithm (str, optional): One of available_algorithms(). Defaults to DEFAULT_ALGORITHM.
+        buffer_size (int, optional): Number of bytes read per syscall. Defaults to DEFAULT_BUFFER_SIZE.
+
+    Returns:
+        str: The hex digest of the file contents
+    """
+    logger.debug(f"Getting {algorithm} of {filename}")
+    with open(filename, "rb", buffering=0) as f:
+        return hash_stream(f, algorithm, buffer_size)
+
+
+def hash_stream(binary_file, algorithm: str = DEFAULT_ALGORITHM, buffer_size: int = DEFAULT_BUFFER_SIZE) -> str:
+    """Hash an open binary file from its current position to the end, see hash_file."""
+    file_hash = new_hasher(algorithm)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while size := binary_file.readinto(buffer):
+        file_hash.update(view[:size])
+
+    return file_hash.hexdigest()
@@ -0,0 +1,275 @@
+import gzip
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+
+import click
+from more_itertools import chunked
+from sqlalchemy import case, select, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from catalog import inspect_file, inspect_in_pool, plan_work
+from db_utils import get_engine, refresh_duplicate_groups
+from hashing import DEFAULT_ALGORITHM, available_algorithms
+from logging_setup import logging_setup
+from models import Base, File
+from roots import DEFAULT_ROOT, RootConfig, assign_directories, load_roots, sync_roots
+from utils import MediaType, load_config
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logging_setup()
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+# Key of the manifest header in the schema metadata of Parquet manifests.
+PARQUET_HEADER_KEY = b"mediatool.manifest"
+# Rows buffered per row group of Parquet manifests.
+PARQUET_ROW_GROUP_SIZE = 10000
+
+# The File columns recorded for every file, by a path relative to the scanned directory.
+RECORD_FIELDS = ["path", "size", "sha256", "filetype", "datestamp"]
+
+
+def is_parquet(path: Path) -> bool:
+    return Path(path).suffix == ".parquet"
+
+
+def parquet_schema(header: dict):
+    schema = pa.schema(
+        [
+            ("path", pa.string()),
+            ("size", pa.int64()),
+            ("sha256", pa.string()),
+            ("filetype", pa.string()),
+            ("datestamp", pa.timestamp("us")),
+        ]
+    )
+    return schema.with_metadata({PARQUET_HEADER_KEY: json.dumps(header)})
+
+
+def scan_records(dir: Path, workers=0, queue_depth=64, hash_algorithm=DEFAULT_ALGORITHM, sniff=False):
+    """Inspect the images under a directory like fill_database, without a catalog.
+
+    Args:
+        dir (Path): The directory to scan
+        workers (int, optional): Number of threads inspecting files. 0 inspects them serially. Defaults to 0.
+        queue_depth (int, optional): Maximum number of files inspected ahead of the caller. Defaults to 64.
+        hash_algorithm (str, optional): The algorithm of the checksums. Defaults to DEFAULT_ALGORITHM.
+        sniff (bool, optional): Also include images whose extension does not say so. Defaults to False.
+
+    Yields:
+        dict: The manifest record of every image, in walk order
+    """
+    dir = Path(dir).absolute()
+    prefix = os.path.join(str(dir), "")
+    work = plan_work(dir, {}, None, hash_algorithm=hash_algorithm, sniff=sniff)
+    inspect = partial(inspect_file, hash_algorithm=hash_algorithm, sniff=sniff)
+    for pathname, _, values in inspect_in_pool(work, inspect, workers, queue_depth):
+        yield {
+            "path": pathname[len(prefix) :],
+            "size": values["size"],
+            "sha256": values["sha256"],
+            "filetype": values["filetype"].name if values["filetype"] else None,
+            "datestamp": values["datestamp"],
+        }
+
+
+def write_manifest(output: Path, records, header: dict) -> int:
+    """Stream manifest records to a JSONL file, gzip compressed if its name ends in .gz, or to a Parquet file.
+
+    JSONL manifests start with a line holding the header, Parquet manifests keep it in their schema metadata.
+
+    Args:
+        output (Path): The manifest file
+        records (Iterable[dict]): The records from scan_records
+        header (dict): What the records have in common, like the scanned root and the hash algorithm
+
+    Returns:
+        int: The number of records written
+    """
+    count = 0
+    if is_parquet(output):
+        if pq is None:
+            raise click.UsageError("Parquet manifests need the optional pyarrow package.")
+        schema = parquet_schema(header)
+        with pq.ParquetWriter(output, schema, compression="zstd") as writer:
+            for batch in chunked(records, PARQUET_ROW_GROUP_SIZE):
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+                count += len(batch)
+        return count
+
+    opener = gzip.open if Path(output).suffix == ".gz" else open
+    with opener(output, "wt", encoding="utf-8") as file:
+        file.write(json.dumps(header) + "\n")
+        for record in records:
+            datestamp = record["datestamp"]
+            file.write(json.dumps({**record, "datestamp": datestamp.isoformat() if datestamp else None}) + "\n")
+            count += 1
+    return count
+
+
+@contextmanager
+def open_manifest(path: Path, batch_size=500):
+    """Read a manifest batch by batch, so only one batch of records is in memory at a time.
+
+    Args:
+        path (Path): A manifest written by write_manifest
+        batch_size (int, optional): How many records per batch. Defaults to 500.
+
+    Yields:
+        tuple: (header, batches) where batches iterates over lists of records with their filetype as a MediaType
+            and their datestamp as a datetime
+    """
+    if is_parquet(path):
+        if pq is None:
+            raise click.UsageError("Parquet manifests need the optional pyarrow package.")
+        with pq.ParquetFile(path) as parquet_file:
+            header = json.loads(parquet_file.schema_arrow.metadata[PARQUET_HEADER_KEY])
+            batches = (batch.to_pylist() for batch in parquet_file.iter_batches(batch_size, columns=RECORD_FIELDS))
+            yield header, (list(map(parse_record, batch)) for batch in batches)
+        return
+
+    opener = gzip.open if Path(path).suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8") as file:
+        header = json.loads(file.readline())
+        records = (parse_record(json.loads(line)) for line in file)
+        yield header, chunked(records, batch_size)
+
+
+def parse_record(record: dict) -> dict:
+    datestamp = record["datestamp"]
+    if isinstance(datestamp, str):
+        record["datestamp"] = datetime.fromisoformat(datestamp)
+    record["filetype"] = MediaType[record["filetype"]] if record["filetype"] else None
+    return record
+
+
+def import_manifest(session: Session, path: Path, root: RootConfig = None, batch_size=500) -> int:
+    """Add or update the catalogued files from a manifest, batch_size rows per executemany statement.
+
+    Files are catalogued under root, where the scanned directory is mounted on this host. The stat
+    signature of imported rows is cleared, as the inode and device differ between hosts, so the next incremental scan
+    records the local signature of files of the same size instead of hashing them again. Perceptual hashes are kept
+    for files whose checksum did not change.
+
+    Args:
+        session (Session): The database session
+        path (Path): A manifest written by write_manifest
+        root (RootConfig, optional): The root the manifest paths are relative to. Defaults to the scanned directory.
+        batch_size (int, optional): How many rows to write per batch. Defaults to 500.
+
+    Returns:
+        int: The number of files imported
+    """
+    statement = insert(File)
+    same_content = File.sha256 == statement.excluded.sha256
+    statement = statement.on_conflict_do_update(
+        index_elements=[File.directory_id, File.basename],
+        set_={
+            "size": statement.excluded.size,
+            "sha256": statement.excluded.sha256,
+            "hash_algorithm": statement.excluded.hash_algorithm,
+            "filetype": statement.excluded.filetype,
+            "datestamp": statement.excluded.datestamp,
+            "partial_hash": None,
+            "mtime_ns": None,
+            "ctime_ns": None,
+            "inode": None,
+            "device": None,
+            "dhash": case((same_content, File.dhash), else_=None),
+            "phash": case((same_content, File.phash), else_=None),
+            "perceptual_error": case((same_content, File.perceptual_error), else_=None),
+        },
+    )
+
+    count = 0
+    with open_manifest(path, batch_size) as (header, batches):
+        [root] = sync_roots(session, [root or RootConfig(Path(header["root"]))])
+        root_id, hash_algorithm = root.id, header["hash_algorithm"]
+        logger.info(f"Importing the manifest of {header['root']} created {header['created']} under {root.path}")
+        for batch in batches:
+            rows = [{"root_id": root_id, "hash_algorithm": hash_algorithm, **record} for record in batch]
+            keys = [(row["directory_id"], row["basename"]) for row in assign_directories(session, rows)]
+            checksums = set(
+                session.scalars(select(File.sha256).where(tuple_(File.directory_id, File.basename).in_(keys)))
+            )
+            checksums.update(row["sha256"] for row in rows)
+            session.execute(statement, rows)
+            refresh_duplicate_groups(session, checksums)
+            session.commit()
+            count += len(rows)
+    logger.info(f"Imported {count} files.")
+    return count
+
+
+@click.group()
+def cli():
+    """Scan a directory into a manifest on the storage host and import manifests into the catalog."""
+
+
+@cli.command()
+@click.argument("dir", type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option(
+    "-o",
+    "--output",
+    required=True,
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="The manifest to write, .jsonl.gz or .parquet.",
+)
+@click.option("--workers", default=os.cpu_count(), show_default=True, help="Number of threads inspecting files.")
+@click.option("--queue-depth", default=64, show_default=True, help="Maximum number of files inspected ahead.")
+@click.option(
+    "--hash-algorithm",
+    type=click.Choice(available_algorithms()),
+    default=DEFAULT_ALGORITHM,
+    show_default=True,
+    help="Algorithm of the file checksums.",
+)
+@click.option("--sniff", is_flag=True, help="Also include images with a misleading extension, recognized by content.")
+def scan(dir, output, workers, queue_depth, hash_algorithm, sniff):
+    """Inspect the images under DIR and write them to a manifest."""
+    header = {
+        "manifest_version": MANIFEST_VERSION,
+        "root": str(dir.absolute()),
+        "hash_algorithm": hash_algorithm,
+        "created": datetime.now().isoformat(timespec="seconds"),
+    }
+    records = scan_records(dir, workers, queue_depth, hash_algorithm, sniff)
+    logger.info(f"Wrote {write_manifest(output, records, header)} files to {output}")
+
+
+@cli.command("import")
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option(
+    "--root",
+    "root_name",
+    default=DEFAULT_ROOT,
+    show_default=True,
+    help="The configured root where the scanned directory is mounted on this host.",
+)
+@click.option("--batch-size", default=500, show_default=True, help="Number of rows written per statement.")
+def import_command(manifest, root_name, batch_size):
+    """Add or update the files of MANIFEST in the catalog."""
+    _, DBFILE = load_config("mediatool.ini", force_previous_database=False)
+    root = next((root for root in load_roots("mediatool.ini") if root.name == root_name), None)
+    if root is None:
+        raise click.UsageError(f"No root named {root_name} in mediatool.ini.")
+    engine = get_engine(DBFILE)
+    Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        import_manifest(session, manifest, root, batch_size)
+
+
+if __name__ == "__main__":
+    cli()
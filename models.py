@@ -1,8 +1,19 @@
 import enum
 from datetime import datetime
 
-from sqlalchemy import DateTime, Enum, Integer, String
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    select,
+)
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 from utils import MediaType
 
@@ -11,14 +22,173 @@ class Base(DeclarativeBase):
     pass
 
 
+class Root(Base):
+    """A directory files are catalogued under, configured by name in mediatool.ini, see roots.load_roots.
+
+    Directories are stored by their path relative to their root, so a root mounted elsewhere only changes its own row.
+    """
+
+    __tablename__ = "root"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(), unique=True)
+    # The absolute path of the directory on this host, ending with a separator.
+    path: Mapped[str] = mapped_column(String())
+
+    def __repr__(self):
+        return f"Root: {self.name}\nPath {self.path}"
+
+
+class Directory(Base):
+    """A directory of catalogued files, stored once by its root and its path relative to it.
+
+    Files only store their basename, so the path of a directory is not repeated by each of its files and their index.
+    """
+
+    __tablename__ = "directory"
+    __table_args__ = (Index("ix_directory_root_id_path", "root_id", "path", unique=True),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    root_id: Mapped[int] = mapped_column(ForeignKey("root.id"))
+    # The path relative to the root ending with a separator, or "" for the root itself, see roots.split_path.
+    path: Mapped[str] = mapped_column(String())
+    # Loaded once per root and session, the rows after that are found in the identity map.
+    root: Mapped[Root] = relationship()
+
+    def __repr__(self):
+        return f"Directory: {self.path}\nRoot {self.root_id}"
+
+
 class File(Base):
     __tablename__ = "file"
+    __table_args__ = (Index("ix_file_directory_id_basename", "directory_id", "basename", unique=True),)
     id: Mapped[int] = mapped_column(primary_key=True)
-    name: Mapped[str] = mapped_column(String(), unique=True)
-    size: Mapped[int] = mapped_column(Integer)
-    sha256: Mapped[str] = mapped_column(String(64))
-    filetype: Mapped[enum.Enum] = mapped_column(Enum(MediaType), nullable=True)
-    datestamp: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    directory_id: Mapped[int] = mapped_column(ForeignKey("directory.id"))
+    basename: Mapped[str] = mapped_column(String())
+    # Loaded once per directory and session. Queries reading many files load their directories with selectinload.
+    directory: Mapped[Directory] = relationship()
+    size: Mapped[int] = mapped_column(Integer, index=True)
+    # Staged scans only compute the full checksum of files whose size and partial hash collide with another file.
+    # Despite its name the column holds the digest of hash_algorithm, see hashing.available_algorithms().
+    sha256: Mapped[str] = mapped_column(String(64), nullable=True, index=True)
+    hash_algorithm: Mapped[str] = mapped_column(String(16), nullable=True)
+    partial_hash: Mapped[str] = mapped_column(String(64), nullable=True)
+    filetype: Mapped[enum.Enum] = mapped_column(Enum(MediaType), nullable=True, index=True)
+    datestamp: Mapped[datetime] = mapped_column(DateTime, nullable=True, index=True)
+    # Stat signature recorded when the file was last inspected, used by incremental scans.
+    mtime_ns: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    ctime_ns: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    inode: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    device: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    # Perceptual hashes of images, stored as signed 64 bit integers, see perceptual.hash_images.
+    dhash: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    phash: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    # Set when the image could not be decoded for its perceptual hashes, so hash_perceptual does not retry it.
+    perceptual_error: Mapped[bool] = mapped_column(Boolean, nullable=True)
+
+    @hybrid_property
+    def name(self) -> str:
+        """The absolute path of the file."""
+        return self.directory.root.path + self.directory.path + self.basename
+
+    @name.inplace.expression
+    @classmethod
+    def _name_expression(cls):
+        # The basename is outside of the subquery, so selecting the name alone still selects from the file table.
+        directory_name = (
+            select(Root.path + Directory.path)
+            .where(Directory.id == cls.directory_id, Root.id == Directory.root_id)
+            .correlate_except(Directory, Root)
+        )
+        return directory_name.scalar_subquery() + cls.basename
+
+    @hybrid_property
+    def path(self) -> str:
+        """The path of the file relative to its root."""
+        return self.directory.path + self.basename
+
+    @path.inplace.expression
+    @classmethod
+    def _path_expression(cls):
+        directory_path = select(Directory.path).where(Directory.id == cls.directory_id).correlate_except(Directory)
+        return directory_path.scalar_subquery() + cls.basename
 
     def __repr__(self):
         return f"File: {self.name}\nSize {self.size}\nSHA256: {self.sha256}"
+
+
+class DuplicateGroup(Base):
+    """A checksum shared by more than one file.
+
+    Maintained by the catalog and by consolidate_files_db through db_utils.refresh_duplicate_groups, so duplicates
+    can be listed and paged through without grouping the whole file table.
+    """
+
+    __tablename__ = "duplicate_group"
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer)
+    total_bytes: Mapped[int] = mapped_column(BigInteger)
+    # The file with the lowest id.
+    representative_id: Mapped[int] = mapped_column(ForeignKey("file.id"))
+    representative: Mapped[File] = relationship()
+
+    def __repr__(self):
+        return f"DuplicateGroup: {self.sha256}\nCount {self.count}\nTotal bytes {self.total_bytes}"
+
+
+class NearDuplicate(Base):
+    """A checksum whose image looks like the images of other checksums in the same cluster.
+
+    Rebuilt from the perceptual hashes by db_utils.rebuild_near_duplicates. Rows of checksums no longer catalogued
+    are left until the next rebuild and ignored when reading.
+    """
+
+    __tablename__ = "near_duplicate"
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    cluster_id: Mapped[int] = mapped_column(Integer, index=True)
+
+    def __repr__(self):
+        return f"NearDuplicate: {self.sha256}\nCluster {self.cluster_id}"
+
+
+class RemoteAlbum(Base):
+    """A Google Photos album, cached by photos_cache so albums can be found by title without listing them all."""
+
+    __tablename__ = "remote_album"
+    id: Mapped[str] = mapped_column(String(), primary_key=True)
+    title: Mapped[str] = mapped_column(String())
+    # The lower cased title, which album lookups compare.
+    title_key: Mapped[str] = mapped_column(String(), index=True)
+    media_items_count: Mapped[int] = mapped_column(Integer, default=0)
+    # media_items_count when the items of the album were last listed, None if they never were.
+    listed_count: Mapped[int] = mapped_column(Integer, nullable=True)
+
+    def __repr__(self):
+        return f"RemoteAlbum: {self.title}\nID {self.id}\nItems {self.media_items_count}"
+
+
+class RemoteMediaItem(Base):
+    __tablename__ = "remote_media_item"
+    id: Mapped[str] = mapped_column(String(), primary_key=True)
+    filename: Mapped[str] = mapped_column(String(), index=True)
+    mime_type: Mapped[str] = mapped_column(String(), nullable=True)
+
+    def __repr__(self):
+        return f"RemoteMediaItem: {self.filename}\nID {self.id}"
+
+
+class RemoteAlbumItem(Base):
+    __tablename__ = "remote_album_item"
+    album_id: Mapped[str] = mapped_column(ForeignKey("remote_album.id"), primary_key=True)
+    media_item_id: Mapped[str] = mapped_column(ForeignKey("remote_media_item.id"), primary_key=True)
+
+
+class Upload(Base):
+    """Content uploaded to Google Photos, keyed by checksum so the same bytes are never sent twice."""
+
+    __tablename__ = "upload"
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    media_item_id: Mapped[str] = mapped_column(String())
+    album_id: Mapped[str] = mapped_column(String(), nullable=True)
+    uploaded_at: Mapped[datetime] = mapped_column(DateTime)
+
+    def __repr__(self):
+        return f"Upload: {self.sha256}\nMedia item {self.media_item_id}\nUploaded at {self.uploaded_at}"
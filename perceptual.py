@@ -0,0 +1,313 @@
+"""Perceptual hashes, which stay close when an image is resized, re-encoded or recompressed.
+
+A difference hash (dHash) shrinks the image to 9x8 grey pixels and sets one bit per pair of horizontal neighbours,
+giving 64 bits. A DCT hash (pHash) shrinks it to 32x32 and sets one bit per low frequency coefficient above their
+median, also 64 bits. Copies of the same photo differ in a few bits, measured by the Hamming distance, while unrelated
+images differ in about half of them.
+
+The pHash, and hashing and clustering whole batches with array operations, need the optional numpy package.
+"""
+
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, combinations
+from typing import Collection, Hashable, Iterable, Iterator
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DHASH_SIZE = 8
+PHASH_SIZE = 32
+# The pHash keeps the lowest PHASH_BITS x PHASH_BITS frequencies of the PHASH_SIZE x PHASH_SIZE image.
+PHASH_BITS = 8
+# Images are decoded at a reduced scale of at least this many pixels per edge before being shrunk.
+DHASH_DRAFT_SIZE = 64
+# Hamming distance up to which two hashes are considered the same picture.
+DEFAULT_THRESHOLD = 8
+
+UINT64_MASK = (1 << 64) - 1
+# Blocks of the multi-index up to this many bits are looked up in a table with an entry per key, of 128 MiB at most.
+BUCKET_TABLE_MAX_WIDTH = 24
+
+
+def available_hashes() -> list[str]:
+    """The perceptual hashes computed in this environment, named after their File column. phash needs numpy."""
+    return ["dhash", "phash"] if np is not None else ["dhash"]
+
+
+def to_signed64(value: int) -> int:
+    """A 64 bit hash as the signed integer SQLite stores."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned64(value: int) -> int:
+    return value & UINT64_MASK
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def load_grey(image_path) -> Image.Image:
+    """Decode an image upright and grey, at a reduced scale for JPEGs.
+
+    JPEGs are decoded with draft(), which scales them down while reading, and the EXIF orientation is applied so a
+    rotated export hashes like its original.
+
+    Raises:
+        OSError: If the image can not be read.
+    """
+    with Image.open(image_path) as image:
+        image.draft("L", (DHASH_DRAFT_SIZE, DHASH_DRAFT_SIZE))
+        return ImageOps.exif_transpose(image).convert("L")
+
+
+def dhash(image: Image.Image, size: int = DHASH_SIZE) -> int:
+    """The difference hash of an image, an unsigned integer of size * size bits."""
+    grey = image.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS)
+    pixels = grey.tobytes()
+    value = 0
+    for row in range(size):
+        start = row * (size + 1)
+        for column in range(size):
+            value = (value << 1) | (pixels[start + column] > pixels[start + column + 1])
+    return value
+
+
+def image_dhash(image_path) -> int | None:
+    """The difference hash of an image file, as stored in File.dhash, or None if the image can not be read."""
+    try:
+        return to_signed64(dhash(load_grey(image_path)))
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning(f"Unable to compute the perceptual hash of {image_path}. {e}")
+        return None
+
+
+def pack_bits(bits):
+    """Pack rows of 64 booleans, first one most significant, into an array of uint64."""
+    return np.packbits(bits, axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def popcount64(values):
+    """The number of set bits of every uint64 of an array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def dhash_batch(pixels):
+    """The difference hashes of a stack of (DHASH_SIZE, DHASH_SIZE + 1) grey images, as uint64."""
+    bits = pixels[:, :, :-1] > pixels[:, :, 1:]
+    return pack_bits(bits.reshape(len(pixels), -1))
+
+
+def dct_matrix(size: int):
+    """The unnormalized DCT-II basis, row k holding frequency k."""
+    frequencies = np.arange(size)[:, np.newaxis]
+    samples = np.arange(size)[np.newaxis, :]
+    return 2 * np.cos(np.pi * frequencies * (2 * samples + 1) / (2 * size))
+
+
+def phash_batch(pixels):
+    """The DCT hashes of a stack of (PHASH_SIZE, PHASH_SIZE) grey images, as uint64.
+
+    Only the PHASH_BITS lowest frequencies of each axis are computed, with two matrix products over the whole stack.
+    """
+    basis = dct_matrix(PHASH_SIZE)[:PHASH_BITS].astype(np.float32)
+    coefficients = (basis @ pixels @ basis.T).reshape(len(pixels), -1)
+    return pack_bits(coefficients > np.median(coefficients, axis=1, keepdims=True))
+
+
+def _grey_grids(image_path):
+    try:
+        grey = load_grey(image_path)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning(f"Unable to compute the perceptual hash of {image_path}. {e}")
+        return None
+    return (
+        np.asarray(grey.resize((DHASH_SIZE + 1, DHASH_SIZE), Image.Resampling.LANCZOS)),
+        np.asarray(grey.resize((PHASH_SIZE, PHASH_SIZE), Image.Resampling.LANCZOS), dtype=np.float32),
+    )
+
+
+def hash_images(image_paths: list, workers: int = 0) -> list[tuple[int | None, int | None]]:
+    """The dHash and pHash of a batch of image files, as stored in File.dhash and File.phash.
+
+    Each image is decoded once, at a reduced scale, into small grey grids, by a pool of threads as Pillow releases
+    the GIL while decoding. The hashes of the whole batch are then computed by a handful of array operations. Without
+    numpy the dHash is computed one image at a time and the pHash is None.
+
+    Args:
+        image_paths (list): The paths of the images
+        workers (int, optional): Number of threads decoding images. 0 decodes them serially. Defaults to 0.
+
+    Returns:
+        list[tuple[int | None, int | None]]: The dHash and pHash of every image, None for images which can not be read
+    """
+    if np is None:
+        return [(image_dhash(image_path), None) for image_path in image_paths]
+
+    if workers:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            grids = list(executor.map(_grey_grids, image_paths))
+    else:
+        grids = list(map(_grey_grids, image_paths))
+    readable = [grid for grid in grids if grid is not None]
+    if not readable:
+        return [(None, None)] * len(grids)
+
+    dhashes = dhash_batch(np.stack([dhash_pixels for dhash_pixels, _ in readable])).tolist()
+    phashes = phash_batch(np.stack([phash_pixels for _, phash_pixels in readable])).tolist()
+    hashes = iter(zip(map(to_signed64, dhashes), map(to_signed64, phashes)))
+    return [next(hashes) if grid is not None else (None, None) for grid in grids]
+
+
+def index_blocks(count: int, threshold: int, bits: int = 64) -> tuple[int, list[tuple[int, int]]]:
+    """Split the bits of count hashes into blocks for a multi-index, see HashIndex.
+
+    Returns:
+        tuple[int, list[tuple[int, int]]]: The search radius within a block, and the shift and width of every block
+    """
+    block_count = min(threshold + 1, max(bits // max(count.bit_length(), 1), 1))
+    widths = [bits // block_count + (block < bits % block_count) for block in range(block_count)]
+    shifts = [sum(widths[block + 1 :]) for block in range(block_count)]
+    return threshold // block_count, list(zip(shifts, widths))
+
+
+def flips(width: int, radius: int) -> list[int]:
+    """The masks flipping at most radius of width bits."""
+    return [
+        sum(1 << bit for bit in bits) for flipped in range(radius + 1) for bits in combinations(range(width), flipped)
+    ]
+
+
+class HashIndex:
+    """A multi-index of hashes, finding all hashes within a Hamming distance without comparing every pair.
+
+    The bits are split into blocks. Two hashes within threshold bits of each other differ in at most
+    threshold // blocks bits of at least one block, so a search only compares the hashes filed under the variants of
+    each of its blocks within that radius. Blocks of about log2(len(values)) bits leave about one hash per variant,
+    so a search costs about the same however many hashes are indexed and clustering n hashes grows with n.
+
+    Unlike a BK-tree, the cost of a search does not depend on how the distances between unrelated hashes are
+    distributed, which for perceptual hashes cluster around half the bits.
+    """
+
+    def __init__(self, values: Collection[int], threshold: int = DEFAULT_THRESHOLD, bits: int = 64):
+        self.threshold = threshold
+        self.radius, blocks = index_blocks(len(values), threshold, bits)
+        self.blocks = [(shift, (1 << width) - 1, flips(width, self.radius)) for shift, width in blocks]
+        self.tables = [defaultdict(list) for _ in self.blocks]
+        self.size = 0
+        for value in values:
+            self.add(value)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value: int):
+        for (shift, mask, _), table in zip(self.blocks, self.tables):
+            table[(value >> shift) & mask].append(value)
+        self.size += 1
+
+    def search(self, value: int) -> set[int]:
+        """The hashes in the index within threshold bits of value, including value itself."""
+        candidates = set()
+        for (shift, mask, block_flips), table in zip(self.blocks, self.tables):
+            key = (value >> shift) & mask
+            # Look the variants up without a Python loop, there are hundreds of them and most have no hashes.
+            candidates.update(chain.from_iterable(filter(None, map(table.get, map(key.__xor__, block_flips)))))
+        return {candidate for candidate in candidates if hamming_distance(value, candidate) <= self.threshold}
+
+
+def _near_pairs_numpy(values: list[int], threshold: int) -> Iterator[tuple[int, int]]:
+    # The multi-index of HashIndex, probing one variant of every hash at a time. Each block is sorted once, and the
+    # hashes filed under a variant are found through a table of where every key starts in the sorted keys, or by a
+    # search for blocks too wide for a table. Candidates are checked with XOR and popcount.
+    hashes = np.array(values, dtype=np.uint64)
+    radius, blocks = index_blocks(len(hashes), threshold)
+    for shift, width in blocks:
+        keys = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        if width <= BUCKET_TABLE_MAX_WIDTH:
+            keys = keys.astype(np.intp)
+            bounds = np.searchsorted(sorted_keys, np.arange((1 << width) + 1, dtype=np.uint64))
+        for flip in flips(width, radius):
+            if width <= BUCKET_TABLE_MAX_WIDTH:
+                variants = keys ^ flip
+                starts, ends = bounds[variants], bounds[variants + 1]
+            else:
+                variants = keys ^ np.uint64(flip)
+                starts, ends = np.searchsorted(sorted_keys, variants, "left"), np.searchsorted(
+                    sorted_keys, variants, "right"
+                )
+            counts = ends - starts
+            matched = counts.nonzero()[0]
+            if not len(matched):
+                continue
+            counts = counts[matched]
+            first = np.repeat(matched, counts)
+            offsets = np.arange(len(first)) - np.repeat(np.cumsum(counts) - counts, counts)
+            second = order[np.repeat(starts[matched], counts) + offsets]
+            near = (first < second) & (popcount64(hashes[first] ^ hashes[second]) <= threshold)
+            yield from zip(first[near].tolist(), second[near].tolist())
+
+
+def near_pairs(values: list[int], threshold: int = DEFAULT_THRESHOLD) -> Iterator[tuple[int, int]]:
+    """The index pairs i < j of distinct hashes within threshold bits of each other, some possibly more than once.
+
+    With numpy, all the hashes are probed at once with array operations, otherwise one at a time in a HashIndex.
+    """
+    if np is not None:
+        yield from _near_pairs_numpy(values, threshold)
+        return
+    index = HashIndex(values, threshold)
+    positions = {value: position for position, value in enumerate(values)}
+    for position, value in enumerate(values):
+        for other in index.search(value):
+            if position < positions[other]:
+                yield position, positions[other]
+
+
+def cluster_hashes(hashes: Iterable[tuple[Hashable, int]], threshold: int = DEFAULT_THRESHOLD) -> list[list]:
+    """Group keys whose hashes are within threshold bits of each other.
+
+    Clusters are the connected components of the graph linking hashes within threshold, so a chain of small edits
+    ends up in one cluster. The links are found by near_pairs.
+
+    Args:
+        hashes: Pairs of a key, e.g. a checksum, and its unsigned hash
+        threshold (int, optional): The largest Hamming distance linking two hashes. Defaults to DEFAULT_THRESHOLD.
+
+    Returns:
+        list[list]: The sorted keys of every cluster of more than one key, ordered by their first key
+    """
+    keys_by_hash = defaultdict(list)
+    for key, value in hashes:
+        keys_by_hash[value].append(key)
+    values = list(keys_by_hash)
+    parent = list(range(len(values)))
+
+    def find(position):
+        while parent[position] != position:
+            parent[position] = parent[parent[position]]
+            position = parent[position]
+        return position
+
+    for position, other in near_pairs(values, threshold):
+        root, other_root = find(position), find(other)
+        if root != other_root:
+            parent[other_root] = root
+
+    clusters = defaultdict(list)
+    for position, value in enumerate(values):
+        clusters[find(position)].extend(keys_by_hash[value])
+    return sorted((sorted(keys) for keys in clusters.values() if len(keys) > 1), key=lambda keys: keys[0])
@@ -0,0 +1,145 @@
+"""Local cache of the Google Photos albums and media items seen by the uploader.
+
+Albums are listed once per refresh and looked up by title through an index instead of paging through every album.
+The items of an album are only listed again when its mediaItemsCount differs from the count it had when they were
+last listed, and items uploaded by this tool are recorded as they are created.
+"""
+
+import logging
+
+from more_itertools import chunked
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from db_utils import SQLITE_BATCH_SIZE
+from google_library import album_pages, create_album, search_media_items
+from models import RemoteAlbum, RemoteAlbumItem, RemoteMediaItem
+
+logger = logging.getLogger(__name__)
+
+
+def album_values(album: dict) -> dict:
+    return {
+        "id": album["id"],
+        "title": album.get("title", ""),
+        "title_key": album.get("title", "").lower(),
+        "media_items_count": int(album.get("mediaItemsCount", 0)),
+    }
+
+
+def refresh_albums(session: Session, google_session) -> int:
+    """Replace the cached albums with a fresh listing, keeping the listed items of albums that still exist.
+
+    Albums missing from the listing are only dropped when it ended with a last page of albums. An error response, an
+    expired token or an empty listing would otherwise drop every cached album, and the next sync would upload into
+    new albums.
+
+    Returns:
+        int: The number of albums
+    """
+    albums, complete = [], False
+    for page in album_pages(google_session, False):
+        albums += [album_values(album) for album in page.get("albums", [])]
+        complete = "albums" in page and "nextPageToken" not in page
+    for batch in chunked(albums, SQLITE_BATCH_SIZE):
+        statement = insert(RemoteAlbum).values(batch)
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[RemoteAlbum.id],
+                set_={
+                    "title": statement.excluded.title,
+                    "title_key": statement.excluded.title_key,
+                    "media_items_count": statement.excluded.media_items_count,
+                },
+            )
+        )
+    if complete and albums:
+        current_ids = [album["id"] for album in albums]
+        gone = select(RemoteAlbum.id).where(RemoteAlbum.id.not_in(current_ids))
+        session.execute(delete(RemoteAlbumItem).where(RemoteAlbumItem.album_id.in_(gone)))
+        session.execute(delete(RemoteAlbum).where(RemoteAlbum.id.not_in(current_ids)))
+    else:
+        logger.warning("The album listing was empty or incomplete, keeping the cached albums it did not list.")
+    session.commit()
+    logger.info(f"Cached {len(albums)} albums.")
+    return len(albums)
+
+
+def find_album(session: Session, title: str) -> RemoteAlbum | None:
+    return session.scalars(select(RemoteAlbum).where(RemoteAlbum.title_key == title.lower()).limit(1)).first()
+
+
+def get_album(session: Session, google_session, title: str) -> RemoteAlbum | None:
+    """Find an album by title in the cache, refreshing the cache once if it is missing, or else create it.
+
+    Returns:
+        RemoteAlbum | None: The album, None if it could not be created
+    """
+    album = find_album(session, title)
+    if album is None:
+        refresh_albums(session, google_session)
+        album = find_album(session, title)
+    if album is None:
+        created = create_album(google_session, title)
+        if created is None:
+            return None
+        album = RemoteAlbum(**album_values(created), listed_count=0)
+        session.add(album)
+        session.commit()
+    return album
+
+
+def add_album_items(session: Session, album: RemoteAlbum, media_items: list[dict]):
+    """Cache media items and their membership of an album. The caller commits."""
+    items = [
+        {"id": item["id"], "filename": item.get("filename", ""), "mime_type": item.get("mimeType")}
+        for item in media_items
+    ]
+    for batch in chunked(items, SQLITE_BATCH_SIZE):
+        statement = insert(RemoteMediaItem).values(batch)
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[RemoteMediaItem.id],
+                set_={"filename": statement.excluded.filename, "mime_type": statement.excluded.mime_type},
+            )
+        )
+        memberships = [{"album_id": album.id, "media_item_id": item["id"]} for item in batch]
+        session.execute(insert(RemoteAlbumItem).values(memberships).on_conflict_do_nothing())
+
+
+def refresh_album_items(session: Session, google_session, album: RemoteAlbum, force: bool = False) -> bool:
+    """List the items of an album again if its item count changed since they were last listed.
+
+    Returns:
+        bool: Whether the items were listed
+    """
+    if not force and album.listed_count == album.media_items_count:
+        logger.debug(f"Items of album '{album.title}' are up to date.")
+        return False
+
+    media_items = list(search_media_items(google_session, album.id))
+    session.execute(delete(RemoteAlbumItem).where(RemoteAlbumItem.album_id == album.id))
+    add_album_items(session, album, media_items)
+    album.media_items_count = album.listed_count = len(media_items)
+    session.commit()
+    logger.info(f"Cached {len(media_items)} items of album '{album.title}'.")
+    return True
+
+
+def record_uploaded_items(session: Session, album: RemoteAlbum, media_items: list[dict]):
+    """Cache items just added to an album, so the next refresh does not need to list the album again."""
+    add_album_items(session, album, media_items)
+    album.media_items_count += len(media_items)
+    if album.listed_count is not None:
+        album.listed_count += len(media_items)
+    session.commit()
+
+
+def album_filenames(session: Session, album: RemoteAlbum) -> set[str]:
+    statement = (
+        select(RemoteMediaItem.filename)
+        .join(RemoteAlbumItem, RemoteAlbumItem.media_item_id == RemoteMediaItem.id)
+        .where(RemoteAlbumItem.album_id == album.id)
+    )
+    return set(session.scalars(statement))
@@ -0,0 +1,95 @@
+"""Rules which pick the file to keep of each duplicate group without asking.
+
+A policy is a list of rules applied in order, each one only breaking the ties left by the rules before it. A rule
+maps a catalogued file to a sort key and the file with the lowest key is kept. Ties left by every rule go to the
+file with the lowest id, the one catalogued first.
+"""
+
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple
+
+from sqlalchemy.orm import Session
+
+from db_utils import iter_duplicate_groups
+from models import File
+from utils import get_recommended_filename
+
+Rule = Callable[[File], object]
+
+
+def shortest_path() -> Rule:
+    return lambda file: len(file.name)
+
+
+def under_root(root: str) -> Rule:
+    root = Path(root)
+    return lambda file: not Path(file.name).is_relative_to(root)
+
+
+def recommended_name() -> Rule:
+    def is_not_recommended(file: File) -> bool:
+        if file.datestamp is None:
+            return True
+        path = Path(file.name)
+        # The stored datestamp saves opening the image again.
+        return path != get_recommended_filename(path, datestamp=file.datestamp)
+
+    return is_not_recommended
+
+
+def oldest_mtime() -> Rule:
+    # Files catalogued before mtimes were recorded sort last.
+    return lambda file: (file.mtime_ns is None, file.mtime_ns or 0)
+
+
+POLICIES = {
+    "shortest-path": shortest_path,
+    "under-root": under_root,
+    "recommended-name": recommended_name,
+    "oldest-mtime": oldest_mtime,
+}
+
+
+def parse_rule(spec: str) -> Rule:
+    """Create a rule from its name, followed by '=argument' for rules taking one, e.g. 'under-root=/photos'.
+
+    Raises:
+        ValueError: If the rule is unknown or its argument is missing or unexpected.
+    """
+    name, _, argument = spec.partition("=")
+    if name not in POLICIES:
+        raise ValueError(f"Unknown policy {name}. Choose from {', '.join(POLICIES)}.")
+    try:
+        return POLICIES[name](argument) if argument else POLICIES[name]()
+    except TypeError:
+        raise ValueError(f"Invalid argument for policy {name}: '{argument}'") from None
+
+
+class Resolution(NamedTuple):
+    sha256: str
+    keep: str
+    remove: list[str]
+    reclaimable_bytes: int
+
+
+def choose_file(files: list[File], rules: list[Rule]) -> File:
+    return min(files, key=lambda file: (*(rule(file) for rule in rules), file.id))
+
+
+def resolve_duplicates(session: Session, rules: list[Rule], batch_size: int = 500) -> Iterator[Resolution]:
+    """Pick the file to keep of every duplicate group.
+
+    Groups and their files are read batch_size groups at a time, with one query for the files of each batch.
+
+    Args:
+        session (Session): The database session
+        rules (list[Rule]): The rules of the policy, in order of precedence
+        batch_size (int, optional): Number of groups read per query. Defaults to 500.
+
+    Yields:
+        Resolution: The checksum, the file to keep, the files to remove and the bytes their removal frees
+    """
+    for group, files in iter_duplicate_groups(session, batch_size=batch_size):
+        keep = choose_file(files, rules)
+        remove = [file for file in files if file is not keep]
+        yield Resolution(group.sha256, keep.name, [file.name for file in remove], sum(file.size for file in remove))
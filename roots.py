@@ -0,0 +1,291 @@
+"""Named directories the catalogued files are stored relative to.
+
+mediatool.ini configures any number of roots in [root:<name>] sections, with the path where the root is mounted on
+this host and optionally how many workers may read from it at once and whether watcher.py polls it for changes:
+
+    [root:photos]
+    path = /mnt/nas/photos
+    workers = 8
+
+    [root:archive]
+    path = /mnt/usb/archive
+    workers = 1
+    poll = yes
+
+The data_dir of the [mediatool] section is the root named default. Roots are matched to their row in the root table
+by name, so mounting a root elsewhere only changes the path of its row.
+
+Files are stored by their directory, a row of the directory table with its path relative to the root, and their
+basename. Rows to insert name their file by root_id and relative path, and assign_directories turns those into the
+directory_id and basename columns.
+"""
+
+import logging
+import os
+from collections import defaultdict
+from configparser import ConfigParser
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+from more_itertools import chunked
+from sqlalchemy import and_, delete, exists, false, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from models import Directory, File, Root
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOT = "default"
+# The root at "/" the add_root_table migration files catalogued rows under when they are under no configured root.
+LEGACY_ROOT = "legacy"
+ROOT_SECTION_PREFIX = "root:"
+# Directory paths looked up per statement. The same as db_utils.SQLITE_BATCH_SIZE, which cannot be imported here as
+# db_utils imports this module.
+DIRECTORY_BATCH_SIZE = 500
+
+
+class RootConfig(NamedTuple):
+    path: Path
+    # Roots without a name are matched by path and named after it when they are new.
+    name: str | None = None
+    # How many files of the root are inspected at once, or None for the --workers of the scan.
+    workers: int | None = None
+    # Whether watcher.py polls the root for changes, for network mounts which do not report them.
+    poll: bool = False
+
+
+def root_path(path: Path) -> str:
+    """The form of a directory stored in Root.path, absolute and ending with a separator."""
+    return os.path.join(str(Path(path).absolute()), "")
+
+
+def load_roots(config_file) -> list[RootConfig]:
+    """Read the roots configured in mediatool.ini.
+
+    Args:
+        config_file (str): The configuration file
+
+    Returns:
+        list[RootConfig]: The root named default for the data_dir of the [mediatool] section, if set, and the roots
+            of the [root:<name>] sections
+    """
+    config = ConfigParser()
+    config.read(config_file)
+    roots = []
+    data_dir = config.get("mediatool", "data_dir", fallback=None)
+    if data_dir:
+        roots.append(RootConfig(Path(data_dir), DEFAULT_ROOT))
+    for section in config.sections():
+        if section.startswith(ROOT_SECTION_PREFIX):
+            name = section[len(ROOT_SECTION_PREFIX) :]
+            workers = config.getint(section, "workers", fallback=None)
+            poll = config.getboolean(section, "poll", fallback=False)
+            roots.append(RootConfig(Path(config.get(section, "path")), name, workers, poll))
+    return roots
+
+
+def sync_roots(session: Session, configs: Iterable[RootConfig]) -> list[Root]:
+    """Find or create the rows of roots and update the paths of roots mounted elsewhere, then commit.
+
+    A root is matched by name, or by path if it has no name or no row of that name exists yet. A row matched by path
+    is renamed after the configured root.
+
+    Args:
+        session (Session): The database session
+        configs (Iterable[RootConfig]): The roots
+
+    Returns:
+        list[Root]: The row of every root, in the same order
+    """
+    rows = []
+    for config in configs:
+        path = root_path(config.path)
+        row = None
+        if config.name:
+            row = session.scalar(select(Root).where(Root.name == config.name))
+        if row is None:
+            row = session.scalars(select(Root).where(Root.path == path)).first()
+        if row is None:
+            row = Root(name=config.name or path, path=path)
+            session.add(row)
+            logger.info(f"Adding root {row.name} at {path}")
+        else:
+            if row.path != path:
+                logger.info(f"Root {row.name} moved from {row.path} to {path}")
+                row.path = path
+            if config.name:
+                row.name = config.name
+        rows.append(row)
+    session.commit()
+    return rows
+
+
+def split_path(path: str) -> tuple[str, str]:
+    """Split a path relative to a root into the Directory.path of its directory and its basename.
+
+    The directory ends with a separator, or is "" for files directly under the root, so the path is their
+    concatenation.
+    """
+    head, basename = os.path.split(path)
+    return os.path.join(head, ""), basename
+
+
+def locate_name(roots: Iterable[Root], name: str) -> tuple[int, str] | None:
+    """Find the root an absolute file name is under.
+
+    Args:
+        roots (Iterable[Root]): The roots, the longest path first so names under nested roots belong to the innermost
+            one
+        name (str): An absolute file name
+
+    Returns:
+        tuple[int, str] | None: The id of the root and the path relative to it, or None if the name is under no root
+    """
+    root = next((root for root in roots if name.startswith(root.path)), None)
+    return None if root is None else (root.id, name[len(root.path) :])
+
+
+def innermost_roots(session: Session) -> list[Root]:
+    """The rows of every root, the longest path first as locate_name expects."""
+    return sorted(session.scalars(select(Root)), key=lambda root: len(root.path), reverse=True)
+
+
+def destination_roots(roots: Iterable[Root]) -> list[Root]:
+    """The roots new names are located under, leaving out the legacy root when there are others.
+
+    The legacy root contains every absolute name, so a file moved or added outside of the configured roots would be
+    filed under it. Names already catalogued under it are still located with all the roots.
+
+    Args:
+        roots (Iterable[Root]): The roots, the longest path first, see locate_name
+
+    Returns:
+        list[Root]: The roots, in the same order
+    """
+    roots = list(roots)
+    configured = [root for root in roots if not (root.name == LEGACY_ROOT and root.path == "/")]
+    return configured or roots
+
+
+def split_names(roots: Iterable[Root], names: Iterable[str]) -> dict[int, list[str]]:
+    """Group absolute file names by the root they are under.
+
+    Args:
+        roots (Iterable[Root]): The roots
+        names (Iterable[str]): Absolute file names. Names under no root are left out.
+
+    Returns:
+        dict[int, list[str]]: The paths relative to their root, by root id
+    """
+    # The longest path first, so names under nested roots belong to the innermost one.
+    roots = sorted(roots, key=lambda root: len(root.path), reverse=True)
+    paths_by_root = defaultdict(list)
+    for name in names:
+        located = locate_name(roots, name)
+        if located is not None:
+            paths_by_root[located[0]].append(located[1])
+    return paths_by_root
+
+
+def directory_ids(session: Session, root_id: int, paths: Iterable[str]) -> dict[str, int]:
+    """Find or add the rows of directories of a root, through the unique index on the root and path.
+
+    The caller commits.
+
+    Args:
+        session (Session): The database session
+        root_id (int): The id of the root
+        paths (Iterable[str]): Directory paths relative to the root, see split_path
+
+    Returns:
+        dict[str, int]: The id of every directory, by path
+    """
+    ids = {}
+    for batch in chunked(set(paths), DIRECTORY_BATCH_SIZE):
+        statement = select(Directory.path, Directory.id).where(Directory.root_id == root_id, Directory.path.in_(batch))
+        ids.update(session.execute(statement).all())
+        missing = [{"root_id": root_id, "path": path} for path in batch if path not in ids]
+        if missing:
+            ids.update(session.execute(insert(Directory).returning(Directory.path, Directory.id), missing).all())
+    return ids
+
+
+def assign_directories(session: Session, rows: list[dict]) -> list[dict]:
+    """Replace the root_id and path of File rows to insert with their directory_id and basename.
+
+    Directories which have no row yet are added, the caller commits.
+
+    Args:
+        session (Session): The database session
+        rows (list[dict]): File columns, with root_id and the path relative to the root. They are changed in place.
+
+    Returns:
+        list[dict]: The rows
+    """
+    paths_by_root = defaultdict(set)
+    for row in rows:
+        row["directory"], row["basename"] = split_path(row.pop("path"))
+        paths_by_root[row["root_id"]].add(row["directory"])
+    ids = {
+        (root_id, path): id
+        for root_id, paths in paths_by_root.items()
+        for path, id in directory_ids(session, root_id, paths).items()
+    }
+    for row in rows:
+        row["directory_id"] = ids[row.pop("root_id"), row.pop("directory")]
+    return rows
+
+
+def under_directory(roots: Iterable[Root], name: str):
+    """A criteria matching the rows of a directory and of the directories under it.
+
+    Args:
+        roots (Iterable[Root]): The roots, the longest path first, see locate_name
+        name (str): The absolute name of the directory
+
+    Returns:
+        ColumnElement[bool] | None: The criteria, or None if the directory is under no root
+    """
+    located = locate_name(roots, os.path.join(name, ""))
+    if located is None:
+        return None
+    root_id, prefix = located
+    # Compared with substr, as LIKE ignores the case of ASCII letters in SQLite.
+    return and_(Directory.root_id == root_id, func.substr(Directory.path, 1, len(prefix)) == prefix)
+
+
+def prune_directories(session: Session, root_id: int) -> int:
+    """Delete the directories of a root which have no file left. The caller commits.
+
+    Returns:
+        int: The number of directories deleted
+    """
+    has_files = exists().where(File.directory_id == Directory.id)
+    return session.execute(delete(Directory).where(Directory.root_id == root_id, ~has_files)).rowcount
+
+
+def names_criteria(session: Session, names: Iterable[str]):
+    """A criteria matching the files of absolute names through the unique indexes on directories and basenames.
+
+    Comparing File.name itself builds the name of every row.
+
+    Args:
+        session (Session): The database session
+        names (Iterable[str]): Absolute file names
+
+    Returns:
+        ColumnElement[bool]: The criteria, matching nothing if no name is under a root
+    """
+    criteria = []
+    for root_id, paths in split_names(session.scalars(select(Root)), names).items():
+        basenames = defaultdict(list)
+        for path in paths:
+            directory, basename = split_path(path)
+            basenames[directory].append(basename)
+        for directory, directory_basenames in basenames.items():
+            # Evaluated once by SQLite, as it is not correlated to the file row.
+            directory_id = select(Directory.id).where(Directory.root_id == root_id, Directory.path == directory)
+            criteria.append(
+                and_(File.directory_id == directory_id.scalar_subquery(), File.basename.in_(directory_basenames))
+            )
+    return or_(false(), *criteria)
@@ -0,0 +1,58 @@
+import threading
+from pathlib import Path
+
+import pytest
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import google_library
+from models import Base
+from tests.photos_api import PhotosApiServer
+
+
+@pytest.fixture
+def engine(tmp_path: Path):
+    """An empty catalog database in the temporary directory of the test."""
+    engine = create_engine(f"sqlite+pysqlite:///{tmp_path.joinpath('catalog.db')}", echo=False)
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture
+def make_images():
+    """Create images of a single colour in a directory.
+
+    The spec maps paths relative to the directory to the colour of a 16x16 RGB image, or to the mode, size and colour
+    of the image. Images of the same spec are identical files.
+    """
+
+    def make_images(directory: Path, spec: dict[str, str | tuple]) -> Path:
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, image in spec.items():
+            path = directory.joinpath(name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            mode, size, colour = ("RGB", (16, 16), image) if isinstance(image, str) else image
+            Image.new(mode, size, colour).save(path)
+        return directory
+
+    return make_images
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """A local stand-in for the Google Photos Library API, which google_library is pointed at."""
+    server = PhotosApiServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(google_library, "API_BASE", server.base_url)
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,135 @@
+"""A local stand-in for the parts of the Google Photos Library API used by google_library."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class PhotosApi(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status=200, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_json(self, value):
+        self.reply(body=json.dumps(value).encode())
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def page(self, items: list, page_size: int, page_token: str | None) -> dict:
+        start = int(page_token or 0)
+        page = {"items": items[start : start + page_size]}
+        if start + page_size < len(items):
+            page["nextPageToken"] = str(start + page_size)
+        return page
+
+    def do_GET(self):
+        api = self.server
+        url = urlparse(self.path)
+        api.requests.append(("GET", url.path))
+        query = parse_qs(url.query)
+        if query.get("pageToken", [None])[0] == api.failing_album_page:
+            self.reply_json({"error": {"code": 401, "status": "UNAUTHENTICATED"}})
+            return
+        page = self.page(api.album_list(), int(query.get("pageSize", ["20"])[0]), query.get("pageToken", [None])[0])
+        page["albums"] = page.pop("items")
+        self.reply_json(page)
+
+    def do_POST(self):
+        api = self.server
+        api.requests.append(("POST", self.path))
+        body = self.read_body()
+        if self.path == "/v1/albums":
+            album = {"id": f"album{len(api.albums)}", "title": json.loads(body)["album"]["title"]}
+            api.albums[album["id"]] = {**album, "items": []}
+            self.reply_json(album)
+        elif self.path == "/v1/uploads" and self.headers["X-Goog-Upload-Protocol"] == "raw":
+            self.reply(body=api.store(self.headers["X-Goog-Upload-File-Name"], body))
+        elif self.path == "/v1/uploads":
+            session = f"session{len(api.resumable)}"
+            api.resumable[session] = {"name": self.headers["X-Goog-Upload-File-Name"], "data": b""}
+            upload_url = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/resumable/{session}"
+            self.reply(headers={"X-Goog-Upload-URL": upload_url, "X-Goog-Upload-Chunk-Granularity": "1024"})
+        elif self.path.startswith("/resumable/"):
+            self.resumable_upload(api.resumable[self.path.rsplit("/", 1)[1]], body)
+        elif self.path == "/v1/mediaItems:batchCreate":
+            self.batch_create(json.loads(body))
+        elif self.path == "/v1/mediaItems:search":
+            search = json.loads(body)
+            items = api.albums[search["albumId"]]["items"]
+            page = self.page(items, search.get("pageSize", 25), search.get("pageToken"))
+            page["mediaItems"] = page.pop("items")
+            self.reply_json(page)
+        else:
+            self.reply(status=404)
+
+    def resumable_upload(self, upload: dict, body: bytes):
+        api = self.server
+        command = self.headers["X-Goog-Upload-Command"]
+        if command == "query":
+            self.reply(headers={"X-Goog-Upload-Size-Received": str(len(upload["data"]))})
+            return
+        assert int(self.headers["X-Goog-Upload-Offset"]) == len(upload["data"])
+        api.chunk_sizes.append(len(body))
+        if api.fail_next_chunk:
+            # Keep part of the chunk, as if the connection dropped halfway.
+            api.fail_next_chunk = False
+            upload["data"] += body[:1024]
+            self.reply(status=503)
+            return
+        upload["data"] += body
+        token = api.store(upload["name"], upload["data"]) if "finalize" in command else b""
+        self.reply(body=token)
+
+    def batch_create(self, create: dict):
+        api = self.server
+        api.batch_sizes.append(len(create["newMediaItems"]))
+        results = []
+        for item in create["newMediaItems"]:
+            token = item["simpleMediaItem"]["uploadToken"]
+            media_item = {"id": f"item-{token}", "filename": api.uploads[token][0], "mimeType": "image/jpeg"}
+            if "albumId" in create:
+                api.albums[create["albumId"]]["items"].append(media_item)
+            results.append({"uploadToken": token, "status": {"message": "Success"}, "mediaItem": media_item})
+        self.reply_json({"newMediaItemResults": results})
+
+
+class PhotosApiServer(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), PhotosApi)
+        self.albums, self.uploads, self.resumable = {}, {}, {}
+        self.requests, self.batch_sizes, self.chunk_sizes = [], [], []
+        self.fail_next_chunk = False
+        # The page token of the album listing answered with an error, "" for none.
+        self.failing_album_page = ""
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def album_list(self) -> list[dict]:
+        return [
+            {"id": album["id"], "title": album["title"], "mediaItemsCount": str(len(album["items"]))}
+            for album in self.albums.values()
+        ]
+
+    def add_album(self, title: str, filenames=()) -> str:
+        album_id = f"album{len(self.albums)}"
+        items = [{"id": f"{album_id}-{name}", "filename": name, "mimeType": "image/jpeg"} for name in filenames]
+        self.albums[album_id] = {"id": album_id, "title": title, "items": items}
+        return album_id
+
+    def store(self, name: str, data: bytes) -> bytes:
+        with self.lock:
+            token = f"token{len(self.uploads)}"
+            self.uploads[token] = (name, data)
+        return token.encode()
@@ -0,0 +1,197 @@
+import importlib
+import json
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from PIL import Image
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import Session
+
+from db_utils import rebuild_duplicate_groups
+from models import Base, File, NearDuplicate
+from roots import RootConfig, assign_directories, sync_roots
+
+
+@pytest.fixture
+def client(tmp_path: Path, monkeypatch):
+    """The web app on a catalog of 25 duplicate groups of two files each and one unique image."""
+    dbfile = tmp_path.joinpath("media.db")
+    engine = create_engine(f"sqlite+pysqlite:///{dbfile}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        media, data_dir = sync_roots(session, [RootConfig(Path("/media")), RootConfig(tmp_path)])
+        rows = [
+            {"root_id": media.id, "path": f"{number}-{copy}.jpg", "size": 10, "sha256": f"{number:064x}"}
+            for number in range(25)
+            for copy in "ab"
+        ]
+        Image.new("RGB", (1600, 1200), "red").save(tmp_path.joinpath("unique.jpg"))
+        rows.append({"root_id": data_dir.id, "path": "unique.jpg", "size": 10, "sha256": "f" * 64})
+        session.execute(insert(File), assign_directories(session, rows))
+        session.commit()
+        rebuild_duplicate_groups(session)
+    engine.dispose()
+
+    tmp_path.joinpath("mediatool.ini").write_text(
+        f"[mediatool]\ndata_dir = {tmp_path}\ndb_file = {dbfile}\nthumbnail_dir = {tmp_path.joinpath('thumbs')}\n"
+    )
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delitem(sys.modules, "app", raising=False)
+    app = importlib.import_module("app")
+    yield app.app.test_client()
+    with app.app.app_context():
+        app.db.engine.dispose()
+
+
+def test_view_duplicates_keyset_pages(client):
+    statements = []
+    web_app = sys.modules["app"]
+    with web_app.app.app_context():
+        event.listen(
+            web_app.db.engine, "before_cursor_execute", lambda _, __, statement, *args: statements.append(statement)
+        )
+    response = client.get("/dupes?per_page=10")
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert page.count("Dupes of") == 10
+    assert f"Dupes of {9:064x}" in page
+    assert f"Dupes of {10:064x}" not in page
+    assert f"after={9:064x}" in page
+
+    page = client.get(f"/dupes?per_page=10&after={19:064x}").get_data(as_text=True)
+    assert page.count("Dupes of") == 5
+    assert "Next" not in page
+    assert f"after={9:064x}" in page
+    # Every page is a keyset lookup, without counting the groups.
+    assert not [statement for statement in statements if "count(" in statement.lower()]
+
+
+def test_view_duplicates_past_the_end_redirects(client):
+    response = client.get(f"/dupes?after={'e' * 64}")
+    assert response.status_code == 302
+
+
+def test_stream_duplicates(client):
+    response = client.get(f"/dupes.json?after={4:064x}&limit=3")
+    groups = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [group["sha256"] for group in groups] == [f"{number:064x}" for number in range(5, 8)]
+    assert groups[0] == {
+        "sha256": f"{5:064x}",
+        "count": 2,
+        "total_bytes": 20,
+        "files": ["/media/5-a.jpg", "/media/5-b.jpg"],
+    }
+
+    all_groups = client.get("/dupes.json").get_data(as_text=True).splitlines()
+    assert len(all_groups) == 25
+
+
+def test_stream_duplicates_limit(client):
+    def checksums(query: str) -> list[str]:
+        response = client.get(f"/dupes.json?{query}")
+        assert response.status_code == 200
+        return [json.loads(line)["sha256"] for line in response.get_data(as_text=True).splitlines()]
+
+    assert checksums("limit=-3") == checksums("limit=0") == [f"{0:064x}"]
+    sys.modules["app"].app.config["DUPES_JSON_MAX_LIMIT"] = 4
+    assert len(checksums("limit=10")) == 4
+    assert len(checksums("")) == 25
+
+    for limit in ["ten", "1.5", ""]:
+        response = client.get(f"/dupes.json?limit={limit}")
+        assert response.status_code == 400
+        assert "error" in response.json
+
+
+def test_thumbs(client, tmp_path):
+    response = client.get(f"/thumbs/{'f' * 64}/256")
+    assert response.status_code == 200
+    assert response.mimetype == "image/jpeg"
+    assert response.headers["ETag"] == f'"{"f" * 64}-256"'
+    assert "immutable" in response.headers["Cache-Control"]
+    with Image.open(BytesIO(response.data)) as thumbnail:
+        assert thumbnail.size == (256, 192)
+    assert tmp_path.joinpath("thumbs", "ff", f"{'f' * 64}-256.jpg").is_file()
+
+    response = client.get(f"/thumbs/{'f' * 64}/256", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_thumbs_not_found(client):
+    assert client.get(f"/thumbs/{'f' * 64}/300").status_code == 404
+    assert client.get(f"/thumbs/{'e' * 64}/256").status_code == 404
+    # The catalogued path does not exist.
+    assert client.get(f"/thumbs/{0:064x}/256").status_code == 404
+
+
+@pytest.mark.parametrize("checksum", ["..", "F" * 64, "f" * 63, "g" * 64, "thumbs"])
+def test_thumbs_invalid_checksum(client, checksum):
+    # Not even a cached answer for what is not a checksum.
+    response = client.get(f"/thumbs/{checksum}/256", headers={"If-None-Match": f'"{checksum}-256"'})
+    assert response.status_code == 404
+
+
+def test_consolidate_bulk(client, tmp_path):
+    decisions = [{"sha256": f"{number:064x}", "keep": f"/media/{number}-a.jpg"} for number in range(3)]
+    response = client.post("/consolidate/bulk", json={"decisions": decisions, "dry_run": True})
+    assert response.json == {"groups": 3, "deleted": 3, "unlinked": 0, "skipped": []}
+
+    # The catalogued files do not exist, so only the rows are deleted.
+    response = client.post("/consolidate/bulk", json={"decisions": decisions})
+    assert response.json == {"groups": 3, "deleted": 3, "unlinked": 0, "skipped": []}
+    page = client.get("/dupes").get_data(as_text=True)
+    assert f"Dupes of {2:064x}" not in page and f"Dupes of {3:064x}" in page
+
+    response = client.post(
+        "/consolidate/bulk", data={"after": f"{3:064x}", "per_page": 5, f"keep:{4:064x}": "/media/4-b.jpg"}
+    )
+    assert response.status_code == 302
+    assert f"after={3:064x}" in response.headers["Location"]
+    page = client.get("/dupes?per_page=5").get_data(as_text=True)
+    assert f"Dupes of {4:064x}" not in page and f"Dupes of {5:064x}" in page
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"decisions": [{"sha256": f"{0:064x}", "keep": "/media/0-a.jpg"}, {"sha256": f"{1:064x}"}]},
+        {"decisions": [{"sha256": f"{0:064x}", "keep": "/media/0-a.jpg"}, "keep everything"]},
+        {"decisions": {"sha256": f"{0:064x}", "keep": "/media/0-a.jpg"}},
+        [{"sha256": f"{0:064x}", "keep": "/media/0-a.jpg"}],
+        {"decisions": [{"sha256": f"{0:064x}", "keep": "/media/0-a.jpg"}], "dry_run": "false"},
+        {"decisions": [{"sha256": f"{0:064x}", "keep": "/media/0-a.jpg"}], "dry_run": 0},
+    ],
+)
+def test_consolidate_bulk_malformed(client, body):
+    response = client.post("/consolidate/bulk", json=body)
+    assert response.status_code == 400
+    assert "error" in response.json
+    # Not even the well formed decisions are applied.
+    assert f"Dupes of {0:064x}" in client.get("/dupes").get_data(as_text=True)
+
+
+def test_view_near_duplicates(client, tmp_path):
+    engine = create_engine(f"sqlite+pysqlite:///{tmp_path.joinpath('media.db')}")
+    with Session(engine) as session:
+        clusters = [[0, 1], [2, 3, 4], [5, 6]]
+        rows = [
+            {"sha256": f"{number:064x}", "cluster_id": cluster_id}
+            for cluster_id, numbers in enumerate(clusters, start=1)
+            for number in numbers
+        ]
+        session.execute(insert(NearDuplicate), rows)
+        session.commit()
+    engine.dispose()
+
+    page = client.get("/near?per_page=2").get_data(as_text=True)
+    assert "cluster 1" in page and "cluster 2" in page and "cluster 3" not in page
+    assert f"/thumbs/{4:064x}/256" in page
+    assert "after=2" in page
+
+    page = client.get("/near?per_page=2&after=2").get_data(as_text=True)
+    assert "cluster 3" in page and "cluster 2" not in page
+    assert "/media/6-b.jpg" in page
+    assert client.get("/near?after=9").status_code == 302
@@ -0,0 +1,139 @@
+from pathlib import Path
+
+import pytest
+from PIL import Image
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import Session
+
+import catalog
+from catalog import fill_database
+from dupefinder import find_duplicate_checksums
+from hashing import hash_file
+from models import Base, File
+from utils import MediaType, get_sha256, probe_file
+
+
+@pytest.fixture
+def media_dir(tmp_path: Path, make_images) -> Path:
+    media = make_images(tmp_path.joinpath("media"), {"image0.jpg": "red", "image1.jpg": "green", "image2.jpg": "blue"})
+    media.joinpath("notes.txt").write_text("not an image")
+    return media
+
+
+def test_fill_database(session, media_dir):
+    fill_database(session, media_dir)
+
+    files = session.query(File).all()
+    assert sorted(Path(file.name).name for file in files) == ["image0.jpg", "image1.jpg", "image2.jpg"]
+    for file in files:
+        assert file.sha256 == get_sha256(file.name)
+        assert file.mtime_ns == Path(file.name).stat().st_mtime_ns
+
+
+def test_fill_database_incremental(session, media_dir, monkeypatch):
+    fill_database(session, media_dir)
+
+    changed = media_dir.joinpath("image0.jpg")
+    Image.new("RGB", (32, 32), "yellow").save(changed)
+    media_dir.joinpath("image1.jpg").unlink()
+
+    probed = []
+    monkeypatch.setattr(
+        catalog,
+        "probe_file",
+        lambda path, *args, **kwargs: probed.append(Path(path)) or probe_file(path, *args, **kwargs),
+    )
+    fill_database(session, media_dir, incremental=True)
+
+    assert probed == [changed]
+    files = {Path(file.name).name: file for file in session.query(File).all()}
+    assert sorted(files) == ["image0.jpg", "image2.jpg"]
+    assert files["image0.jpg"].sha256 == get_sha256(changed)
+    assert files["image0.jpg"].size == changed.stat().st_size
+
+
+def test_fill_database_incremental_keeps_rows_of_empty_walk(session, media_dir):
+    fill_database(session, media_dir)
+    for path in media_dir.iterdir():
+        path.unlink()
+
+    fill_database(session, media_dir, incremental=True)
+
+    assert session.query(File).count() == 3
+
+
+@pytest.mark.parametrize("workers,use_processes", [(4, False), (2, True)])
+def test_fill_database_parallel_matches_serial(tmp_path, media_dir, workers, use_processes):
+    for number in range(20):
+        Image.new("RGB", (8, 8), (number * 10, 0, 0)).save(media_dir.joinpath(f"extra{number}.png"))
+
+    def catalogue(dbname, **kwargs):
+        engine = create_engine(f"sqlite+pysqlite:///{tmp_path.joinpath(dbname)}", echo=False)
+        Base.metadata.create_all(engine)
+        with Session(engine) as session:
+            fill_database(session, media_dir, batch_size=3, **kwargs)
+            return [
+                (file.id, file.name, file.size, file.sha256, file.filetype, file.datestamp, file.mtime_ns)
+                for file in session.query(File).order_by(File.id)
+            ]
+
+    serial = catalogue("serial.db")
+    parallel = catalogue("parallel.db", workers=workers, queue_depth=4, use_processes=use_processes)
+    assert len(serial) == 23
+    assert parallel == serial
+
+
+def test_fill_database_fills_missing_columns(session, media_dir):
+    fill_database(session, media_dir)
+    session.execute(update(File).values(filetype=None))
+    session.commit()
+
+    fill_database(session, media_dir)
+
+    assert {file.filetype for file in session.query(File)} == {MediaType.image}
+
+
+def test_fill_database_staged(session, tmp_path, monkeypatch):
+    media = tmp_path.joinpath("staged")
+    media.mkdir()
+    middle_a, middle_b = b"a" * 100_000, b"b" * 100_000
+    head, tail = b"h" * 70_000, b"t" * 70_000
+    media.joinpath("unique.jpg").write_bytes(b"only one of this size")
+    media.joinpath("original.jpg").write_bytes(head + middle_a + tail)
+    media.joinpath("copy.jpg").write_bytes(head + middle_a + tail)
+    media.joinpath("same_ends.jpg").write_bytes(head + middle_b + tail)
+    media.joinpath("other_ends.jpg").write_bytes(tail + middle_a + head[:-1] + b"x")
+
+    hashed = []
+    monkeypatch.setattr(
+        catalog, "hash_file", lambda path, *args, **kwargs: hashed.append(Path(path).name) or get_sha256(path)
+    )
+    fill_database(session, media, staged=True)
+
+    files = {Path(file.name).name: file for file in session.query(File)}
+    assert sorted(hashed) == ["copy.jpg", "original.jpg", "same_ends.jpg"]
+    assert files["unique.jpg"].partial_hash is None
+    assert files["other_ends.jpg"].partial_hash != files["original.jpg"].partial_hash
+    assert files["original.jpg"].sha256 == files["copy.jpg"].sha256 == get_sha256(media.joinpath("copy.jpg"))
+    assert files["same_ends.jpg"].sha256 != files["original.jpg"].sha256
+    assert list(find_duplicate_checksums(session)) == [files["copy.jpg"].sha256]
+
+
+def test_fill_database_incremental_rehashes_other_algorithm(session, media_dir):
+    fill_database(session, media_dir)
+    fill_database(session, media_dir, incremental=True, hash_algorithm="blake2b")
+
+    for file in session.query(File):
+        assert file.hash_algorithm == "blake2b"
+        assert file.sha256 == hash_file(file.name, "blake2b")
+
+
+def test_fill_database_sniff(session, media_dir):
+    Image.new("RGB", (16, 16), "white").save(media_dir.joinpath("IMG_0001.dat"), "PNG")
+
+    fill_database(session, media_dir)
+    assert session.query(File).count() == 3
+
+    fill_database(session, media_dir, sniff=True)
+    misnamed = session.query(File).filter(File.name == str(media_dir.joinpath("IMG_0001.dat"))).one()
+    assert misnamed.filetype == MediaType.image
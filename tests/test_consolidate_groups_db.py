@@ -0,0 +1,71 @@
+import json
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select
+
+from catalog import fill_database
+from db_utils import consolidate_groups_db, replay_consolidation_journal
+from models import DuplicateGroup, File
+from utils import get_sha256
+
+
+@pytest.fixture
+def media_dir(tmp_path: Path, make_images) -> Path:
+    return make_images(
+        tmp_path.joinpath("media"),
+        {f"{colour}{copy}.jpg": colour for colour in ["red", "green", "blue"] for copy in range(3)},
+    )
+
+
+def catalogued(session) -> list[str]:
+    return sorted(Path(name).name for name in session.scalars(select(File.name)))
+
+
+def test_consolidate_groups_db(session, media_dir, tmp_path):
+    fill_database(session, media_dir)
+    journal = tmp_path.joinpath("consolidate.jsonl")
+    decisions = [
+        (get_sha256(media_dir.joinpath("red0.jpg")), str(media_dir.joinpath("red1.jpg"))),
+        (get_sha256(media_dir.joinpath("blue0.jpg")), str(media_dir.joinpath("blue0.jpg"))),
+        # Not one of the duplicates of green, so the group is left alone.
+        (get_sha256(media_dir.joinpath("green0.jpg")), str(media_dir.joinpath("red0.jpg"))),
+    ]
+
+    result = consolidate_groups_db(session, decisions, journal, dry_run=True)
+    assert result.groups == 2
+    assert result.deleted == 4
+    assert result.unlinked == 0
+    assert len(catalogued(session)) == 9
+
+    result = consolidate_groups_db(session, decisions, journal)
+    assert result.groups == 2
+    assert result.deleted == 4
+    assert result.unlinked == 4
+    assert result.skipped == [decisions[2][0]]
+    expected = ["blue0.jpg", "green0.jpg", "green1.jpg", "green2.jpg", "red1.jpg"]
+    assert catalogued(session) == expected
+    assert sorted(path.name for path in media_dir.iterdir()) == expected
+    assert session.scalars(select(DuplicateGroup.sha256)).all() == [decisions[2][0]]
+    assert not journal.exists()
+
+
+def test_replay_consolidation_journal(session, media_dir, tmp_path):
+    fill_database(session, media_dir)
+    journal = tmp_path.joinpath("consolidate.jsonl")
+    red = [str(media_dir.joinpath(f"red{copy}.jpg")) for copy in range(3)]
+    green = [str(media_dir.joinpath(f"green{copy}.jpg")) for copy in range(3)]
+    # Interrupted after the red rows were deleted but before any file was unlinked. The green rows never were.
+    journal.write_text(
+        json.dumps({"sha256": "red", "keep": red[0], "remove": red[1:]})
+        + "\n"
+        + json.dumps({"sha256": "green", "keep": green[0], "remove": green[1:]})
+        + "\n"
+    )
+    session.execute(File.__table__.delete().where(File.name.in_(red[1:])))
+    session.commit()
+
+    assert replay_consolidation_journal(session, journal) == 2
+    assert not Path(red[1]).exists() and not Path(red[2]).exists()
+    assert all(Path(name).exists() for name in green)
+    assert not journal.exists()
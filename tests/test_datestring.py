@@ -0,0 +1,46 @@
+from hypothesis import example, given
+from hypothesis import strategies as st
+
+from benchmarks.bench_datestring import legacy_datestring_to_date
+from utils import datestring_to_date
+
+
+def outcome(function, datestring):
+    try:
+        return function(datestring)
+    except ValueError:
+        return ValueError
+
+
+def digits(size):
+    return st.text(alphabet="0123456789", min_size=size, max_size=size)
+
+
+# Mostly well formed timestamps with arbitrary digits, separators and decimals, so both valid and invalid dates occur.
+timestamps = st.builds(
+    lambda year, sep1, month, sep2, day, hour, minute, second, fraction, suffix: (
+        f"{year}{sep1}{month}{sep2}{day} {hour}:{minute}:{second}{fraction}{suffix}"
+    ),
+    digits(4),
+    st.sampled_from(["-", ":", "/"]),
+    digits(2),
+    st.sampled_from(["-", ":"]),
+    digits(2),
+    digits(2),
+    digits(2),
+    digits(2),
+    st.one_of(st.just(""), st.text(alphabet="0123456789", max_size=7).map(lambda fraction: f".{fraction}")),
+    st.sampled_from(["", "", "", "\n", " ", "Z"]),
+)
+
+
+@given(st.one_of(timestamps, st.text(max_size=30)))
+@example("")
+@example("0000:00:00 00:00:00")
+@example("2021:06:12 09:14:20.")
+@example("2021:06:12 09:14:20\n")
+@example("2021-06:12 09:14:20")
+@example("2021:02:30 09:14:20")
+@example("2021:06:12 09:14:60")
+def test_datestring_to_date_matches_legacy(datestring):
+    assert outcome(datestring_to_date, datestring) == outcome(legacy_datestring_to_date, datestring)
@@ -0,0 +1,94 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from sqlalchemy import delete, event, select
+
+import dupefinder
+import utils
+from catalog import fill_database
+from db_utils import consolidate_files_db, rebuild_duplicate_groups
+from dupefinder import find_duplicate_files
+from models import DuplicateGroup, File
+from utils import get_sha256
+
+
+@pytest.fixture
+def media_dir(tmp_path: Path, make_images) -> Path:
+    return make_images(
+        tmp_path.joinpath("media"), {"red0.jpg": "red", "red1.jpg": "red", "red2.jpg": "red", "blue.jpg": "blue"}
+    )
+
+
+def groups(session) -> dict:
+    return {group.sha256: group for group in session.scalars(select(DuplicateGroup))}
+
+
+def test_fill_database_maintains_groups(session, media_dir):
+    fill_database(session, media_dir)
+
+    checksum = get_sha256(media_dir.joinpath("red0.jpg"))
+    (group,) = groups(session).values()
+    assert group.sha256 == checksum
+    assert group.count == 3
+    assert group.total_bytes == 3 * media_dir.joinpath("red0.jpg").stat().st_size
+    assert group.representative_id == session.scalar(select(File.id).filter_by(sha256=checksum).order_by(File.id))
+
+
+def test_incremental_changes_update_groups(session, media_dir):
+    fill_database(session, media_dir)
+    red = get_sha256(media_dir.joinpath("red0.jpg"))
+
+    media_dir.joinpath("red2.jpg").unlink()
+    shutil.copy(media_dir.joinpath("blue.jpg"), media_dir.joinpath("red1.jpg"))
+    fill_database(session, media_dir, incremental=True)
+
+    # Only red0.jpg is left of the red group, while blue.jpg gained a copy.
+    assert red not in groups(session)
+    (group,) = groups(session).values()
+    assert group.sha256 == get_sha256(media_dir.joinpath("blue.jpg"))
+    assert group.count == 2
+
+
+def test_consolidate_files_db_updates_groups(session, media_dir):
+    fill_database(session, media_dir)
+    red = get_sha256(media_dir.joinpath("red0.jpg"))
+    paths = [media_dir.joinpath(f"red{number}.jpg") for number in range(3)]
+
+    consolidate_files_db(session, paths[1:], paths[1], dry_run=True)
+    assert groups(session)[red].count == 3
+
+    consolidate_files_db(session, paths[1:], paths[1])
+    assert groups(session)[red].count == 2
+
+    consolidate_files_db(session, paths[:2], paths[0])
+    assert groups(session) == {}
+
+
+def test_rebuild_duplicate_groups(session, media_dir):
+    fill_database(session, media_dir)
+    session.execute(delete(DuplicateGroup))
+    session.commit()
+
+    assert rebuild_duplicate_groups(session) == 1
+    assert groups(session)[get_sha256(media_dir.joinpath("red0.jpg"))].count == 3
+
+
+def test_process_duplicates_reads_the_catalog_once(session, media_dir, monkeypatch):
+    fill_database(session, media_dir)
+    checksum = get_sha256(media_dir.joinpath("red0.jpg"))
+    ((group, rows),) = find_duplicate_files(session)
+    assert group == checksum
+    assert sorted(Path(row.name).name for row in rows) == ["red0.jpg", "red1.jpg", "red2.jpg"]
+    assert [row.name for row in rows] == session.scalars(
+        select(File.name).filter_by(sha256=checksum).order_by(File.id)
+    ).all()
+
+    statements = []
+    event.listen(session.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    monkeypatch.setattr(dupefinder.IntPrompt, "ask", lambda *args, **kwargs: 2)
+    monkeypatch.setattr(utils, "get_datestamp", lambda path: pytest.fail("The image was opened"))
+    dupefinder.process_duplicates(session)
+
+    assert sum(statement.lstrip().upper().startswith("SELECT") for statement in statements) <= 2
+    assert sorted(path.name for path in media_dir.iterdir()) == sorted(["blue.jpg", Path(rows[1].name).name])
@@ -0,0 +1,67 @@
+import io
+import struct
+
+import pytest
+from PIL import Image
+from PIL.ExifTags import IFD
+from PIL.ExifTags import Base as ExifBase
+
+from exif_header import ExifHeaderError, exif_datestring, read_exif_datestring
+from utils import read_datestring_with_pillow
+
+EXIF_CASES = [
+    {},
+    {ExifBase.DateTime: "2021:06:12 09:14:20"},
+    {ExifBase.DateTime: "2021:06:12 09:14:20", ExifBase.DateTimeOriginal: "2018:11:25 07:09:07.547"},
+    {ExifBase.DateTimeOriginal: "2018-11-25 07:09:07", ExifBase.Make: "Camera"},
+    {ExifBase.DateTime: ""},
+    {ExifBase.DateTime: "0000:00:00 00:00:00"},
+]
+
+
+def image_bytes(image_format: str, tags: dict, exif_ifd: dict = None) -> bytes:
+    exif = Image.Exif()
+    for tag, value in tags.items():
+        exif[tag] = value
+    if exif_ifd:
+        exif.get_ifd(IFD.Exif).update(exif_ifd)
+    output = io.BytesIO()
+    Image.new("RGB", (16, 16), "red").save(output, image_format, exif=exif)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+@pytest.mark.parametrize("tags", EXIF_CASES)
+def test_read_exif_datestring_matches_pillow(image_format, tags):
+    image_file = io.BytesIO(image_bytes(image_format, tags))
+    expected = read_datestring_with_pillow(io.BytesIO(image_file.getvalue()), "test")
+    assert read_exif_datestring(image_file) == expected
+
+
+def test_read_exif_datestring_ignores_exif_ifd():
+    # Image.getexif() only exposes IFD0, so neither reader sees the DateTimeOriginal of the Exif IFD.
+    image_file = io.BytesIO(
+        image_bytes(
+            "JPEG", {ExifBase.DateTime: "2021:06:12 09:14:20"}, {ExifBase.DateTimeOriginal: "2019:01:01 00:00:01"}
+        )
+    )
+    assert read_exif_datestring(image_file) == "2021:06:12 09:14:20"
+
+
+def test_read_exif_datestring_without_exif():
+    output = io.BytesIO()
+    Image.new("RGB", (16, 16), "red").save(output, "PNG")
+    assert read_exif_datestring(output) is None
+
+
+def test_exif_datestring_big_endian():
+    value = b"2021:06:12 09:14:20\x00"
+    ifd = struct.pack(">H", 1) + struct.pack(">HHII", ExifBase.DateTime, 2, len(value), 26) + struct.pack(">I", 0)
+    exif = b"MM" + struct.pack(">HI", 42, 8) + ifd + value
+    assert exif_datestring(exif) == "2021:06:12 09:14:20"
+
+
+@pytest.mark.parametrize("data", [b"GIF89a" + b"\x00" * 10, b"\xff\xd8\xff\xe1\x00", b"\x89PNG\r\n\x1a\n\x00"])
+def test_read_exif_datestring_unreadable(data):
+    with pytest.raises(ExifHeaderError):
+        read_exif_datestring(io.BytesIO(data))
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import requests
+
+import google_library
+from google_library import UploadResult, batch_create, upload_photos
+
+
+def test_upload_photos(api, tmp_path):
+    files = []
+    for number in range(120):
+        files.append(tmp_path.joinpath(f"photo{number}.jpg"))
+        files[-1].write_bytes(f"photo {number}".encode())
+
+    with requests.Session() as session:
+        results = upload_photos(session, files, "mediatool", workers=4, session_factory=requests.Session)
+
+    assert [result.filename for result in results] == files
+    assert all(result.error is None for result in results)
+    assert [result.media_item["filename"] for result in results] == [file.name for file in files]
+    assert api.batch_sizes == [50, 50, 20]
+    assert sorted(data for _, data in api.uploads.values()) == sorted(file.read_bytes() for file in files)
+    assert api.album_list() == [{"id": "album0", "title": "mediatool", "mediaItemsCount": "120"}]
+
+
+def test_upload_resumable(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(google_library, "RESUMABLE_THRESHOLD", 4096)
+    video = tmp_path.joinpath("video.mp4")
+    video.write_bytes(bytes(range(256)) * 40)
+    api.fail_next_chunk = True
+
+    with requests.Session() as session:
+        token = google_library.upload_resumable(session, video, "video/mp4", chunk_size=3000)
+
+    assert api.uploads[token] == ("video.mp4", video.read_bytes())
+    # Chunks are rounded down to the granularity, and the failed chunk resumed from what the server received.
+    assert api.chunk_sizes == [2048, 2048, 2048, 2048, 2048, 1024]
+
+
+def test_upload_photos_reports_errors(api, tmp_path):
+    photo = tmp_path.joinpath("photo.jpg")
+    photo.write_bytes(b"photo")
+
+    with requests.Session() as session:
+        results = upload_photos(
+            session, [tmp_path.joinpath("missing.jpg"), photo], None, session_factory=requests.Session
+        )
+
+    assert results[0].error and results[0].media_item is None
+    assert results[1].media_item["filename"] == "photo.jpg"
+
+
+def test_batch_create_missing_results():
+    class Session:
+        def post(self, url, data):
+            # A result for the second upload only.
+            result = {"uploadToken": "token-b", "status": {"message": "Success"}, "mediaItem": {"id": "item-b"}}
+            return SimpleNamespace(json=lambda: {"newMediaItemResults": [result]})
+
+    assert batch_create(Session(), None, [("a.jpg", "token-a"), ("b.jpg", "token-b")]) == [
+        UploadResult("a.jpg", None, "no result returned"),
+        UploadResult("b.jpg", {"id": "item-b"}, None),
+    ]
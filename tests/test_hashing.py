@@ -0,0 +1,29 @@
+import hashlib
+
+import pytest
+
+from hashing import available_algorithms, hash_file, new_hasher
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path.joinpath("data.bin")
+    path.write_bytes(bytes(range(256)) * 500)
+    return path
+
+
+@pytest.mark.parametrize("algorithm", available_algorithms())
+@pytest.mark.parametrize("buffer_size", [7, 4096, 1 << 20])
+def test_hash_file(data_file, algorithm, buffer_size):
+    expected = new_hasher(algorithm)
+    expected.update(data_file.read_bytes())
+    assert hash_file(data_file, algorithm, buffer_size) == expected.hexdigest()
+
+
+def test_hash_file_sha256(data_file):
+    assert hash_file(data_file) == hashlib.sha256(data_file.read_bytes()).hexdigest()
+
+
+def test_new_hasher_unknown_algorithm():
+    with pytest.raises(ValueError):
+        new_hasher("md5")
@@ -0,0 +1,113 @@
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from PIL import Image
+from sqlalchemy import select, update
+
+import manifest
+from catalog import fill_database
+from db_utils import rebuild_duplicate_groups
+from manifest import import_manifest, open_manifest, scan_records, write_manifest
+from models import DuplicateGroup, File
+from roots import RootConfig
+from utils import MediaType, get_sha256
+
+
+@pytest.fixture
+def media_dir(tmp_path: Path, make_images) -> Path:
+    media = make_images(
+        tmp_path.joinpath("nas", "photos"),
+        {"2024/image0.jpg": "red", "2024/image1.jpg": "green", "2024/image2.jpg": "blue", "copy.jpg": "red"},
+    )
+    media.joinpath("notes.txt").write_text("not an image")
+    return media
+
+
+def header(media_dir: Path) -> dict:
+    return {"manifest_version": 1, "root": str(media_dir), "hash_algorithm": "sha256", "created": "2024-01-02T03:04:05"}
+
+
+def test_scan_records(media_dir):
+    records = list(scan_records(media_dir, workers=2))
+    assert sorted(record["path"] for record in records) == [
+        "2024/image0.jpg",
+        "2024/image1.jpg",
+        "2024/image2.jpg",
+        "copy.jpg",
+    ]
+    for record in records:
+        assert record["sha256"] == get_sha256(media_dir.joinpath(record["path"]))
+        assert record["size"] == media_dir.joinpath(record["path"]).stat().st_size
+        assert record["filetype"] == "image"
+
+
+@pytest.mark.parametrize(
+    "suffix",
+    [
+        ".jsonl.gz",
+        ".jsonl",
+        pytest.param(".parquet", marks=pytest.mark.skipif(manifest.pq is None, reason="no pyarrow")),
+    ],
+)
+def test_manifest_round_trip(tmp_path: Path, media_dir, suffix):
+    records = list(scan_records(media_dir))
+    records[0]["datestamp"] = datetime(2024, 1, 2, 3, 4, 5)
+    output = tmp_path.joinpath(f"photos{suffix}")
+    assert write_manifest(output, iter(records), header(media_dir)) == 4
+
+    with open_manifest(output, batch_size=3) as (read_header, batches):
+        batches = list(batches)
+    assert read_header == header(media_dir)
+    assert [len(batch) for batch in batches] == [3, 1]
+    expected = [{**record, "filetype": MediaType.image} for record in records]
+    assert [record for batch in batches for record in batch] == expected
+
+
+def test_import_manifest(tmp_path: Path, session, media_dir):
+    output = tmp_path.joinpath("photos.jsonl.gz")
+    write_manifest(output, scan_records(media_dir), header(media_dir))
+    # The volume is mounted elsewhere on the catalog host.
+    mount = tmp_path.joinpath("mnt", "photos")
+    shutil.copytree(media_dir, mount)
+
+    assert import_manifest(session, output, RootConfig(mount, "photos"), batch_size=3) == 4
+    files = session.scalars(select(File)).all()
+    assert sorted(file.name for file in files) == sorted(
+        str(mount.joinpath(path)) for path in ["2024/image0.jpg", "2024/image1.jpg", "2024/image2.jpg", "copy.jpg"]
+    )
+    for file in files:
+        assert file.sha256 == get_sha256(file.name)
+        assert file.hash_algorithm == "sha256"
+        assert file.filetype == MediaType.image
+    groups = select(DuplicateGroup.sha256, DuplicateGroup.count, DuplicateGroup.total_bytes)
+    imported_groups = session.execute(groups).all()
+    assert [group.count for group in imported_groups] == [2]
+    rebuild_duplicate_groups(session)
+    assert session.execute(groups).all() == imported_groups
+
+    # An incremental scan adopts the local signatures of the imported files instead of hashing them again.
+    session.execute(update(File).values(sha256="not hashed again"))
+    session.commit()
+    fill_database(session, mount, incremental=True)
+    assert session.scalars(select(File.sha256).distinct()).all() == ["not hashed again"]
+    assert session.scalar(select(File).where(File.mtime_ns.is_(None))) is None
+
+
+def test_import_manifest_updates_changed_files(tmp_path: Path, session, media_dir):
+    fill_database(session, media_dir, perceptual=True)
+    session.execute(update(File).values(dhash=1))
+    session.commit()
+
+    Image.new("RGB", (16, 16), "yellow").save(media_dir.joinpath("copy.jpg"))
+    output = tmp_path.joinpath("photos.jsonl.gz")
+    write_manifest(output, scan_records(media_dir), header(media_dir))
+    assert import_manifest(session, output) == 4
+
+    changed = session.scalar(select(File).where(File.name == str(media_dir.joinpath("copy.jpg"))))
+    assert changed.sha256 == get_sha256(changed.name)
+    assert changed.dhash is None
+    assert session.scalar(select(File.dhash).where(File.name != changed.name).distinct()) == 1
+    # The copy no longer shares the checksum of image0.jpg.
+    assert session.scalar(select(DuplicateGroup)) is None
@@ -0,0 +1,178 @@
+import random
+import shutil
+from pathlib import Path
+
+import pytest
+from PIL import Image, ImageDraw
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy.orm import Session
+
+import catalog
+import perceptual
+from catalog import fill_database, hash_perceptual
+from db_utils import iter_near_duplicates, rebuild_near_duplicates
+from models import Base, File, NearDuplicate
+from perceptual import (
+    HashIndex,
+    cluster_hashes,
+    dhash,
+    dhash_batch,
+    hamming_distance,
+    hash_images,
+    image_dhash,
+    near_pairs,
+    to_signed64,
+    to_unsigned64,
+)
+
+needs_numpy = pytest.mark.skipif(perceptual.np is None, reason="numpy is not installed")
+
+
+def make_picture(path: Path, seed: int, size=(400, 300)):
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle([x, y, x + rng.randrange(40, 200), y + rng.randrange(40, 150)], fill=colour)
+    image.save(path, quality=95)
+    return image
+
+
+@pytest.fixture
+def media_dir(tmp_path: Path) -> Path:
+    media = tmp_path.joinpath("media")
+    media.mkdir()
+    photo = make_picture(media.joinpath("photo.jpg"), seed=1)
+    # A smaller, heavily recompressed export of the same photo.
+    photo.resize((200, 150)).save(media.joinpath("photo-export.jpg"), quality=40)
+    shutil.copy(media.joinpath("photo.jpg"), media.joinpath("photo-copy.jpg"))
+    make_picture(media.joinpath("other.jpg"), seed=2)
+    return media
+
+
+def test_image_dhash_matches_resized_copies(media_dir):
+    photo, export, other = (
+        to_unsigned64(image_dhash(media_dir.joinpath(name))) for name in ["photo.jpg", "photo-export.jpg", "other.jpg"]
+    )
+    assert hamming_distance(photo, export) <= 4
+    assert hamming_distance(photo, other) > 16
+
+
+def test_image_dhash_unreadable(tmp_path: Path):
+    tmp_path.joinpath("broken.jpg").write_bytes(b"not an image")
+    assert image_dhash(tmp_path.joinpath("broken.jpg")) is None
+
+
+@needs_numpy
+@pytest.mark.parametrize("workers", [0, 2])
+def test_hash_images(media_dir, tmp_path: Path, workers):
+    tmp_path.joinpath("broken.jpg").write_bytes(b"not an image")
+    paths = [media_dir.joinpath(name) for name in ["photo.jpg", "photo-export.jpg", "other.jpg"]]
+    hashes = hash_images([*paths, tmp_path.joinpath("broken.jpg")], workers)
+    assert hashes[3] == (None, None)
+    # The batch computes the same dHash as a single image.
+    assert [dhash for dhash, _ in hashes[:3]] == [image_dhash(path) for path in paths]
+
+    (_, photo), (_, export), (_, other) = ((to_unsigned64(d), to_unsigned64(p)) for d, p in hashes[:3])
+    assert hamming_distance(photo, export) <= 4
+    assert hamming_distance(photo, other) > 16
+
+
+def test_hash_images_without_numpy(media_dir, monkeypatch):
+    monkeypatch.setattr(perceptual, "np", None)
+    path = media_dir.joinpath("photo.jpg")
+    assert hash_images([path]) == [(image_dhash(path), None)]
+
+
+@needs_numpy
+def test_dhash_batch_matches_dhash():
+    np = perceptual.np
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(20, 8, 9), dtype=np.uint8)
+    expected = [dhash(Image.fromarray(grid)) for grid in pixels]
+    assert dhash_batch(pixels).tolist() == expected
+
+
+def test_signed_storage():
+    for value in [0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1]:
+        assert -(1 << 63) <= to_signed64(value) < 1 << 63
+        assert to_unsigned64(to_signed64(value)) == value
+
+
+@pytest.mark.parametrize("count", [10, 500, 5000])
+def test_hash_index_search_matches_brute_force(count):
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(count)]
+    # Near copies of the first values, up to eight bits apart.
+    values += [value ^ sum(1 << bit for bit in rng.sample(range(64), rng.randrange(9))) for value in values[:50]]
+    for threshold in [0, 3, 8]:
+        index = HashIndex(values, threshold)
+        assert len(index) == len(values)
+        for value in values[:60]:
+            assert index.search(value) == {other for other in values if hamming_distance(value, other) <= threshold}
+
+
+@pytest.mark.parametrize("with_numpy", [pytest.param(True, marks=needs_numpy), False])
+@pytest.mark.parametrize("count", [10, 1000])
+def test_near_pairs_match_brute_force(monkeypatch, with_numpy, count):
+    if not with_numpy:
+        monkeypatch.setattr(perceptual, "np", None)
+    rng = random.Random(1)
+    values = [rng.getrandbits(64) for _ in range(count)]
+    values += [value ^ sum(1 << bit for bit in rng.sample(range(64), rng.randrange(1, 9))) for value in values[:40]]
+    values = list(dict.fromkeys(values))
+    for threshold in [0, 4, 8]:
+        expected = {
+            (i, j)
+            for i in range(len(values))
+            for j in range(i + 1, len(values))
+            if hamming_distance(values[i], values[j]) <= threshold
+        }
+        assert set(near_pairs(values, threshold)) == expected
+
+
+def test_cluster_hashes():
+    hashes = [("a", 0b0000), ("b", 0b0011), ("c", 0b0111), ("d", (1 << 64) - 1), ("e", 0b0000)]
+    # a and e share a hash, b is two bits from them and c one bit from b, d is far from all of them.
+    assert cluster_hashes(hashes, threshold=2) == [["a", "b", "c", "e"]]
+    assert cluster_hashes(hashes, threshold=0) == [["a", "e"]]
+
+
+@needs_numpy
+def test_near_duplicates(tmp_path: Path, media_dir):
+    engine = create_engine(f"sqlite+pysqlite:///{tmp_path.joinpath('catalog.db')}", echo=False)
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        fill_database(session, media_dir, perceptual=True)
+        assert session.scalar(select(File).where(File.dhash.is_(None) | File.phash.is_(None))) is None
+        assert rebuild_near_duplicates(session, hash_name="phash") == 1
+
+        assert rebuild_near_duplicates(session) == 1
+        # The exact copy shares the checksum of the photo, so the cluster has two checksums and three files.
+        assert len(session.scalars(select(NearDuplicate)).all()) == 2
+        [(cluster_id, files)] = list(iter_near_duplicates(session))
+        assert sorted(Path(file.name).name for file in files) == ["photo-copy.jpg", "photo-export.jpg", "photo.jpg"]
+
+        # Clusters which lost their other files are skipped until the next rebuild.
+        session.execute(delete(File).where(File.name.not_like("%/other.jpg")))
+        session.commit()
+        assert list(iter_near_duplicates(session)) == []
+
+
+def test_hash_perceptual_marks_unreadable_images(session, media_dir, monkeypatch):
+    broken = media_dir.joinpath("broken.jpg")
+    broken.write_bytes(b"not an image")
+    fill_database(session, media_dir, perceptual=True)
+    errors = dict(session.execute(select(File.name, File.perceptual_error)).all())
+    assert errors.pop(str(broken)) is True
+    assert set(errors.values()) == {False}
+
+    # The broken image is not decoded again, until it changes.
+    monkeypatch.setattr(catalog, "hash_images", lambda paths, workers: pytest.fail(f"{paths} hashed again"))
+    assert hash_perceptual(session) == 0
+    monkeypatch.undo()
+    make_picture(broken, seed=3)
+    fill_database(session, media_dir, incremental=True, perceptual=True)
+    assert session.scalar(select(File.perceptual_error).where(File.name == str(broken))) is False
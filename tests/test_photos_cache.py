@@ -0,0 +1,106 @@
+import requests
+from sqlalchemy import select
+
+from google_library import upload_photos
+from models import RemoteAlbum
+from photos_cache import (
+    album_filenames,
+    find_album,
+    get_album,
+    record_uploaded_items,
+    refresh_album_items,
+    refresh_albums,
+)
+
+
+def searches(api) -> int:
+    return sum(path == "/v1/mediaItems:search" for _, path in api.requests)
+
+
+def test_refresh_albums(api, session):
+    for number in range(120):
+        api.add_album(f"Album {number}")
+    with requests.Session() as google_session:
+        assert refresh_albums(session, google_session) == 120
+
+    assert find_album(session, "ALBUM 7").id == "album7"
+    assert find_album(session, "Album 120") is None
+    # Albums were listed 50 at a time.
+    assert [path for _, path in api.requests] == ["/v1/albums"] * 3
+
+    del api.albums["album7"]
+    with requests.Session() as google_session:
+        refresh_albums(session, google_session)
+    assert find_album(session, "Album 7") is None
+
+
+def test_refresh_albums_keeps_albums_after_failed_listing(api, session):
+    for number in range(120):
+        api.add_album(f"Album {number}", [f"{number}.jpg"])
+    with requests.Session() as google_session:
+        refresh_albums(session, google_session)
+        refresh_album_items(session, google_session, find_album(session, "Album 119"))
+
+        # The second page fails, as when the token expires while listing.
+        del api.albums["album7"]
+        api.failing_album_page = "50"
+        assert refresh_albums(session, google_session) == 50
+        assert find_album(session, "Album 7").id == "album7"
+        assert album_filenames(session, find_album(session, "Album 119")) == {"119.jpg"}
+
+        api.failing_album_page = ""
+        api.albums.clear()
+        assert refresh_albums(session, google_session) == 0
+        assert find_album(session, "Album 119").id == "album119"
+
+        api.add_album("New")
+        assert refresh_albums(session, google_session) == 1
+        assert find_album(session, "Album 119") is None
+
+
+def test_get_album(api, session):
+    api.add_album("Holidays")
+    with requests.Session() as google_session:
+        assert get_album(session, google_session, "holidays").id == "album0"
+        assert get_album(session, google_session, "holidays").id == "album0"
+        created = get_album(session, google_session, "New")
+
+    assert created.id == "album1"
+    assert created.listed_count == 0
+    # The album listing was fetched once, the cache answered the second lookup.
+    assert [request for request in api.requests] == [
+        ("GET", "/v1/albums"),
+        ("GET", "/v1/albums"),
+        ("POST", "/v1/albums"),
+    ]
+
+
+def test_refresh_album_items_incrementally(api, session, tmp_path):
+    api.add_album("Holidays", [f"old{number}.jpg" for number in range(150)])
+    with requests.Session() as google_session:
+        album = get_album(session, google_session, "Holidays")
+        assert refresh_album_items(session, google_session, album)
+        assert searches(api) == 2
+        assert album_filenames(session, album) == {f"old{number}.jpg" for number in range(150)}
+
+        refresh_albums(session, google_session)
+        assert not refresh_album_items(session, google_session, album)
+        assert searches(api) == 2
+
+        photo = tmp_path.joinpath("new.jpg")
+        photo.write_bytes(b"new")
+        results = upload_photos(
+            google_session, [photo], "Holidays", album_id=album.id, session_factory=requests.Session
+        )
+        record_uploaded_items(session, album, [result.media_item for result in results])
+        assert "new.jpg" in album_filenames(session, album)
+
+        # The count grew by the item recorded above, so the album is not listed again.
+        refresh_albums(session, google_session)
+        assert not refresh_album_items(session, google_session, album)
+
+        api.albums[album.id]["items"].append({"id": "elsewhere", "filename": "elsewhere.jpg"})
+        refresh_albums(session, google_session)
+        assert refresh_album_items(session, google_session, album)
+        assert "elsewhere.jpg" in album_filenames(session, album)
+        assert session.scalar(select(RemoteAlbum.listed_count)) == 152
@@ -0,0 +1,102 @@
+import os
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+from sqlalchemy import select, update
+
+import dupefinder
+from catalog import fill_database
+from models import Directory, File, Root
+from policies import choose_file, parse_rule, resolve_duplicates
+from roots import split_path
+
+
+@pytest.fixture
+def media_dir(tmp_path: Path, make_images) -> Path:
+    return make_images(
+        tmp_path.joinpath("media"),
+        {
+            "inbox/long-folder-name/red.jpg": "red",
+            "inbox/red.jpg": "red",
+            "archive/20240102_030405.jpg": "red",
+            "blue.jpg": "blue",
+        },
+    )
+
+
+def files(*names, **columns) -> list[File]:
+    root = Root(path="/")
+    return [
+        File(id=number, directory=Directory(root=root, path=directory), basename=basename, size=10, **columns)
+        for number, (directory, basename) in enumerate(split_path(name[1:]) for name in names)
+    ]
+
+
+def test_rules():
+    candidates = files("/b/long/name.jpg", "/a/x.jpg", "/c/y.jpg")
+    assert choose_file(candidates, [parse_rule("shortest-path")]).name == "/a/x.jpg"
+    assert choose_file(candidates, [parse_rule("under-root=/c")]).name == "/c/y.jpg"
+    # Ties go to the next rule, then to the lowest id.
+    assert choose_file(candidates, [parse_rule("under-root=/d"), parse_rule("shortest-path")]).name == "/a/x.jpg"
+    assert choose_file(candidates, [parse_rule("under-root=/d")]).name == "/b/long/name.jpg"
+
+    dated = files("/a/IMG_1.jpg", "/b/20240102_030405.jpg", datestamp=datetime(2024, 1, 2, 3, 4, 5))
+    assert choose_file(dated, [parse_rule("recommended-name")]).name == "/b/20240102_030405.jpg"
+
+    timed = files("/a.jpg", "/b.jpg", "/c.jpg")
+    timed[0].mtime_ns, timed[1].mtime_ns = 20, 10
+    assert choose_file(timed, [parse_rule("oldest-mtime")]).name == "/b.jpg"
+
+
+@pytest.mark.parametrize("spec", ["newest", "under-root", "shortest-path=3"])
+def test_parse_rule_errors(spec):
+    with pytest.raises(ValueError):
+        parse_rule(spec)
+
+
+def test_resolve_duplicates(session, media_dir):
+    fill_database(session, media_dir)
+    session.execute(update(File).values(datestamp=datetime(2024, 1, 2, 3, 4, 5)))
+    session.commit()
+
+    (resolution,) = resolve_duplicates(session, [parse_rule("recommended-name")])
+    assert resolution.keep == str(media_dir.joinpath("archive", "20240102_030405.jpg"))
+    assert sorted(resolution.remove) == [
+        str(media_dir.joinpath("inbox", "long-folder-name", "red.jpg")),
+        str(media_dir.joinpath("inbox", "red.jpg")),
+    ]
+    assert resolution.reclaimable_bytes == 2 * media_dir.joinpath("inbox", "red.jpg").stat().st_size
+
+
+def test_dupefinder_policy(session, media_dir, tmp_path, monkeypatch):
+    fill_database(session, media_dir)
+    tmp_path.joinpath("mediatool.ini").write_text(
+        f"[mediatool]\ndata_dir = {media_dir}\ndb_file = {tmp_path.joinpath('catalog.db')}\n"
+    )
+    monkeypatch.chdir(tmp_path)
+    size = media_dir.joinpath("inbox", "red.jpg").stat().st_size
+
+    result = CliRunner().invoke(
+        dupefinder.main, ["--policy", "under-root=/nowhere", "--policy", "shortest-path", "--dry-run"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "1 duplicate groups, 2 files to remove" in result.output
+    assert f"({2 * size:,} bytes) reclaimable" in result.output
+    assert len(os.listdir(media_dir.joinpath("inbox"))) == 2
+
+    result = CliRunner().invoke(dupefinder.main, ["--policy", "shortest-path"])
+    assert result.exit_code == 0, result.output
+    assert sorted(session.scalars(select(File.name))) == [
+        str(media_dir.joinpath("blue.jpg")),
+        str(media_dir.joinpath("inbox", "red.jpg")),
+    ]
+    assert not media_dir.joinpath("archive", "20240102_030405.jpg").exists()
+    assert not media_dir.joinpath("inbox", "long-folder-name", "red.jpg").exists()
+
+
+def test_dupefinder_unknown_policy():
+    result = CliRunner().invoke(dupefinder.main, ["--policy", "newest"])
+    assert result.exit_code == 2
+    assert "Unknown policy newest" in result.output
@@ -0,0 +1,196 @@
+import shutil
+import threading
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select
+
+import catalog
+from catalog import fill_database, merge_in_threads
+from db_utils import (
+    SQLITE_BATCH_SIZE,
+    delete_files_db,
+    move_directory_db,
+    move_files_db,
+)
+from models import Directory, DuplicateGroup, File, Root
+from roots import (
+    DIRECTORY_BATCH_SIZE,
+    LEGACY_ROOT,
+    RootConfig,
+    load_roots,
+    names_criteria,
+    sync_roots,
+)
+from utils import get_sha256
+
+
+@pytest.fixture
+def roots(tmp_path: Path, make_images) -> list[RootConfig]:
+    photos = make_images(tmp_path.joinpath("nas", "photos"), {"album/red.jpg": "red", "album/green.jpg": "green"})
+    archive = make_images(tmp_path.joinpath("usb", "archive"), {"album/blue.jpg": "blue", "red.jpg": "red"})
+    return [RootConfig(photos, "photos", 2), RootConfig(archive, "archive", 1)]
+
+
+def test_load_roots(tmp_path: Path):
+    config = tmp_path.joinpath("mediatool.ini")
+    config.write_text(
+        "[mediatool]\ndata_dir = /srv/media\ndb_file = media.db\n\n"
+        "[root:photos]\npath = /mnt/nas/photos\nworkers = 8\n\n[root:archive]\npath = /mnt/usb/archive\npoll = yes\n"
+    )
+    assert load_roots(config) == [
+        RootConfig(Path("/srv/media"), "default"),
+        RootConfig(Path("/mnt/nas/photos"), "photos", 8),
+        RootConfig(Path("/mnt/usb/archive"), "archive", poll=True),
+    ]
+
+
+def test_fill_database_roots(session, roots):
+    fill_database(session, roots, workers=4)
+
+    assert sorted(session.scalars(select(File.name))) == sorted(
+        [
+            str(roots[0].path.joinpath("album", "green.jpg")),
+            str(roots[0].path.joinpath("album", "red.jpg")),
+            str(roots[1].path.joinpath("album", "blue.jpg")),
+            str(roots[1].path.joinpath("red.jpg")),
+        ]
+    )
+    assert sorted(session.scalars(select(File.path))) == [
+        "album/blue.jpg",
+        "album/green.jpg",
+        "album/red.jpg",
+        "red.jpg",
+    ]
+    # The copy of red.jpg in the other root is a duplicate all the same.
+    assert session.scalar(select(DuplicateGroup.count)) == 2
+    # The files of a directory share its row.
+    assert sorted(session.execute(select(Directory.root_id, Directory.path)).all()) == [
+        (1, "album/"),
+        (2, ""),
+        (2, "album/"),
+    ]
+
+
+def test_fill_database_roots_workers(session, roots, monkeypatch):
+    pools = {}
+
+    def inspect_in_pool(work, inspect, workers, **pool):
+        pools[threading.current_thread().name] = workers
+        yield from original(work, inspect, workers, **pool)
+
+    original = catalog.inspect_in_pool
+    monkeypatch.setattr(catalog, "inspect_in_pool", inspect_in_pool)
+    fill_database(session, [*roots, RootConfig(roots[0].path.parent.joinpath("other"), "other")], workers=4)
+    # Every root is scanned on a thread of its own, with its own number of workers or the default one.
+    assert sorted(pools.values()) == [1, 2, 4]
+    assert threading.current_thread().name not in pools
+
+
+def test_fill_database_root_moved(session, roots, tmp_path: Path):
+    fill_database(session, roots)
+    ids = dict(session.execute(select(File.path, File.id)).all())
+
+    moved = tmp_path.joinpath("mnt", "photos")
+    shutil.move(roots[0].path, moved)
+    fill_database(session, [RootConfig(moved, "photos"), roots[1]], incremental=True)
+    # The rows of the moved root are kept, under the new mount point.
+    assert dict(session.execute(select(File.path, File.id)).all()) == ids
+    assert session.scalar(select(Root.path).where(Root.name == "photos")) == f"{moved}/"
+    assert str(moved.joinpath("album", "red.jpg")) in session.scalars(select(File.name)).all()
+
+
+def test_fill_database_roots_prune(session, roots):
+    fill_database(session, roots)
+    roots[1].path.joinpath("red.jpg").unlink()
+    shutil.rmtree(roots[0].path)
+
+    fill_database(session, roots, incremental=True)
+    # The files of the unmounted root are kept, the file missing from the other root is pruned.
+    assert sorted(session.scalars(select(File.path))) == ["album/blue.jpg", "album/green.jpg", "album/red.jpg"]
+    assert session.scalar(select(DuplicateGroup)) is None
+    # The directory of the pruned file is deleted with it, as it has no file left.
+    assert session.scalars(select(Directory.path).where(Directory.root_id == 2)).all() == ["album/"]
+
+
+def test_names_criteria(session, roots):
+    nested = RootConfig(roots[0].path.joinpath("album"), "album")
+    rows = sync_roots(session, [*roots, nested])
+    assert sorted(row.name for row in session.scalars(select(Root))) == ["album", "archive", "photos"]
+
+    fill_database(session, [roots[1]])
+    fill_database(session, [nested])
+    names = [str(roots[0].path.joinpath("album", "red.jpg")), str(roots[1].path.joinpath("red.jpg")), "/elsewhere.jpg"]
+    # Names under nested roots belong to the innermost one.
+    matched = session.scalars(select(Directory.root_id).join(File.directory).where(names_criteria(session, names)))
+    assert sorted(matched) == [rows[1].id, rows[2].id]
+    assert delete_files_db(session, names) == 2
+    assert session.scalars(select(File.id).where(names_criteria(session, ["/elsewhere.jpg"]))).all() == []
+
+
+def test_move_files_db(session, roots):
+    fill_database(session, roots)
+    photos, archive = roots[0].path, roots[1].path
+    red = session.scalar(select(File).where(File.name == str(photos.joinpath("album", "red.jpg"))))
+    moves = [
+        (str(photos.joinpath("album", "red.jpg")), str(photos.joinpath("2024", "red.jpg"))),
+        # Replaces the catalogued blue.jpg, which is not a duplicate of red.jpg anymore.
+        (str(archive.joinpath("red.jpg")), str(archive.joinpath("album", "blue.jpg"))),
+        (str(photos.joinpath("album", "green.jpg")), "/elsewhere/green.jpg"),
+    ]
+    assert move_files_db(session, moves) == 2
+    session.commit()
+
+    assert sorted(session.scalars(select(File.name))) == [
+        str(photos.joinpath("2024", "red.jpg")),
+        str(archive.joinpath("album", "blue.jpg")),
+    ]
+    session.refresh(red)
+    assert (red.path, red.sha256) == ("2024/red.jpg", get_sha256(photos.joinpath("album", "red.jpg")))
+    assert session.scalar(select(DuplicateGroup.count)) == 2
+
+
+def test_move_out_of_roots_with_legacy_root(session, roots, tmp_path: Path):
+    fill_database(session, roots)
+    # The root the add_root_table migration creates for rows under no configured root.
+    legacy = Root(name=LEGACY_ROOT, path="/")
+    session.add(legacy)
+    session.commit()
+    photos, archive = roots[0].path, roots[1].path
+    outside = tmp_path.joinpath("outside")
+
+    moves = [
+        (str(photos.joinpath("album", "green.jpg")), str(outside.joinpath("green.jpg"))),
+        (str(archive.joinpath("red.jpg")), str(photos.joinpath("red.jpg"))),
+    ]
+    assert move_files_db(session, moves) == 1
+    assert move_directory_db(session, str(archive.joinpath("album")), str(outside.joinpath("album"))) == 0
+    session.commit()
+
+    # Moved outside of the configured roots, not filed under the legacy root.
+    assert sorted(session.scalars(select(File.name))) == [
+        str(photos.joinpath("album", "red.jpg")),
+        str(photos.joinpath("red.jpg")),
+    ]
+    assert session.scalar(select(Directory).where(Directory.root_id == legacy.id)) is None
+
+
+def test_merge_in_threads():
+    def numbers(start):
+        yield from range(start, start + 100)
+
+    def failing():
+        yield 1
+        raise OSError("unmounted")
+
+    merged = list(merge_in_threads([numbers(0), numbers(100)], queue_depth=4))
+    assert sorted(merged) == list(range(200))
+    assert [number for number in merged if number < 100] == list(range(100))
+
+    with pytest.raises(OSError, match="unmounted"):
+        list(merge_in_threads([numbers(0), failing()], queue_depth=4))
+
+
+def test_directory_batch_size():
+    # roots cannot import the constant from db_utils, which imports roots.
+    assert DIRECTORY_BATCH_SIZE == SQLITE_BATCH_SIZE
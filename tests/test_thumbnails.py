@@ -0,0 +1,101 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+import thumbnails
+from catalog import fill_database
+from thumbnails import get_thumbnail, make_thumbnail, thumbnail_path, warm_cache
+from utils import get_sha256
+
+
+@pytest.fixture
+def media_dir(tmp_path: Path, make_images) -> Path:
+    red = ("RGB", (2000, 1000), "red")
+    return make_images(
+        tmp_path.joinpath("media"), {"red0.jpg": red, "red1.jpg": red, "blue.png": ("RGBA", (500, 800), "blue")}
+    )
+
+
+def test_make_thumbnail(media_dir, tmp_path):
+    destination = make_thumbnail(media_dir.joinpath("blue.png"), tmp_path.joinpath("thumbs", "blue.jpg"), 256)
+    with Image.open(destination) as thumbnail:
+        assert thumbnail.format == "JPEG"
+        assert thumbnail.mode == "RGB"
+        assert thumbnail.size == (160, 256)
+
+
+def test_make_thumbnail_applies_orientation(tmp_path):
+    source = tmp_path.joinpath("rotated.jpg")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees clockwise
+    Image.new("RGB", (400, 200), "green").save(source, exif=exif)
+
+    with Image.open(make_thumbnail(source, tmp_path.joinpath("rotated-thumb.jpg"), 256)) as thumbnail:
+        assert thumbnail.size == (128, 256)
+
+
+def test_make_thumbnail_concurrently(media_dir, tmp_path, monkeypatch):
+    destination = tmp_path.joinpath("thumbs", "red.jpg")
+    # Both threads write their thumbnail at the same time, like two requests of the web app for the same image.
+    barrier = threading.Barrier(2, timeout=10)
+    save = Image.Image.save
+
+    def save_together(image, *args, **kwargs):
+        barrier.wait()
+        save(image, *args, **kwargs)
+
+    monkeypatch.setattr(Image.Image, "save", save_together)
+
+    with ThreadPoolExecutor(2) as executor:
+        futures = [executor.submit(make_thumbnail, media_dir.joinpath("red0.jpg"), destination, 256) for _ in range(2)]
+        assert [future.result() for future in futures] == [destination, destination]
+    with Image.open(destination) as thumbnail:
+        assert thumbnail.size == (256, 128)
+    assert [path.name for path in destination.parent.iterdir()] == ["red.jpg"]
+
+
+def fail_to_save(image, path, *args, **kwargs):
+    Path(path).write_bytes(b"\xff\xd8 partial")
+    raise OSError("No space left on device")
+
+
+@pytest.mark.parametrize("failure", ["truncated", "save"])
+def test_make_thumbnail_failure_leaves_no_file(media_dir, tmp_path, monkeypatch, failure):
+    source = media_dir.joinpath("red0.jpg")
+    if failure == "truncated":
+        data = source.read_bytes()
+        source.write_bytes(data[: len(data) // 2])
+    else:
+        monkeypatch.setattr(Image.Image, "save", fail_to_save)
+    destination = tmp_path.joinpath("thumbs", "red.jpg")
+
+    with pytest.raises(OSError):
+        make_thumbnail(source, destination, 256)
+    assert not destination.parent.exists() or list(destination.parent.iterdir()) == []
+
+
+def test_get_thumbnail_is_cached(media_dir, tmp_path, monkeypatch):
+    cache_dir = tmp_path.joinpath("thumbs")
+    checksum = get_sha256(media_dir.joinpath("red0.jpg"))
+    first = get_thumbnail(cache_dir, checksum, media_dir.joinpath("red0.jpg"), 512)
+    assert first == thumbnail_path(cache_dir, checksum, 512)
+
+    monkeypatch.setattr(thumbnails, "make_thumbnail", lambda *args: pytest.fail("Thumbnail created twice"))
+    assert get_thumbnail(cache_dir, checksum, media_dir.joinpath("red1.jpg"), 512) == first
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_warm_cache(session, media_dir, tmp_path, workers):
+    fill_database(session, media_dir)
+    cache_dir = tmp_path.joinpath("thumbs")
+
+    assert warm_cache(session, cache_dir, sizes=(256, 1024), workers=workers) == 2
+    red = get_sha256(media_dir.joinpath("red0.jpg"))
+    assert thumbnail_path(cache_dir, red, 256).is_file()
+    assert thumbnail_path(cache_dir, red, 1024).is_file()
+
+    assert warm_cache(session, cache_dir, sizes=(256, 1024), workers=workers) == 0
+    assert warm_cache(session, cache_dir, sizes=(256,), only_duplicates=False, workers=workers) == 1
@@ -0,0 +1,191 @@
+import random
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+import requests
+from sqlalchemy import create_engine, delete, event, select, update
+from sqlalchemy.orm import Session
+
+import uploader
+from catalog import fill_database
+from google_library import upload_photos
+from models import Base, Directory, File, Upload
+from photos_cache import get_album
+from roots import RootConfig, sync_roots
+from uploader import (
+    ByteBudget,
+    get_random_images,
+    pending_uploads,
+    sample_images,
+    sync,
+    upload_files,
+)
+from utils import MediaType, get_sha256
+
+
+@pytest.fixture
+def media_dir(tmp_path: Path, make_images) -> Path:
+    return make_images(
+        tmp_path.joinpath("media"), {"red.jpg": "red", "green.jpg": "green", "blue.jpg": "blue", "red-copy.jpg": "red"}
+    )
+
+
+@pytest.fixture
+def session(session, media_dir):
+    fill_database(session, media_dir)
+    for day, colour in enumerate(["red", "green", "blue"], start=1):
+        session.execute(update(File).where(File.name.like(f"%/{colour}%")).values(datestamp=datetime(2024, 1, day)))
+    session.commit()
+    return session
+
+
+@pytest.fixture
+def google_session(api):
+    with requests.Session() as google_session:
+        yield google_session
+
+
+@pytest.fixture(autouse=True)
+def worker_sessions(monkeypatch):
+    """Upload with plain sessions, the stand-in API needs no credentials."""
+    monkeypatch.setattr(
+        uploader,
+        "upload_photos",
+        lambda *args, **kwargs: upload_photos(*args, **kwargs, session_factory=requests.Session),
+    )
+
+
+def test_upload_files_skips_uploaded_content(api, session, google_session, media_dir):
+    album = get_album(session, google_session, "mediatool")
+    files = [
+        (str(media_dir.joinpath(name)), get_sha256(media_dir.joinpath(name))) for name in ["red.jpg", "red-copy.jpg"]
+    ]
+
+    results = upload_files(session, google_session, files, album)
+    assert [result.filename for result in results] == [files[0][0]]
+    upload = session.scalars(select(Upload)).one()
+    assert upload.sha256 == files[0][1]
+    assert upload.media_item_id == results[0].media_item["id"]
+    assert upload.album_id == album.id
+
+    assert upload_files(session, google_session, files, album) == []
+    assert len(api.uploads) == 1
+
+
+def test_sync_uploads_newest_first(api, session, google_session, media_dir):
+    album = get_album(session, google_session, "mediatool")
+    checksums = {colour: get_sha256(media_dir.joinpath(f"{colour}.jpg")) for colour in ["red", "green", "blue"]}
+    assert [checksum for _, checksum, *_ in pending_uploads(session)] == [
+        checksums[c] for c in ["blue", "green", "red"]
+    ]
+
+    assert sync(session, google_session, album, max_files=2) == 2
+    assert sorted(name for name, _ in api.uploads.values()) == ["blue.jpg", "green.jpg"]
+    assert [checksum for _, checksum, *_ in pending_uploads(session)] == [checksums["red"]]
+
+    assert sync(session, google_session, album) == 1
+    assert pending_uploads(session) == []
+
+
+def test_sync_within_budget(api, session, google_session):
+    album = get_album(session, google_session, "mediatool")
+    sizes = [size for _, _, size, _ in pending_uploads(session)]
+    now, waits = [0.0], []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    budget = ByteBudget(3600 * 10, clock=lambda: now[0], sleep=sleep)
+    budget.available = sizes[0]
+
+    sync(session, google_session, album, budget=budget)
+    # The first file fits the remaining budget, the others wait for it to refill at 10 bytes per second.
+    assert waits == [pytest.approx(sizes[1] / 10), pytest.approx(sizes[2] / 10)]
+
+
+def test_byte_budget():
+    now, waits = [0.0], []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    budget = ByteBudget(3600, clock=lambda: now[0], sleep=sleep)
+    budget.acquire(3000)
+    budget.acquire(600)
+    assert waits == []
+    budget.acquire(100)
+    assert waits == [pytest.approx(100)]
+    # A file larger than the hourly budget waits for a full hour of budget.
+    budget.acquire(10_000)
+    assert waits[-1] == pytest.approx(3600)
+
+
+@pytest.fixture
+def catalog(tmp_path: Path):
+    engine = create_engine(f"sqlite+pysqlite:///{tmp_path.joinpath('sample.db')}", echo=False)
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        [root] = sync_roots(session, [RootConfig(Path("/media"))])
+        directory = Directory(root=root, path="")
+        session.add_all(
+            File(
+                directory=directory,
+                basename=f"{i}.{'mp4' if i % 10 == 0 else 'jpg'}",
+                size=i,
+                sha256=f"{i:064x}",
+                filetype=MediaType.video if i % 10 == 0 else MediaType.image,
+                datestamp=datetime(2000 + i % 20, 1, 1),
+            )
+            for i in range(1, 501)
+        )
+        session.commit()
+        yield session
+
+
+def test_sample_images_distinct(catalog):
+    images = sample_images(catalog, 50, rng=random.Random(1))
+    assert len({image.id for image in images}) == 50
+    assert all(image.filetype == MediaType.image for image in images)
+    assert sample_images(catalog, 50, rng=random.Random(1)) == images
+    assert len(get_random_images(catalog, 5)) == 5
+
+
+def test_sample_images_filters(catalog):
+    catalog.add(Upload(sha256=f"{1:064x}", media_item_id="item", uploaded_at=datetime.now()))
+    catalog.commit()
+    images = sample_images(
+        catalog, 10, since=datetime(2005, 1, 1), until=datetime(2010, 1, 1), max_size=300, not_uploaded=True
+    )
+    assert len(images) == 10
+    for image in images:
+        assert datetime(2005, 1, 1) <= image.datestamp < datetime(2010, 1, 1)
+        assert image.size <= 300
+
+    # Fewer matching images than requested returns all of them.
+    images = sample_images(catalog, 10, max_size=5, not_uploaded=True)
+    assert sorted(image.size for image in images) == [2, 3, 4, 5]
+    assert sample_images(catalog, 10, min_size=1000) == []
+
+
+def test_sample_images_gives_up_probing(catalog, monkeypatch):
+    monkeypatch.setattr(uploader, "SAMPLE_PROBE_WINDOW", 5)
+    statements = []
+    event.listen(catalog.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    # One image in 20 matches, so most windows of 5 ids hold none.
+    images = sample_images(catalog, 10, rng=random.Random(1), since=datetime(2005, 1, 1), until=datetime(2006, 1, 1))
+    assert len({image.id for image in images}) == 10
+    assert all(image.datestamp == datetime(2005, 1, 1) for image in images)
+
+    statements.clear()
+    assert sample_images(catalog, 10, min_size=1000) == []
+    # The lowest and highest ids, SAMPLE_MISSED_PROBES probes and the random sort.
+    assert len(statements) == 2 + uploader.SAMPLE_MISSED_PROBES + 1
+
+
+def test_sample_images_empty_catalog(session):
+    session.execute(delete(File))
+    assert sample_images(session, 5) == []
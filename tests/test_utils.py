@@ -1,8 +1,12 @@
 from datetime import datetime
+from mimetypes import guess_type
 from pathlib import Path
 
 import pytest
+from PIL import Image
+from PIL.ExifTags import Base as ExifBase
 
+import utils
 from utils import (
     MediaType,
     datestamp_to_filename_stem,
@@ -10,11 +14,14 @@ from utils import (
     datestring_to_date,
     get_datestamp,
     get_media_type,
+    get_partial_hash,
     get_recommended_filename,
     get_sha256,
     is_image,
     is_media,
     is_video,
+    probe_file,
+    sniff_media_type,
 )
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -28,6 +35,18 @@ def test_get_sha256():
     )
 
 
+def test_get_partial_hash(tmp_path):
+    head, tail = b"h" * 100, b"t" * 100
+    tmp_path.joinpath("a.bin").write_bytes(head + b"a" * 1000 + tail)
+    tmp_path.joinpath("b.bin").write_bytes(head + b"b" * 1000 + tail)
+    tmp_path.joinpath("c.bin").write_bytes(head + b"a" * 1000 + b"x" + tail[1:])
+
+    partial_a = get_partial_hash(tmp_path.joinpath("a.bin"), sample_size=100)
+    assert partial_a == get_partial_hash(tmp_path.joinpath("b.bin"), sample_size=100)
+    assert partial_a != get_partial_hash(tmp_path.joinpath("c.bin"), sample_size=100)
+    assert partial_a != get_partial_hash(tmp_path.joinpath("a.bin"))
+
+
 def test_is_image():
     assert is_image(Path("/path/does/not/matter/filename.jpg")) is True
     assert is_image(Path("/path/does/not/matter/filename.mov")) is False
@@ -55,6 +74,66 @@ def test_get_media_type():
     assert get_media_type(Path("/path/does/not/matter/filename.txt")) == MediaType.unknown
 
 
+@pytest.mark.parametrize(
+    "name",
+    [
+        "photo.jpg",
+        "PHOTO.JPG",
+        "clip.MOV",
+        "clip.mp4",
+        "archive.tar.gz",
+        "photo.jpg.gz",
+        "image.svgz",
+        ".hidden.png",
+        ".jpg",
+        "no_extension",
+        "trailing.",
+        "notes.txt",
+        "dir.with.dots/photo.heic",
+    ],
+)
+def test_get_media_type_matches_guess_type(name):
+    guessed_type = guess_type(Path("/some/path", name))[0] or ""
+    expected = (
+        MediaType.image
+        if guessed_type.startswith("image")
+        else MediaType.video if guessed_type.startswith("video") else MediaType.unknown
+    )
+    assert get_media_type(Path("/some/path", name)) == expected
+
+
+def test_get_media_type_sniff(tmp_path):
+    misnamed = tmp_path.joinpath("IMG_0001.dat")
+    Image.new("RGB", (16, 16), "red").save(misnamed, "JPEG")
+    video = tmp_path.joinpath("clip")
+    video.write_bytes(b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00")
+    text = tmp_path.joinpath("notes.jpg")
+    text.write_text("not really an image")
+
+    assert get_media_type(misnamed) == MediaType.unknown
+    assert get_media_type(misnamed, sniff=True) == MediaType.image
+    assert get_media_type(video, sniff=True) == MediaType.video
+    assert get_media_type(text, sniff=True) == MediaType.image
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        (b"\x89PNG\r\n\x1a\n\x00\x00", MediaType.image),
+        (b"RIFF\x00\x00\x00\x00WEBPVP8 ", MediaType.image),
+        (b"RIFF\x00\x00\x00\x00AVI LIST", MediaType.video),
+        (b"RIFF\x00\x00\x00\x00WAVEfmt ", MediaType.unknown),
+        (b"\x00\x00\x00\x18ftypheic\x00\x00", MediaType.image),
+        (b"\x00\x00\x00\x14ftypqt  \x00\x00", MediaType.video),
+        (b"\x00\x00\x00\x20ftypM4A \x00\x00", MediaType.unknown),
+        (b"\x1aE\xdf\xa3\x01\x00", MediaType.video),
+        (b"plain text", MediaType.unknown),
+    ],
+)
+def test_sniff_media_type(header, expected):
+    assert sniff_media_type(header) == expected
+
+
 def test_get_datestamp():
     assert get_datestamp(DATA_DIR.joinpath("Rose/20210612_091420.jpg")) == datetime.strptime(
         "2021-06-12 09:14:20", "%Y-%m-%d %H:%M:%S"
@@ -70,6 +149,20 @@ def test_get_datestamp():
     assert get_datestamp(DATA_DIR.joinpath("problems/Hockey and stuff 014.JPG")) is None
 
 
+def test_probe_file(tmp_path):
+    image_path = tmp_path.joinpath("image.jpg")
+    exif = Image.Exif()
+    exif[ExifBase.DateTime] = "2021:06:12 09:14:20"
+    Image.new("RGB", (16, 16), "red").save(image_path, exif=exif)
+
+    probe = probe_file(image_path)
+    assert probe.filetype == MediaType.image
+    assert probe.size == image_path.stat().st_size
+    assert probe.digest == get_sha256(image_path)
+    assert probe.datestamp == get_datestamp(image_path) == datetime(2021, 6, 12, 9, 14, 20)
+    assert probe_file(image_path, compute_hash=False).digest is None
+
+
 def test_datestamp_to_filenam_stem():
     assert (
         datestamp_to_filename_stem(datetime.strptime("2021-06-12 09:14:20", "%Y-%m-%d %H:%M:%S")) == "20210612_091420"
@@ -110,3 +203,12 @@ def test_datestring_to_date():
 
     with pytest.raises(ValueError):
         datestring_to_date("2021x06x12 09:14:20.345000")
+
+
+def test_get_recommended_filename_from_datestamp(monkeypatch):
+    monkeypatch.setattr(utils, "get_datestamp", lambda path: pytest.fail("The image was opened"))
+    datestamp = datetime(2021, 6, 12, 9, 14, 20)
+    assert get_recommended_filename(Path("/photos/IMG_0001.jpeg"), datestamp=datestamp) == Path(
+        "/photos/20210612_091420.jpg"
+    )
+    assert get_recommended_filename(Path("/photos/README"), datestamp=datestamp) is None
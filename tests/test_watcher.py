@@ -0,0 +1,270 @@
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import pytest
+from PIL import Image
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import watcher
+from catalog import fill_database
+from models import Directory, DuplicateGroup, File
+from roots import RootConfig
+from watcher import ChangeCollector, Changes, apply_changes, no_changes, watch
+
+
+class Event(NamedTuple):
+    event_type: str
+    src_path: str
+    dest_path: str = ""
+    is_directory: bool = False
+
+
+def no_inspection(*args):
+    pytest.fail(f"{args[0]} was inspected")
+
+
+@pytest.fixture
+def media_dir(tmp_path: Path, make_images) -> Path:
+    return make_images(
+        tmp_path.joinpath("media"), {f"album/{colour}.jpg": colour for colour in ("red", "green", "blue")}
+    )
+
+
+@pytest.fixture
+def session(session, media_dir: Path):
+    fill_database(session, [RootConfig(media_dir)])
+    return session
+
+
+def names(session: Session) -> list[str]:
+    return sorted(session.scalars(select(File.name)))
+
+
+def wait_for_file(engine, name: str, timeout: float = 10) -> int | None:
+    """The id of the file once the watcher catalogued it, polled with short transactions to not block the watcher."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with Session(engine) as session:
+            id = session.scalar(select(File.id).where(File.name == name))
+        if id is not None:
+            return id
+        time.sleep(0.1)
+    return None
+
+
+def test_collector_debounces_bursts():
+    collector = ChangeCollector(debounce=0.2, max_delay=5)
+    stop = threading.Event()
+    for event in [
+        Event("created", "/media/card/.IMG_1.jpg.part"),
+        Event("modified", "/media/card/.IMG_1.jpg.part"),
+        Event("moved", "/media/card/.IMG_1.jpg.part", "/media/card/IMG_1.jpg"),
+        Event("created", "/media/card/IMG_2.jpg"),
+        Event("deleted", "/media/card/IMG_2.jpg"),
+        Event("deleted", "/media/old/IMG_3.jpg"),
+        Event("moved", "/media/new/IMG_4.jpg", "/media/old/IMG_3.jpg"),
+        Event("created", "/media/trip", is_directory=True),
+        Event("modified", "/media/trip", is_directory=True),
+        Event("opened", "/media/card/IMG_1.jpg"),
+    ]:
+        collector.dispatch(event)
+
+    start = time.monotonic()
+    changes = collector.wait(stop)
+    assert time.monotonic() - start >= 0.15
+    assert changes == Changes(
+        changed={"/media/card/IMG_1.jpg"},
+        deleted={"/media/card/IMG_2.jpg"},
+        moves=[
+            ("/media/card/.IMG_1.jpg.part", "/media/card/IMG_1.jpg", False),
+            ("/media/new/IMG_4.jpg", "/media/old/IMG_3.jpg", False),
+        ],
+        created_directories={"/media/trip"},
+        deleted_directories=set(),
+    )
+    stop.set()
+    assert collector.wait(stop) is None
+
+
+def test_collector_directory_moves():
+    collector = ChangeCollector(debounce=0, max_delay=5)
+    for event in [
+        # inotify reports the contents of a moved directory after it, polling before it.
+        Event("moved", "/media/album", "/media/2024", is_directory=True),
+        Event("moved", "/media/album/red.jpg", "/media/2024/red.jpg"),
+        Event("moved", "/media/card/IMG_1.jpg", "/media/trip/IMG_1.jpg"),
+        Event("moved", "/media/card", "/media/trip", is_directory=True),
+        Event("moved", "/media/trip/IMG_2.jpg", "/media/trip/beach.jpg"),
+    ]:
+        collector.dispatch(event)
+    assert collector.wait(threading.Event()).moves == [
+        ("/media/album", "/media/2024", True),
+        ("/media/card", "/media/trip", True),
+        ("/media/trip/IMG_2.jpg", "/media/trip/beach.jpg", False),
+    ]
+
+
+def test_collector_max_delay():
+    collector = ChangeCollector(debounce=0.2, max_delay=0.5)
+    stop = threading.Event()
+
+    def keep_changing():
+        for number in range(20):
+            collector.dispatch(Event("created", f"/media/{number}.jpg"))
+            time.sleep(0.1)
+
+    thread = threading.Thread(target=keep_changing)
+    thread.start()
+    batches = [collector.wait(stop).changed]
+    while sum(map(len, batches)) < 20:
+        batches.append(collector.wait(stop).changed)
+    thread.join()
+    # Handed out every max_delay while the burst goes on.
+    assert 3 <= len(batches) <= 5
+    assert set().union(*batches) == {f"/media/{number}.jpg" for number in range(20)}
+
+
+def test_apply_changes_moves(session, media_dir: Path):
+    ids = dict(session.execute(select(File.name, File.id)).all())
+    album, trips = media_dir.joinpath("album"), media_dir.joinpath("trips")
+    trips.mkdir()
+    shutil.move(album.joinpath("red.jpg"), trips.joinpath("red.jpg"))
+    changes = no_changes()
+    changes.moves.append((str(album.joinpath("red.jpg")), str(trips.joinpath("red.jpg")), False))
+    changes.created_directories.add(str(trips))
+    apply_changes(session, changes, inspect=no_inspection)
+
+    shutil.move(album, media_dir.joinpath("2024"))
+    changes = no_changes()
+    changes.moves.append((str(album), str(media_dir.joinpath("2024")), True))
+    apply_changes(session, changes, inspect=no_inspection)
+
+    # The rows follow the files and the directory without inspecting them again.
+    assert dict(session.execute(select(File.name, File.id)).all()) == {
+        str(trips.joinpath("red.jpg")): ids[str(album.joinpath("red.jpg"))],
+        str(media_dir.joinpath("2024", "green.jpg")): ids[str(album.joinpath("green.jpg"))],
+        str(media_dir.joinpath("2024", "blue.jpg")): ids[str(album.joinpath("blue.jpg"))],
+    }
+    assert sorted(session.scalars(select(Directory.path))) == ["2024/", "trips/"]
+
+
+def test_apply_changes_created_and_deleted(session, media_dir: Path, tmp_path: Path):
+    album = media_dir.joinpath("album")
+    shutil.copy(album.joinpath("red.jpg"), album.joinpath("red copy.jpg"))
+    Image.new("RGB", (16, 16), "white").save(album.joinpath("white.jpg"))
+    album.joinpath("notes.txt").write_text("not an image")
+    album.joinpath("blue.jpg").unlink()
+    # A directory moved in from outside of the root has no events for its files.
+    outside = tmp_path.joinpath("card")
+    outside.mkdir()
+    Image.new("RGB", (16, 16), "black").save(outside.joinpath("black.jpg"))
+    shutil.move(outside, media_dir.joinpath("card"))
+
+    changes = no_changes()
+    changes.changed.update(str(album.joinpath(name)) for name in ("red copy.jpg", "white.jpg", "notes.txt", "red.jpg"))
+    changes.deleted.add(str(album.joinpath("blue.jpg")))
+    changes.moves.append((str(outside), str(media_dir.joinpath("card")), True))
+    apply_changes(session, changes)
+
+    assert names(session) == sorted(
+        [
+            str(media_dir.joinpath("card", "black.jpg")),
+            str(album.joinpath("green.jpg")),
+            str(album.joinpath("red copy.jpg")),
+            str(album.joinpath("red.jpg")),
+            str(album.joinpath("white.jpg")),
+        ]
+    )
+    assert session.scalar(select(DuplicateGroup.count)) == 2
+
+    shutil.rmtree(album)
+    changes = no_changes()
+    changes.deleted_directories.add(str(album))
+    apply_changes(session, changes)
+    assert names(session) == [str(media_dir.joinpath("card", "black.jpg"))]
+    assert session.scalar(select(DuplicateGroup)) is None
+    assert session.scalars(select(Directory.path)).all() == ["card/"]
+
+
+def test_watch_polling(engine, media_dir: Path):
+    pytest.importorskip("watchdog")
+    stop = threading.Event()
+
+    def run():
+        with Session(engine) as session:
+            watch(session, [RootConfig(media_dir, poll=True)], poll_interval=0.1, debounce=0.1, stop=stop)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        time.sleep(0.5)
+        Image.new("RGB", (16, 16), "white").save(media_dir.joinpath("white.jpg"))
+        assert wait_for_file(engine, str(media_dir.joinpath("white.jpg"))) is not None
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_watch_survives_errors(engine, media_dir: Path, monkeypatch):
+    pytest.importorskip("watchdog")
+    applied = []
+
+    def apply_changes(session, changes, **options):
+        if not applied:
+            applied.append(None)
+            raise OperationalError("UPDATE file", {}, sqlite3.OperationalError("database is locked"))
+        original(session, changes, **options)
+
+    original = watcher.apply_changes
+    monkeypatch.setattr(watcher, "apply_changes", apply_changes)
+    stop = threading.Event()
+
+    def run():
+        with Session(engine) as session:
+            watch(session, [RootConfig(media_dir, poll=True)], poll_interval=0.1, debounce=0.1, stop=stop)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        time.sleep(0.5)
+        Image.new("RGB", (16, 16), "white").save(media_dir.joinpath("white.jpg"))
+        assert wait_for_file(engine, str(media_dir.joinpath("white.jpg")), timeout=1) is None
+        assert applied and thread.is_alive()
+        # Changes after the failed batch are catalogued.
+        Image.new("RGB", (16, 16), "black").save(media_dir.joinpath("black.jpg"))
+        assert wait_for_file(engine, str(media_dir.joinpath("black.jpg"))) is not None
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_watch_inotify_moves(engine, session, media_dir: Path, monkeypatch):
+    pytest.importorskip("watchdog")
+    ids = dict(session.execute(select(File.name, File.id)).all())
+    session.close()
+    inspected = []
+    monkeypatch.setattr("watcher.inspect_file", lambda pathname, **options: inspected.append(pathname) or {})
+    stop = threading.Event()
+
+    def run():
+        with Session(engine) as session:
+            watch(session, [RootConfig(media_dir)], debounce=0.1, stop=stop)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        time.sleep(0.5)
+        media_dir.joinpath("album", "red.jpg").rename(media_dir.joinpath("album", "rouge.jpg"))
+        media_dir.joinpath("album").rename(media_dir.joinpath("2024"))
+        red = ids[str(media_dir.joinpath("album", "red.jpg"))]
+        assert wait_for_file(engine, str(media_dir.joinpath("2024", "rouge.jpg"))) == red
+    finally:
+        stop.set()
+        thread.join()
+    assert inspected == []
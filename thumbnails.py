@@ -0,0 +1,163 @@
+"""Content addressed cache of image thumbnails for the web UI.
+
+Thumbnails are stored as <cache dir>/<checksum[:2]>/<checksum>-<size>.jpg. A checksum identifies the contents of the
+original, so a cached thumbnail never goes stale and is shared by all duplicates of an image.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from configparser import ConfigParser
+from functools import partial
+from pathlib import Path
+
+import click
+from PIL import Image, ImageOps
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from db_utils import get_engine
+from logging_setup import logging_setup
+from models import Base, DuplicateGroup, File
+from utils import MediaType, load_config
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels of the thumbnails which may be requested. A fixed set keeps the cache bounded.
+THUMBNAIL_SIZES = (256, 512, 1024, 2048)
+THUMBNAIL_QUALITY = 85
+
+
+def get_cache_dir(config_file="mediatool.ini") -> Path:
+    """The thumbnail cache directory, thumbnail_dir in the configuration or else 'thumbnails' next to the database."""
+    config = ConfigParser()
+    config.read(config_file)
+    if config.has_option("mediatool", "thumbnail_dir"):
+        return Path(config.get("mediatool", "thumbnail_dir"))
+    return Path(config.get("mediatool", "db_file")).parent.joinpath("thumbnails")
+
+
+def thumbnail_path(cache_dir: Path, checksum: str, size: int) -> Path:
+    return cache_dir.joinpath(checksum[:2], f"{checksum}-{size}.jpg")
+
+
+def make_thumbnail(source, destination: Path, size: int) -> Path:
+    """Write a JPEG thumbnail of an image whose longest edge is at most size pixels.
+
+    JPEGs are decoded with draft(), which lets the decoder scale down by up to 8x while reading, so a 40 MP photo is
+    never fully decoded. The thumbnail is written under a temporary name and renamed into place, so concurrent
+    requests and warm-up workers never see a partial file.
+
+    Args:
+        source: The path of the original image
+        destination (Path): The path of the thumbnail
+        size (int): Longest edge of the thumbnail in pixels
+
+    Returns:
+        Path: The destination
+    """
+    logger.debug(f"Creating {size}px thumbnail of {source}")
+    with Image.open(source) as image:
+        image.draft("RGB", (size, size))
+        thumbnail = ImageOps.exif_transpose(image)
+        thumbnail.thumbnail((size, size))
+        if thumbnail.mode != "RGB":
+            thumbnail = thumbnail.convert("RGB")
+
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    # Named after the process and the thread, as the threads of the web app may create the same thumbnail at once.
+    temporary = destination.with_name(f".{destination.name}.{os.getpid()}.{threading.get_ident()}")
+    try:
+        thumbnail.save(temporary, "JPEG", quality=THUMBNAIL_QUALITY)
+        temporary.replace(destination)
+    except Exception:
+        temporary.unlink(missing_ok=True)
+        raise
+    return destination
+
+
+def get_thumbnail(cache_dir: Path, checksum: str, source, size: int) -> Path:
+    """The cached thumbnail of a checksum, created from source if it is not cached yet."""
+    destination = thumbnail_path(cache_dir, checksum, size)
+    if destination.is_file():
+        return destination
+    return make_thumbnail(source, destination, size)
+
+
+def images_to_warm(session: Session, only_duplicates: bool = True):
+    """One (checksum, path) per distinct image content, for the duplicate groups only or for every image."""
+    statement = select(File.sha256, func.min(File.name)).where(File.filetype == MediaType.image)
+    if only_duplicates:
+        statement = statement.join(DuplicateGroup, DuplicateGroup.sha256 == File.sha256)
+    else:
+        statement = statement.where(File.sha256.is_not(None))
+    return session.execute(statement.group_by(File.sha256)).all()
+
+
+def _warm_one(cache_dir: Path, sizes, job) -> int:
+    checksum, source = job
+    created = 0
+    for size in sizes:
+        if not thumbnail_path(cache_dir, checksum, size).is_file():
+            try:
+                make_thumbnail(source, thumbnail_path(cache_dir, checksum, size), size)
+                created += 1
+            except OSError as e:
+                logger.warning(f"Unable to create a thumbnail of {source}. {e}")
+                break
+    return created
+
+
+def warm_cache(session: Session, cache_dir: Path, sizes=(1024,), only_duplicates: bool = True, workers: int = 0) -> int:
+    """Create the missing thumbnails of catalogued images in parallel.
+
+    Args:
+        session (Session): The database session
+        cache_dir (Path): The thumbnail cache directory
+        sizes (optional): Thumbnail sizes to create. Defaults to (1024,), the size shown by the /dupes view.
+        only_duplicates (bool, optional): Only images in a duplicate group. Defaults to True.
+        workers (int, optional): Number of worker processes, 0 to work serially. Defaults to 0.
+
+    Returns:
+        int: The number of thumbnails created
+    """
+    jobs = images_to_warm(session, only_duplicates)
+    logger.info(f"Warming thumbnails of {len(jobs)} images.")
+    warm = partial(_warm_one, cache_dir, tuple(sizes))
+    if not workers:
+        return sum(map(warm, jobs))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(warm, jobs, chunksize=16))
+
+
+@click.command()
+@click.option(
+    "--size",
+    "sizes",
+    type=click.Choice([str(size) for size in THUMBNAIL_SIZES]),
+    multiple=True,
+    default=["1024"],
+    show_default=True,
+    help="Thumbnail size to create, may be repeated.",
+)
+@click.option(
+    "--only-duplicates/--all-images",
+    default=True,
+    help="Create thumbnails for the images in duplicate groups only, or for every catalogued image.",
+)
+@click.option("--workers", default=os.cpu_count(), show_default=True, help="Number of processes creating thumbnails.")
+def main(sizes, only_duplicates, workers):
+    logging_setup()
+    _, DBFILE = load_config("mediatool.ini")
+    cache_dir = get_cache_dir("mediatool.ini")
+    engine = get_engine(DBFILE)
+    Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        created = warm_cache(session, cache_dir, [int(size) for size in sizes], only_duplicates, workers)
+    logger.info(f"Created {created} thumbnails in {cache_dir}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,26 @@
 import logging
 import random
+import time
+from datetime import datetime
 from pathlib import Path
 
-from sqlalchemy import create_engine, select
+import click
+from more_itertools import chunked
+from sqlalchemy import and_, desc, exists, func, nulls_last, select
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import Session
 
-from google_library import get_authorized_session, upload_photos
+from db_utils import SQLITE_BATCH_SIZE, get_engine
+from google_library import BATCH_CREATE_SIZE, get_authorized_session, upload_photos
 from logging_setup import logging_setup
-from models import Base, File
-from utils import load_config
+from models import Base, File, RemoteAlbum, Upload
+from photos_cache import (
+    album_filenames,
+    get_album,
+    record_uploaded_items,
+    refresh_album_items,
+)
+from utils import MediaType, load_config
 
 logging_setup()
 logger = logging.getLogger(__name__)
@@ -20,27 +32,275 @@ urllib3_logger = logging.getLogger("urllib3.connectionpool")
 urllib3_logger.setLevel(logging.INFO)
 
 
-def get_random_images(session: Session, qty=5):
-    # It is inefficient to load all the images and then take a random subset, but it works for now.
-    statement = select(File).filter_by(filetype="image")
-    all_images = [image.name for image in [row.File for row in session.execute(statement).all()]]
-    random_images = random.choices(all_images, k=qty)
+# Random probes per requested image before sample_images falls back to sorting the matching rows randomly.
+SAMPLE_PROBES_PER_IMAGE = 4
+# Ids a probe looks at, so a probe reads a bounded number of rows however selective the filters are.
+SAMPLE_PROBE_WINDOW = 1000
+# Probes finding no image before sample_images gives up probing, as few images match the filters.
+SAMPLE_MISSED_PROBES = 3
 
-    return random_images
 
+def sample_criteria(
+    since: datetime | None = None,
+    until: datetime | None = None,
+    min_size: int | None = None,
+    max_size: int | None = None,
+    not_uploaded: bool = False,
+) -> tuple[list, list]:
+    """The WHERE criteria of the images sample_images may pick.
 
-def main():
+    Returns:
+        tuple[list, list]: The file type and upload criteria, and the datestamp and size ranges
+    """
+    image_criteria = [File.filetype == MediaType.image]
+    if not_uploaded:
+        image_criteria += [File.sha256.is_not(None), ~exists().where(Upload.sha256 == File.sha256)]
+    range_criteria = []
+    if since is not None:
+        range_criteria.append(File.datestamp >= since)
+    if until is not None:
+        range_criteria.append(File.datestamp < until)
+    if min_size is not None:
+        range_criteria.append(File.size >= min_size)
+    if max_size is not None:
+        range_criteria.append(File.size <= max_size)
+    return image_criteria, range_criteria
+
+
+def sample_images(session: Session, k: int = 5, rng=random, **filters) -> list[File]:
+    """Pick up to k distinct random images without reading the whole catalog.
+
+    Each probe draws a random id between the lowest and the highest file id and takes the first matching image among
+    the SAMPLE_PROBE_WINDOW ids from there, so it only walks a bounded range of the primary key index. Images
+    following a run of ids that do not match are a little more likely to be picked, which is fine for picking photos
+    to upload. When SAMPLE_MISSED_PROBES probes find nothing or the probes find fewer than k images, because few
+    images match the filters, the matching images are sorted randomly in the database instead.
+
+    Args:
+        session (Session): The database session
+        k (int, optional): Number of images. Defaults to 5.
+        rng (optional): The source of random numbers. Defaults to the random module.
+        **filters: since, until, min_size, max_size and not_uploaded, see sample_criteria
+
+    Returns:
+        list[File]: At most k images, fewer if fewer match the filters
+    """
+    image_criteria, range_criteria = sample_criteria(**filters)
+    criteria = image_criteria + range_criteria
+    # Separate queries, SQLite only reads min() or max() from the index when it is the only aggregate.
+    low, high = session.scalar(select(func.min(File.id))), session.scalar(select(func.max(File.id)))
+    if low is None or k <= 0:
+        return []
+
+    def first_match(start: int) -> File | None:
+        window = and_(File.id >= start, File.id < start + SAMPLE_PROBE_WINDOW)
+        return session.scalars(select(File).where(window, *criteria).order_by(File.id).limit(1)).first()
+
+    picked, missed = {}, 0
+    for _ in range(k * SAMPLE_PROBES_PER_IMAGE):
+        image = first_match(rng.randint(low, high))
+        if image is None:
+            missed += 1
+            if missed == SAMPLE_MISSED_PROBES:
+                break
+            continue
+        picked[image.id] = image
+        if len(picked) == k:
+            return list(picked.values())
+
+    logger.debug(f"Random probes found {len(picked)} of {k} images, sampling the matching images instead.")
+    fallback = select(File).where(*criteria).order_by(func.random()).limit(k)
+    if range_criteria:
+        # SQLite prefers the filetype index to the datestamp and size ones and would walk every image, so the ids
+        # within the ranges are looked up first.
+        fallback = fallback.where(File.id.in_(select(File.id).where(*range_criteria)))
+    return list(session.scalars(fallback))
+
+
+def get_random_images(session: Session, qty=5) -> list[str]:
+    """The names of qty distinct random images."""
+    return [image.name for image in sample_images(session, qty)]
+
+
+class ByteBudget:
+    """Limit the bytes uploaded per hour with a token bucket holding up to one hour of budget."""
+
+    def __init__(self, bytes_per_hour: int, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = bytes_per_hour
+        self.rate = bytes_per_hour / 3600
+        self.available = bytes_per_hour
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, size: int):
+        """Wait until size bytes may be sent. Files larger than the whole budget wait for a full bucket."""
+        self.refill()
+        needed = min(size, self.capacity)
+        if self.available < needed:
+            wait = (needed - self.available) / self.rate
+            logger.info(f"Upload budget used up, waiting {wait:.0f} seconds.")
+            self.sleep(wait)
+            self.refill()
+        self.available -= size
+
+
+def uploaded_checksums(session: Session, checksums) -> set[str]:
+    """The checksums already in the upload ledger, looked up SQLITE_BATCH_SIZE at a time."""
+    uploaded = set()
+    for batch in chunked(set(checksums), SQLITE_BATCH_SIZE):
+        uploaded.update(session.scalars(select(Upload.sha256).where(Upload.sha256.in_(batch))))
+    return uploaded
+
+
+def record_uploads(session: Session, results, checksum_by_name: dict, album_id) -> int:
+    """Add the files uploaded successfully to the upload ledger and commit.
+
+    Returns:
+        int: The number of files recorded
+    """
+    now = datetime.now()
+    rows = [
+        {
+            "sha256": checksum_by_name[str(result.filename)],
+            "media_item_id": result.media_item["id"],
+            "album_id": album_id,
+            "uploaded_at": now,
+        }
+        for result in results
+        if result.media_item
+    ]
+    for batch in chunked(rows, SQLITE_BATCH_SIZE):
+        session.execute(insert(Upload).values(batch).on_conflict_do_nothing())
+    session.commit()
+    return len(rows)
+
+
+def upload_files(sql_session: Session, google_session, files, album: RemoteAlbum, workers: int = 4) -> list:
+    """Upload files whose content is not in the upload ledger yet, and record them in the ledger and the album cache.
+
+    Args:
+        sql_session (Session): The database session
+        google_session: The authorized session
+        files: (name, sha256) pairs
+        album (RemoteAlbum): The album to add the files to
+        workers (int, optional): Number of concurrent uploads. Defaults to 4.
+
+    Returns:
+        list[UploadResult]: The results of the files which were sent
+    """
+    checksum_by_name = {}
+    uploaded = uploaded_checksums(sql_session, [checksum for _, checksum in files])
+    for name, checksum in files:
+        if checksum not in uploaded:
+            # Copies of the same content are only sent once.
+            uploaded.add(checksum)
+            checksum_by_name[str(name)] = checksum
+    logger.info(f"Uploading {len(checksum_by_name)} of {len(files)} files, the others were uploaded before.")
+    if not checksum_by_name:
+        return []
+
+    results = upload_photos(google_session, list(checksum_by_name), album.title, workers=workers, album_id=album.id)
+    record_uploads(sql_session, results, checksum_by_name, album.id)
+    record_uploaded_items(sql_session, album, [result.media_item for result in results if result.media_item])
+    return results
+
+
+def pending_uploads(session: Session):
+    """One (name, sha256, size, datestamp) per media content not uploaded yet, newest datestamp first."""
+    statement = (
+        select(func.min(File.name), File.sha256, func.min(File.size), func.max(File.datestamp).label("datestamp"))
+        .outerjoin(Upload, Upload.sha256 == File.sha256)
+        .where(
+            File.filetype.in_([MediaType.image, MediaType.video]),
+            File.sha256.is_not(None),
+            Upload.sha256.is_(None),
+        )
+        .group_by(File.sha256)
+        .order_by(nulls_last(desc("datestamp")), File.sha256)
+    )
+    return session.execute(statement).all()
+
+
+def sync(
+    sql_session: Session,
+    google_session,
+    album: RemoteAlbum,
+    budget: ByteBudget | None = None,
+    workers: int = 4,
+    max_files: int | None = None,
+) -> int:
+    """Upload all media content missing from the upload ledger, newest first, within a bytes per hour budget.
+
+    Files are sent BATCH_CREATE_SIZE at a time and recorded after every batch, so an interrupted sync resumes where
+    it stopped.
+
+    Returns:
+        int: The number of files uploaded
+    """
+    unhashed = sql_session.scalar(
+        select(func.count())
+        .select_from(File)
+        .where(File.filetype.in_([MediaType.image, MediaType.video]), File.sha256.is_(None))
+    )
+    if unhashed:
+        logger.warning(f"Skipping {unhashed} files without a checksum, run a full scan of the catalog to include them.")
+
+    pending = pending_uploads(sql_session)[:max_files]
+    logger.info(f"{len(pending)} files to upload.")
+    uploaded = 0
+    for batch in chunked(pending, BATCH_CREATE_SIZE):
+        if budget:
+            for _, _, size, _ in batch:
+                budget.acquire(size)
+        results = upload_files(
+            sql_session, google_session, [(name, checksum) for name, checksum, _, _ in batch], album, workers
+        )
+        uploaded += sum(1 for result in results if result.media_item)
+    return uploaded
+
+
+@click.command()
+@click.option("--count", default=5, show_default=True, help="Number of random images to upload.")
+@click.option("--album", default="mediatool", show_default=True, help="Album to add the images to.")
+@click.option("--workers", default=4, show_default=True, help="Number of concurrent uploads.")
+@click.option("--sync", "sync_mode", is_flag=True, help="Upload every image and video not uploaded yet, newest first.")
+@click.option("--budget-mb-per-hour", type=float, help="With --sync, the most MiB to upload per hour.")
+@click.option("--max-files", type=int, help="With --sync, the most files to upload.")
+@click.option("--since", type=click.DateTime(), help="Only pick random images taken on or after this date.")
+@click.option("--until", type=click.DateTime(), help="Only pick random images taken before this date.")
+@click.option("--max-size-mb", type=float, help="Only pick random images of at most this many MiB.")
+def main(count, album, workers, sync_mode, budget_mb_per_hour, max_files, since, until, max_size_mb):
     _, DBFILE = load_config("mediatool.ini")
-    engine = create_engine(f"sqlite+pysqlite:///{DBFILE}", echo=False)
+    engine = get_engine(DBFILE)
     Base.metadata.create_all(engine)
 
-    with Session(engine) as sql_session:
-        images = get_random_images(sql_session, 5)
-
     auth_file = Path(".authtoken")
     google_session = get_authorized_session(auth_file)
 
-    upload_photos(google_session, images, "mediatool")
+    with Session(engine) as sql_session:
+        remote_album = get_album(sql_session, google_session, album)
+        if remote_album is None:
+            return
+
+        if sync_mode:
+            budget = ByteBudget(int(budget_mb_per_hour * 1024 * 1024)) if budget_mb_per_hour else None
+            uploaded = sync(sql_session, google_session, remote_album, budget, workers, max_files)
+            logger.info(f"Uploaded {uploaded} files.")
+            return
+
+        refresh_album_items(sql_session, google_session, remote_album)
+        uploaded = album_filenames(sql_session, remote_album)
+
+        max_size = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        images = sample_images(sql_session, count, since=since, until=until, max_size=max_size, not_uploaded=True)
+        files = [(image.name, image.sha256) for image in images if Path(image.name).name not in uploaded]
+        upload_files(sql_session, google_session, files, remote_album, workers)
 
 
 if __name__ == "__main__":
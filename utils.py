@@ -2,17 +2,22 @@ import enum
 import hashlib
 import itertools
 import logging
+import os
 import re
 import sys
 from configparser import ConfigParser
 from datetime import datetime
-from mimetypes import guess_type
+from functools import lru_cache
+from mimetypes import encodings_map, guess_type, suffix_map
 from pathlib import Path, PosixPath
-from typing import List
+from typing import List, NamedTuple
 
 from PIL import Image, UnidentifiedImageError
 from PIL.ExifTags import Base as ExifBase
 
+from exif_header import ExifHeaderError, read_exif_datestring
+from hashing import DEFAULT_ALGORITHM, hash_file, hash_stream
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARN)
 
@@ -30,42 +35,151 @@ class MediaType(enum.Enum):
     unknown = 3
 
 
+# Leading bytes of the image and video formats recognized by sniff_media_type.
+MEDIA_SIGNATURES = [
+    (b"\xff\xd8\xff", MediaType.image),  # JPEG
+    (b"\x89PNG\r\n\x1a\n", MediaType.image),
+    (b"GIF87a", MediaType.image),
+    (b"GIF89a", MediaType.image),
+    (b"II*\x00", MediaType.image),  # TIFF and the raw formats built on it
+    (b"MM\x00*", MediaType.image),
+    (b"\x1aE\xdf\xa3", MediaType.video),  # Matroska and WebM
+    (b"0&\xb2u\x8ef\xcf\x11", MediaType.video),  # ASF/WMV
+    (b"FLV", MediaType.video),
+    (b"\x00\x00\x01\xba", MediaType.video),  # MPEG program stream
+]
+RIFF_MEDIA_TYPES = {b"WEBP": MediaType.image, b"AVI ": MediaType.video}
+# ISO base media files (MP4, MOV, HEIC, ...) are videos unless their major brand is one of these still image brands.
+ISO_IMAGE_BRANDS = {b"heic", b"heix", b"heim", b"heis", b"mif1", b"msf1", b"avif"}
+ISO_AUDIO_BRANDS = {b"M4A ", b"M4B ", b"M4P "}
+SNIFF_SIZE = 16
+
+
+@lru_cache(maxsize=1024)
+def get_extension_media_type(extension: str) -> MediaType:
+    """Media type of a file extension, as guessed by mimetypes.guess_type. The result is cached per extension.
+
+    Args:
+        extension (str): The last one or two suffixes of a file name, e.g. '.jpg' or '.tar.gz'
+
+    Returns:
+        MediaType: The media type of files with this extension
+    """
+    guessed_type = guess_type(f"file{extension}")[0]
+    if guessed_type and guessed_type.startswith("image"):
+        return MediaType.image
+    elif guessed_type and guessed_type.startswith("video"):
+        return MediaType.video
+    else:
+        return MediaType.unknown
+
+
+def get_file_extension(filename: Path) -> str:
+    """The part of a file name that mimetypes.guess_type looks at.
+
+    This is the suffix as split by os.path.splitext, or the last two when the last one is an encoding such as '.gz'.
+    """
+    name = os.fspath(filename)
+    name = name[name.rfind("/") + 1 :]
+    dot = name.rfind(".")
+    # Like splitext, leading dots of hidden files do not start a suffix.
+    if dot <= 0 or not name[:dot].lstrip("."):
+        return ""
+    extension = name[dot:]
+    if extension in encodings_map or extension.lower() in suffix_map:
+        return os.path.splitext(name[:dot])[1] + extension
+    return extension
+
+
 def is_media(filename: Path):
-    guessed_type = guess_type(filename)[0]
-    return True if guessed_type and guessed_type.startswith(("image", "video")) else False
+    return get_extension_media_type(get_file_extension(filename)) in (MediaType.image, MediaType.video)
 
 
 def is_image(filename: Path):
-    guessed_type = guess_type(filename)[0]
-    return True if guessed_type and guessed_type.startswith("image") else False
+    return get_extension_media_type(get_file_extension(filename)) == MediaType.image
 
 
 def is_video(filename: Path):
-    guessed_type = guess_type(filename)[0]
-    return True if guessed_type and guessed_type.startswith("video") else False
+    return get_extension_media_type(get_file_extension(filename)) == MediaType.video
 
 
-def get_media_type(filename: Path):
-    if is_image(filename):
-        return MediaType.image
-    elif is_video(filename):
-        return MediaType.video
-    else:
-        return MediaType.unknown
+def get_media_type(filename: Path, sniff: bool = False):
+    """Media type of a file
+
+    Args:
+        filename (Path): The path of the file
+        sniff (bool, optional): Recognize the type from the first bytes of the file, falling back to the extension
+            if they are not recognized. This catches misnamed files but reads from disk. Defaults to False.
+
+    Returns:
+        MediaType: The media type of the file
+    """
+    if sniff:
+        with open(filename, "rb") as f:
+            sniffed_type = sniff_media_type(f.read(SNIFF_SIZE))
+        if sniffed_type != MediaType.unknown:
+            return sniffed_type
+    return get_extension_media_type(get_file_extension(filename))
+
+
+def sniff_media_type(header: bytes) -> MediaType:
+    """Recognize image and video formats from the first bytes of a file.
+
+    Args:
+        header (bytes): At least the first SNIFF_SIZE bytes of the file
+
+    Returns:
+        MediaType: The media type, or MediaType.unknown if the format is not recognized
+    """
+    for signature, media_type in MEDIA_SIGNATURES:
+        if header.startswith(signature):
+            return media_type
+    if header.startswith(b"RIFF"):
+        return RIFF_MEDIA_TYPES.get(header[8:12], MediaType.unknown)
+    if header[4:8] == b"ftyp":
+        brand = header[8:12]
+        if brand in ISO_IMAGE_BRANDS:
+            return MediaType.image
+        return MediaType.unknown if brand in ISO_AUDIO_BRANDS else MediaType.video
+    return MediaType.unknown
 
 
 def get_sha256(filename):
-    print(f"Getting sha256 of {filename}")
+    return hash_file(filename, "sha256")
+
+
+def get_partial_hash(filename, sample_size: int = 65536) -> str:
+    """Cheap hash of the head and tail of a file.
+
+    Files with different partial hashes can not be duplicates, so only files whose size and partial hash collide
+    need a full checksum.
+
+    Args:
+        filename: The path of the file
+        sample_size (int, optional): Number of bytes read from each end of the file. Defaults to 65536.
+
+    Returns:
+        str: The hex digest of the file size, head and tail
+    """
     with open(filename, "rb") as f:
-        file_hash = hashlib.sha256()
-        chunk = f.read(8192)
-        while chunk:
-            file_hash.update(chunk)
-            chunk = f.read(8192)
+        size = os.fstat(f.fileno()).st_size
+        file_hash = hashlib.sha256(str(size).encode())
+        file_hash.update(f.read(sample_size))
+        if size > sample_size:
+            f.seek(max(sample_size, size - sample_size))
+            file_hash.update(f.read(sample_size))
 
     return file_hash.hexdigest()
 
 
+# Date separated by either hyphens or colons, but not a mix of both, optionally followed by up to 6 decimals.
+DATESTRING_PATTERN = re.compile(
+    r"([0-9]{4})([-:])([0-9]{2})\2([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})(?:\.([0-9]{0,6}))?\Z"
+)
+
+
+# Bursts of photos share their timestamps, so recently converted ones are cached.
+@lru_cache(maxsize=4096)
 def datestring_to_date(datestring: str):
     """Convert a string seeming to contain a timestamp into a datetime object.
 
@@ -77,30 +191,18 @@ def datestring_to_date(datestring: str):
         datestring (str): A timestamp-like value
     """
 
-    logger.debug(f"Original datetime is {datestring}")
-
     if datestring == "" or "0000" in datestring:
         return None
 
-    PATTERNS = [
-        {"regex": r"([0-9]{4})-([0-9]{2})-([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})$", "format": "%Y-%m-%d %H:%M:%S"},
-        {"regex": r"([0-9]{4}):([0-9]{2}):([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})$", "format": "%Y:%m:%d %H:%M:%S"},
-        {
-            "regex": r"([0-9]{4})-([0-9]{2})-([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})\.([0-9]{0,6})$",
-            "format": "%Y-%m-%d %H:%M:%S.%f",
-        },
-        {
-            "regex": r"([0-9]{4}):([0-9]{2}):([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})\.([0-9]{0,6})$",
-            "format": "%Y:%m:%d %H:%M:%S.%f",
-        },
-    ]
-
-    for pattern in PATTERNS:
-        if re.match(pattern["regex"], datestring):
-            date_obj = datetime.strptime(datestring, pattern["format"])
-            return date_obj
+    match = DATESTRING_PATTERN.match(datestring)
+    if not match:
+        raise ValueError(f"Unknown datetime format for {datestring}")
 
-    raise ValueError(f"Unknown datetime format for {datestring}")
+    year, _, month, day, hour, minute, second, fraction = match.groups()
+    if fraction == "":
+        raise ValueError(f"Missing microseconds in {datestring}")
+    microsecond = int(fraction.ljust(6, "0")) if fraction else 0
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond)
 
 
 def get_datestamp(image_path: Path):
@@ -110,10 +212,35 @@ def get_datestamp(image_path: Path):
         return None
 
     try:
-        with open(image_path, "rb") as image_file:
-            logger.debug(f"Opening image {image_path}")
-            exif = Image.open(image_file).getexif()
-            # logger.debug("Opened")
+        image_file = open(image_path, "rb")
+    except Exception as e:
+        logger.error(f"Unknown exception: {e} while opening {image_path}")
+        return None
+
+    with image_file:
+        return read_datestamp(image_file, image_path)
+
+
+def read_datestamp(image_file, image_path: Path):
+    """Read the EXIF datestamp of an open JPEG or PNG file.
+
+    The EXIF block is located from the file header, and Pillow is only used for files whose header can not be read
+    that way.
+
+    Args:
+        image_file: The image, opened in binary mode
+        image_path (Path): The path of the image, for logging
+
+    Returns:
+        datetime: The datestamp, or None if the image has none or can not be read.
+    """
+    try:
+        try:
+            datestring = read_exif_datestring(image_file)
+        except ExifHeaderError as e:
+            logger.debug(f"Falling back to Pillow for {image_path}: {e}")
+            image_file.seek(0)
+            datestring = read_datestring_with_pillow(image_file, image_path)
     except UnidentifiedImageError:
         logger.warning(f"UnidentifiedImageError while opening {image_path}")
         return None
@@ -121,17 +248,70 @@ def get_datestamp(image_path: Path):
         logger.error(f"Unknown exception: {e} while opening {image_path}")
         return None
 
+    if not datestring:
+        return None
+
+    return datestring_to_date(datestring)
+
+
+def read_datestring_with_pillow(image_file, image_path: Path):
+    logger.debug(f"Opening image {image_path}")
+    exif = Image.open(image_file).getexif()
+
     if not exif:
         return None
 
     if ExifBase.DateTimeOriginal in exif.keys():
-        date_obj = datestring_to_date(exif[ExifBase.DateTimeOriginal])
+        return exif[ExifBase.DateTimeOriginal]
     elif ExifBase.DateTime in exif.keys():
-        date_obj = datestring_to_date(exif[ExifBase.DateTime])
+        return exif[ExifBase.DateTime]
     else:
         return None
 
-    return date_obj
+
+class FileProbe(NamedTuple):
+    filetype: MediaType
+    size: int
+    digest: str | None
+    datestamp: datetime | None
+    stat: os.stat_result
+
+
+def probe_file(
+    filename, hash_algorithm: str = DEFAULT_ALGORITHM, compute_hash: bool = True, sniff: bool = False
+) -> FileProbe:
+    """Gather the type, size, checksum and datestamp of a file from a single open file handle.
+
+    The EXIF header is read first and the checksum then reads the whole file, so each file is read once.
+
+    Args:
+        filename: The path of the file
+        hash_algorithm (str, optional): The algorithm of the checksum. Defaults to DEFAULT_ALGORITHM.
+        compute_hash (bool, optional): Whether to compute the checksum at all. Defaults to True.
+        sniff (bool, optional): Recognize the media type from the content of the file, see get_media_type.
+            Defaults to False.
+
+    Returns:
+        FileProbe: The media type, size, checksum (None unless computed), datestamp and stat result of the file
+    """
+    filetype = get_extension_media_type(get_file_extension(filename))
+    has_exif = filetype == MediaType.image and guess_type(filename)[0].endswith(("jpeg", "png"))
+    datestamp = None
+    with open(filename, "rb") as f:
+        stat_result = os.fstat(f.fileno())
+        if sniff:
+            header = f.read(SNIFF_SIZE)
+            sniffed_type = sniff_media_type(header)
+            if sniffed_type != MediaType.unknown:
+                filetype = sniffed_type
+                has_exif = header.startswith((b"\xff\xd8\xff", b"\x89PNG"))
+            f.seek(0)
+        if has_exif:
+            datestamp = read_datestamp(f, filename)
+            f.seek(0)
+        digest = hash_stream(f, hash_algorithm) if compute_hash else None
+
+    return FileProbe(filetype, stat_result.st_size, digest, datestamp, stat_result)
 
 
 def datestamp_to_filename_stem(date_obj: datetime) -> str:
@@ -158,18 +338,21 @@ def datestamp_to_folder(date_obj: datetime) -> str:
     return date_obj.strftime("%Y/%m/%d")
 
 
-def get_recommended_filename(image_path: Path, date_folders: bool = False, root_dir: Path = None) -> Path:
+def get_recommended_filename(
+    image_path: Path, date_folders: bool = False, root_dir: Path = None, datestamp: datetime = None
+) -> Path:
     """Provide a recommended filename for an image.
 
     Args:
         image_path (Path): The path of an image file
         date_folders (bool, optional): Whether to prefix the recommended filename with recommended folders. Defaults to False.
         root_dir (Path, optional): The path of a directory to use instead of the file's current directory. Defaults to None.
+        datestamp (datetime, optional): The datestamp of the image, e.g. the one stored in the catalog. Defaults to None, reading it from the image.
 
     Returns:
         Path: The complete path to the recommended filename
     """
-    image_type = guess_type(image_path)[0]
+    image_type = guess_type(image_path)[0] or ""
     if image_type.endswith("jpeg"):
         new_extension = "jpg"
     elif image_type.endswith("png"):
@@ -177,7 +360,7 @@ def get_recommended_filename(image_path: Path, date_folders: bool = False, root_
     else:
         return None
 
-    datestamp_from_image = get_datestamp(image_path)
+    datestamp_from_image = datestamp if datestamp else get_datestamp(image_path)
     if not datestamp_from_image:
         return None
 
@@ -205,10 +388,13 @@ def load_config(config_file, force_previous_database=True):
         logger.error(f"Unable to load configuration from {config_file}. {e}")
         sys.exit(1)
 
-    DATA_DIR = Path(config.get("mediatool", "data_dir"))
-    if not DATA_DIR.is_dir():
-        logger.error(f"{DATA_DIR} is not a valid directory.")
-        sys.exit(1)
+    # data_dir is optional when the roots are configured in [root:<name>] sections, see roots.load_roots.
+    DATA_DIR = config.get("mediatool", "data_dir", fallback=None)
+    if DATA_DIR is not None:
+        DATA_DIR = Path(DATA_DIR)
+        if not DATA_DIR.is_dir():
+            logger.error(f"{DATA_DIR} is not a valid directory.")
+            sys.exit(1)
 
     DBFILE = Path(config.get("mediatool", "db_file"))
     if force_previous_database and not DBFILE.is_file():
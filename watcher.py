@@ -0,0 +1,367 @@
+"""Keep the catalog up to date by watching the roots for changes, instead of walking them again.
+
+Files created, modified, deleted or moved under the roots are catalogued a few seconds after the changes stop, so a
+burst like the import of a camera card is written in one go. Changed files are planned like an incremental scan
+does, so only files whose stat signature changed are hashed, and moved files and directories keep their rows.
+
+Changes are reported by inotify through the optional watchdog package. Network mounts do not report changes made by
+other hosts, so roots with poll = yes in mediatool.ini, or all of them with --poll, are compared with a snapshot of
+their files instead, every --poll-interval seconds.
+"""
+
+import logging
+import os
+import threading
+import time
+from functools import partial
+from typing import NamedTuple
+
+import click
+from more_itertools import chunked
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from catalog import (
+    EXISTING_FILE_COLUMNS,
+    ScanTarget,
+    configured_roots,
+    fill_database,
+    inspect_file,
+    inspect_in_pool,
+    plan_file,
+    write_results,
+)
+from db_utils import (
+    delete_directory_db,
+    delete_files_db,
+    get_engine,
+    move_directory_db,
+    move_files_db,
+)
+from hashing import DEFAULT_ALGORITHM, available_algorithms
+from logging_setup import logging_setup
+from models import Base, File
+from roots import (
+    RootConfig,
+    destination_roots,
+    innermost_roots,
+    locate_name,
+    names_criteria,
+    sync_roots,
+)
+from utils import load_config
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.observers.polling import PollingObserver
+except ImportError:
+    Observer = PollingObserver = None
+
+logging_setup()
+logger = logging.getLogger(__name__)
+
+# Seconds without a change before the changes are catalogued.
+DEFAULT_DEBOUNCE = 2.0
+# Seconds after the first change at which changes are catalogued even if more keep coming.
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_POLL_INTERVAL = 30.0
+# Seconds between checks of the stop event while nothing changes.
+IDLE_WAIT = 1.0
+
+
+class Changes(NamedTuple):
+    """The changes of a burst, reduced to what the catalog needs to do about them."""
+
+    # Files created or modified since they were last catalogued.
+    changed: set[str]
+    deleted: set[str]
+    # Tuples of (source, target, is_directory) in the order they were moved.
+    moves: list[tuple[str, str, bool]]
+    # Directories whose files were created without an event of their own, like a directory moved in from elsewhere.
+    created_directories: set[str]
+    deleted_directories: set[str]
+
+
+def no_changes() -> Changes:
+    return Changes(set(), set(), [], set(), set())
+
+
+def implied_move(move: tuple[str, str, bool], directory_move: tuple[str, str, bool]) -> bool:
+    """Whether a move is part of moving a directory, like the moves watchdog reports for its contents."""
+    source, target, _ = move
+    directory_source, directory_target, is_directory = directory_move
+    prefix = os.path.join(directory_source, "")
+    return (
+        is_directory
+        and source.startswith(prefix)
+        and target == os.path.join(directory_target, source.removeprefix(prefix))
+    )
+
+
+class ChangeCollector:
+    """Collect the events of watchdog observers and hand them out once they stop coming.
+
+    The observers call dispatch on their own threads.
+
+    Args:
+        debounce (float, optional): Seconds without an event before the changes are handed out. Defaults to
+            DEFAULT_DEBOUNCE.
+        max_delay (float, optional): Seconds after the first event at which the changes are handed out even if
+            events keep coming. Defaults to DEFAULT_MAX_DELAY.
+    """
+
+    def __init__(self, debounce: float = DEFAULT_DEBOUNCE, max_delay: float = DEFAULT_MAX_DELAY):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        self.changes = no_changes()
+        self.first_event = self.last_event = None
+
+    def dispatch(self, event):
+        """Record a watchdog event."""
+        path = os.fsdecode(event.src_path)
+        with self.condition:
+            changes = self.changes
+            if event.event_type == "moved":
+                target = os.fsdecode(event.dest_path)
+                move = (path, target, event.is_directory)
+                # The contents of a moved directory are reported as moved too, before or after it.
+                if any(implied_move(move, earlier) for earlier in changes.moves):
+                    return
+                changes.moves[:] = [earlier for earlier in changes.moves if not implied_move(earlier, move)]
+                changes.moves.append(move)
+                changes.deleted.discard(target)
+                if path in changes.changed:
+                    # Not catalogued yet, like a file written under a temporary name.
+                    changes.changed.discard(path)
+                    changes.changed.add(target)
+            elif event.event_type == "deleted":
+                (changes.deleted_directories if event.is_directory else changes.deleted).add(path)
+                changes.changed.discard(path)
+            elif event.event_type == "created" and event.is_directory:
+                changes.created_directories.add(path)
+            elif event.event_type in ("created", "modified", "closed") and not event.is_directory:
+                changes.changed.add(path)
+                changes.deleted.discard(path)
+            else:
+                return
+            self.last_event = time.monotonic()
+            if self.first_event is None:
+                self.first_event = self.last_event
+            self.condition.notify()
+
+    def wait(self, stop: threading.Event) -> Changes | None:
+        """Wait for changes until debounce seconds pass without an event.
+
+        Args:
+            stop (threading.Event): Stops waiting. The changes collected so far are still handed out.
+
+        Returns:
+            Changes | None: The changes, or None once stopped without any
+        """
+        with self.condition:
+            while True:
+                if self.first_event is None:
+                    if stop.is_set():
+                        return None
+                    self.condition.wait(IDLE_WAIT)
+                    continue
+                due = min(self.last_event + self.debounce, self.first_event + self.max_delay)
+                if stop.is_set() or time.monotonic() >= due:
+                    changes, self.changes = self.changes, no_changes()
+                    self.first_event = self.last_event = None
+                    return changes
+                self.condition.wait(due - time.monotonic())
+
+
+def walk_files(directory: str) -> list[str]:
+    return [os.path.join(root, file) for root, _, files in os.walk(directory) for file in files]
+
+
+def record_files(
+    session: Session,
+    names,
+    inspect=inspect_file,
+    workers=0,
+    batch_size=500,
+    hash_algorithm=DEFAULT_ALGORITHM,
+    sniff=False,
+):
+    """Catalog changed files like an incremental scan of their roots would.
+
+    Files which are not images, are under no root or do not exist anymore are left out.
+
+    Args:
+        session (Session): The database session
+        names (Iterable[str]): Absolute file names
+        inspect (Callable, optional): inspect_file or a partial of it binding the scan options. Defaults to
+            inspect_file.
+        workers (int, optional): Number of threads inspecting the files. 0 inspects them serially. Defaults to 0.
+        batch_size (int, optional): How many files to plan and write at a time. Defaults to 500.
+        hash_algorithm (str, optional): The algorithm of the checksums. Defaults to DEFAULT_ALGORITHM.
+        sniff (bool, optional): Also catalog images whose extension does not say so. Defaults to False.
+    """
+    roots = destination_roots(innermost_roots(session))
+    targets = {root.id: ScanTarget(root.id, root.name, root.path, workers, {}, None) for root in roots}
+    for batch in chunked(sorted(names), batch_size):
+        existing_rows = session.execute(select(File.name, *EXISTING_FILE_COLUMNS).where(names_criteria(session, batch)))
+        existing_rows = {row.name: row for row in existing_rows}
+        work, root_ids = [], {}
+        for name in batch:
+            located = locate_name(roots, name)
+            if located is None or not os.path.isfile(name):
+                continue
+            planned = plan_file(name, existing_rows.get(name), True, hash_algorithm, sniff)
+            if planned is not None:
+                work.append(planned)
+                root_ids[name] = located[0]
+        results = inspect_in_pool(work, inspect, workers)
+        write_results(
+            session, ((targets[root_ids[name]], name, row, values) for name, row, values in results), batch_size
+        )
+
+
+def apply_changes(session: Session, changes: Changes, **options) -> None:
+    """Bring the catalog up to date with the changes of a burst.
+
+    Moved files and directories keep their rows and checksums. Files moved in from outside of the watched roots, or
+    before they were catalogued, are catalogued like created ones.
+
+    Args:
+        session (Session): The database session
+        changes (Changes): The changes
+        options: The options of record_files
+    """
+    changed = set(changes.changed)
+    for source, target, is_directory in changes.moves:
+        if is_directory:
+            moved = move_directory_db(session, source, target)
+            logger.info(f"Moved {moved} directories from {source} to {target}")
+            # Files moved in from outside of the catalog are new.
+            changed.update(walk_files(target))
+        elif move_files_db(session, [(source, target)]):
+            logger.info(f"Moved {source} to {target}")
+        else:
+            changed.add(target)
+    for directory in changes.deleted_directories:
+        logger.info(f"Deleted {delete_directory_db(session, directory)} files under {directory}")
+    deleted = delete_files_db(session, sorted(changes.deleted))
+    session.commit()
+    if deleted:
+        logger.info(f"Deleted {deleted} files")
+
+    for directory in changes.created_directories:
+        changed.update(walk_files(directory))
+    record_files(session, changed, **options)
+
+
+def watch(
+    session: Session,
+    roots: list[RootConfig],
+    poll: bool = False,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    debounce: float = DEFAULT_DEBOUNCE,
+    max_delay: float = DEFAULT_MAX_DELAY,
+    workers: int = 0,
+    hash_algorithm: str = DEFAULT_ALGORITHM,
+    sniff: bool = False,
+    stop: threading.Event | None = None,
+) -> None:
+    """Catalog the changes under roots until stopped.
+
+    Args:
+        session (Session): The database session
+        roots (list[RootConfig]): The roots, see roots.load_roots
+        poll (bool, optional): Poll every root, and not only those configured to be polled. Defaults to False.
+        poll_interval (float, optional): Seconds between two snapshots of a polled root. Defaults to
+            DEFAULT_POLL_INTERVAL.
+        debounce (float, optional): Seconds without a change before changes are catalogued. Defaults to
+            DEFAULT_DEBOUNCE.
+        max_delay (float, optional): Seconds after a change at which it is catalogued even if more changes keep
+            coming. Defaults to DEFAULT_MAX_DELAY.
+        workers (int, optional): Number of threads inspecting files. 0 inspects them serially. Defaults to 0.
+        hash_algorithm (str, optional): The algorithm of the checksums. Defaults to DEFAULT_ALGORITHM.
+        sniff (bool, optional): Also catalog images whose extension does not say so. Defaults to False.
+        stop (threading.Event, optional): Stops watching once set. Defaults to watching until interrupted.
+    """
+    if Observer is None:
+        raise click.UsageError("Watching the roots needs the optional watchdog package.")
+    stop = stop or threading.Event()
+    collector = ChangeCollector(debounce, max_delay)
+    observers = {}
+    for config, root in zip(roots, sync_roots(session, roots)):
+        polled = poll or config.poll
+        if polled not in observers:
+            observers[polled] = PollingObserver(timeout=poll_interval) if polled else Observer()
+        observers[polled].schedule(collector, root.path, recursive=True)
+        logger.info(f"Watching {root.name} at {root.path}{' by polling' if polled else ''}")
+
+    inspect = partial(inspect_file, hash_algorithm=hash_algorithm, sniff=sniff)
+    options = {"inspect": inspect, "workers": workers, "hash_algorithm": hash_algorithm, "sniff": sniff}
+    for observer in observers.values():
+        observer.start()
+    try:
+        while (changes := collector.wait(stop)) is not None:
+            try:
+                apply_changes(session, changes, **options)
+            except (OSError, ValueError, SQLAlchemyError) as error:
+                # Most likely a file removed while it was inspected, whose deletion comes with the next changes, a
+                # file which could not be read or a database locked by a scan. Keep watching, the next --scan
+                # catches up with changes lost this way.
+                logger.error(f"Could not catalog the changes: {error}")
+                session.rollback()
+    finally:
+        for observer in observers.values():
+            observer.stop()
+        for observer in observers.values():
+            observer.join()
+
+
+@click.command()
+@click.option(
+    "--root",
+    "root_names",
+    multiple=True,
+    help="Only watch the configured root of this name. Can be repeated. Defaults to every root.",
+)
+@click.option("--poll", is_flag=True, help="Poll every root for changes, not only the roots configured with poll.")
+@click.option(
+    "--poll-interval", default=DEFAULT_POLL_INTERVAL, show_default=True, help="Seconds between polls of a root."
+)
+@click.option(
+    "--debounce", default=DEFAULT_DEBOUNCE, show_default=True, help="Seconds without changes before cataloguing them."
+)
+@click.option(
+    "--max-delay",
+    default=DEFAULT_MAX_DELAY,
+    show_default=True,
+    help="Seconds after a change at which it is catalogued even if more changes keep coming.",
+)
+@click.option("--scan", is_flag=True, help="Catch up with an incremental scan of the roots before watching them.")
+@click.option("--workers", default=os.cpu_count(), show_default=True, help="Number of threads inspecting files.")
+@click.option(
+    "--hash-algorithm",
+    type=click.Choice(available_algorithms()),
+    default=DEFAULT_ALGORITHM,
+    show_default=True,
+    help="Algorithm of the file checksums.",
+)
+@click.option("--sniff", is_flag=True, help="Also catalog images with a misleading extension, recognized by content.")
+def main(root_names, poll, poll_interval, debounce, max_delay, scan, workers, hash_algorithm, sniff):
+    _, DBFILE = load_config("mediatool.ini", force_previous_database=False)
+    roots = configured_roots("mediatool.ini", root_names)
+    engine = get_engine(DBFILE)
+    Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        if scan:
+            fill_database(session, roots, incremental=True, workers=workers, hash_algorithm=hash_algorithm, sniff=sniff)
+        try:
+            watch(session, roots, poll, poll_interval, debounce, max_delay, workers, hash_algorithm, sniff)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching.")
+
+
+if __name__ == "__main__":
+    main()